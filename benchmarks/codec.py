@@ -0,0 +1,87 @@
+"""
+Per-stage cost of turning json-file lines into sink payloads.
+
+    python3 -m benchmarks.codec --lines 200000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from logsql import codec
+from logsql.logpath import LogPath
+from logsql.transform import transform
+
+
+def _write_log(path, count):
+    line = codec.StdlibCodec().dumps({
+        "log": 'GET /index.html HTTP/1.1 200 612 "-" "curl/7.58.0"\n',
+        "stream": "stdout",
+        "time": "2019-08-17T23:18:39.123456789Z",
+    })
+    with open(path, "w") as filp:
+        for _ in range(count):
+            print(line, file=filp)
+
+
+def _read(path):
+    offsetfile = path + ".offsetfile"
+    if os.path.exists(offsetfile):
+        os.remove(offsetfile)
+    log_path = LogPath(path)
+    lines = log_path.readlines(raw=True)
+    log_path.close()
+    return lines
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(count):
+    """ Time read, decode, transform and encode for every codec """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench-json.log")
+        _write_log(path, count)
+        lines, read = _timed(_read, path)
+
+    print("{:<10} {:>12} {:>12} {:>12} {:>12}".format(
+        "codec", "decode", "transform", "encode", "lines/sec"
+    ))
+    for name in codec.available():
+        instance = codec.get_codec(name)
+        records, decode = _timed(instance.decode_batch, lines)
+        records, transformed = _timed(
+            lambda records: [transform("/bench", data) for data in records],
+            records
+        )
+        _, encode = _timed(instance.encode_batch, records)
+        total = read + decode + transformed + encode
+        print("{:<10} {:>11.3f}s {:>11.3f}s {:>11.3f}s {:>12,.0f}".format(
+            name, decode, transformed, encode, count / total
+        ))
+
+    # identity transform: the raw lines are the payloads
+    _, passthrough = _timed(
+        lambda lines: [str(line, "utf-8") for line in lines], lines
+    )
+    print("{:<10} {:>12} {:>12} {:>11.3f}s {:>12,.0f}".format(
+        "identity", "-", "-", passthrough, count / (read + passthrough)
+    ))
+    print("read: {:.3f}s".format(read))
+
+
+def main(argv=None):
+    """ Command line entrypoint """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    args = parser.parse_args(argv)
+    run(args.lines)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
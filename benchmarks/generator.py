@@ -0,0 +1,216 @@
+"""
+Synthetic docker json-file logs.
+
+    python3 -m benchmarks.generator /tmp/bench --lines 1000000 \
+        --line-size 200 --rotate-size 10000000 --partial
+
+Writes <directory>/<container id>/<container id>-json.log like docker's
+json-file driver: one JSON document per line with log, stream and time,
+rotated to -json.log.1, .2, ... when it reaches rotate_size.  A mix of
+nginx access lines and free text, padded to about line_size bytes.
+
+Next to the logs, config.v2.json describes the container as running, so
+that the directory can stand in for /var/lib/docker/containers with
+LOGSQL_DISCOVERY=directory.
+"""
+import os
+import sys
+import json
+import random
+import string
+import datetime
+import argparse
+import typing
+
+START = datetime.datetime(2020, 3, 1, tzinfo=datetime.timezone.utc)
+CONTAINER_ID = "b" * 64
+
+NGINX_FORMAT = '{} - - [{}] "{} {} HTTP/1.1" {} {} "-" "{}"'
+METHODS = ("GET", "GET", "GET", "POST", "PUT")
+STATUSES = (200, 200, 200, 301, 404, 500)
+AGENTS = ("curl/7.58.0", "Mozilla/5.0 (X11; Linux x86_64)", "kube-probe/1.18")
+
+
+class Generator:
+    """ Produces json-file lines.
+
+    rate is the number of lines per second of docker time, line_size the
+    average length of the log message with up to jitter of it added or
+    removed.
+    """
+
+    def __init__(
+            self,
+            line_size: int = 120,
+            jitter: float = 0.5,
+            rate: float = 1000.0,
+            nginx_ratio: float = 0.5,
+            stderr_ratio: float = 0.1,
+            seed: int = 0,
+    ):
+        self.line_size = line_size
+        self.jitter = jitter
+        self.rate = rate
+        self.nginx_ratio = nginx_ratio
+        self.stderr_ratio = stderr_ratio
+        self.random = random.Random(seed)
+        # random text is costly, pad from a pool instead
+        self.filler = "".join(
+            self.random.choice(string.ascii_letters + " ")
+            for _ in range(4096)
+        )
+        self.count = 0
+
+    def _size(self) -> int:
+        spread = int(self.line_size * self.jitter)
+        return max(1, self.line_size + self.random.randint(-spread, spread))
+
+    def _nginx(self, moment: datetime.datetime) -> str:
+        return NGINX_FORMAT.format(
+            "10.0.{}.{}".format(
+                self.random.randint(0, 255), self.random.randint(1, 254)
+            ),
+            moment.strftime("%d/%b/%Y:%H:%M:%S +0000"),
+            self.random.choice(METHODS),
+            "/api/v1/items/{}".format(self.random.randint(1, 100000)),
+            self.random.choice(STATUSES),
+            self.random.randint(0, 100000),
+            self.random.choice(AGENTS),
+        )
+
+    def message(self, moment: datetime.datetime) -> str:
+        """ A log message of about line_size characters """
+        size = self._size()
+        if self.random.random() < self.nginx_ratio:
+            message = self._nginx(moment)
+        else:
+            message = "INFO request handled"
+        if len(message) < size:
+            offset = self.random.randint(0, len(self.filler) - 1)
+            padding = (self.filler * 2)[offset:offset + size - len(message)]
+            message += " " + padding
+        return message
+
+    def line(self) -> bytes:
+        """ The next json-file line, without the newline """
+        moment = START + datetime.timedelta(seconds=self.count / self.rate)
+        self.count += 1
+        return json.dumps({
+            "log": self.message(moment) + "\n",
+            "stream": "stderr"
+            if self.random.random() < self.stderr_ratio else "stdout",
+            "time": moment.strftime("%Y-%m-%dT%H:%M:%S.%f") + "000Z",
+        }).encode("utf-8")
+
+
+def log_path(directory: str, container_id: str = CONTAINER_ID) -> str:
+    """ The path of the live log file of the container """
+    return os.path.join(
+        directory, container_id, container_id + "-json.log"
+    )
+
+
+def write_config(
+        directory: str,
+        container_id: str = CONTAINER_ID,
+        name: str = "bench",
+) -> str:
+    """ Write the config.v2.json of a running container, returns its path """
+    path = os.path.join(directory, container_id, "config.v2.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as filp:
+        json.dump({
+            "ID": container_id,
+            "Name": "/" + name,
+            "LogPath": log_path(directory, container_id),
+            "Created": START.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "State": {
+                "Running": True,
+                "StartedAt": START.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "FinishedAt": "0001-01-01T00:00:00Z",
+            },
+            "Config": {"Image": "bench", "Labels": {}},
+        }, filp)
+    return path
+
+
+def _rotate(path: str, max_files: int) -> None:
+    """ Rotate like docker: path.1 is the newest rotated file """
+    for index in range(max_files - 1, 0, -1):
+        source = path if index == 1 else "{}.{}".format(path, index - 1)
+        if os.path.exists(source):
+            os.replace(source, "{}.{}".format(path, index))
+    if max_files <= 1 and os.path.exists(path):
+        os.remove(path)
+
+
+def generate(
+        directory: str,
+        lines: int,
+        generator: Generator = None,
+        container_id: str = CONTAINER_ID,
+        rotate_size: int = 0,
+        max_files: int = 5,
+        partial: bool = False,
+) -> typing.List[str]:
+    """ Write lines to the container's log, rotating it every rotate_size
+    bytes and keeping max_files files.  With partial, the live file ends
+    in half a line.  Returns the files, oldest first.
+    """
+    generator = generator or Generator()
+    path = log_path(directory, container_id)
+    write_config(directory, container_id)
+
+    filp = open(path, "wb")
+    size = 0
+    for _ in range(lines):
+        line = generator.line() + b"\n"
+        if rotate_size and size + len(line) > rotate_size and size:
+            filp.close()
+            _rotate(path, max_files)
+            filp = open(path, "wb")
+            size = 0
+        filp.write(line)
+        size += len(line)
+    if partial:
+        line = generator.line()
+        filp.write(line[:len(line) // 2])
+    filp.close()
+
+    rotated = sorted(
+        (name for name in os.listdir(os.path.dirname(path))
+         if name.startswith(os.path.basename(path) + ".")),
+        key=lambda name: -int(name.rsplit(".", 1)[1])
+    )
+    return [os.path.join(os.path.dirname(path), name) for name in rotated] \
+        + [path]
+
+
+def main(argv=None):
+    """ Command line entrypoint """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--line-size", type=int, default=120)
+    parser.add_argument("--rate", type=float, default=1000.0)
+    parser.add_argument("--rotate-size", type=int, default=0)
+    parser.add_argument("--max-files", type=int, default=5)
+    parser.add_argument("--partial", action="store_true", default=False)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    files = generate(
+        args.directory, args.lines,
+        Generator(
+            line_size=args.line_size, rate=args.rate, seed=args.seed
+        ),
+        rotate_size=args.rotate_size,
+        max_files=args.max_files,
+        partial=args.partial,
+    )
+    for path in files:
+        print(path, os.path.getsize(path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Access log parsing throughput: utils.parse_nginx_combined line by line
+against the compiled parsers of the parsing module.
+
+    python3 -m benchmarks.parsing --lines 200000
+"""
+import sys
+import time
+import argparse
+
+from logsql import parsing, utils
+
+NGINX_LINE = "203.0.113.7 - - [17/Aug/2019:23:18:39 +0000] " \
+    '"GET /static/app.js?v=3 HTTP/1.1" 200 51234 ' \
+    '"https://example.com/" "Mozilla/5.0 (X11; Linux x86_64)"'
+LOGFMT_LINE = 'time=2019-08-17T23:18:39Z level=info msg="request done" ' \
+    "method=GET path=/static/app.js status=200 took=1.5ms"
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(count):
+    """ Time every parser over count lines """
+    nginx_lines = [NGINX_LINE] * count
+    cases = [
+        ("utils.parse_nginx_combined", nginx_lines, lambda lines: [
+            utils.parse_nginx_combined(line) for line in lines
+        ]),
+    ]
+    for spec in ("nginx_combined", "apache_combined"):
+        parser = parsing.compile_format(spec)
+        cases.append((spec + " parse", nginx_lines, lambda lines, p=parser: [
+            p.parse(line) for line in lines
+        ]))
+        cases.append((spec + " parse_many", nginx_lines, parser.parse_many))
+    cases.append((
+        "logfmt parse_many", [LOGFMT_LINE] * count,
+        parsing.compile_format("logfmt").parse_many
+    ))
+
+    print("{:<32} {:>10} {:>12}".format("parser", "time", "lines/sec"))
+    for name, lines, func in cases:
+        results, elapsed = _timed(func, lines)
+        assert all(results), name
+        print("{:<32} {:>9.3f}s {:>12,.0f}".format(
+            name, elapsed, count / elapsed
+        ))
+
+
+def main(argv=None):
+    """ Command line entrypoint """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    args = parser.parse_args(argv)
+    run(args.lines)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
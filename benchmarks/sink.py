@@ -0,0 +1,77 @@
+"""
+Compare the ORM insert path with the bulk sink.
+
+    python3 -m benchmarks.sink --url postgresql://localhost/logsql_bench
+"""
+import sys
+import json
+import time
+import argparse
+
+import sqlalchemy
+
+from logsql import models
+from logsql.sink import create_sink
+
+
+def _records(count):
+    return [
+        {
+            "log": 'line {} with a \\ and a "quote"\n'.format(i),
+            "stream": "stderr",
+            "time": "2019-08-17T23:18:39.123456789Z",
+        } for i in range(count)
+    ]
+
+
+def bench_orm(engine, records, batch_size):
+    """ The original client path: one ORM object per line """
+    session = models.Session(bind=engine)
+    container = models.Container(container_id="X" * 64, name="/bench")
+    for start in range(0, len(records), batch_size):
+        for data in records[start:start + batch_size]:
+            session.add(models.Log(container=container, json=data))
+        session.commit()
+    session.close()
+
+
+def bench_sink(engine, records, batch_size):
+    """ Bulk sink path: serialize once, one statement per batch """
+    sink = create_sink(engine)
+    for start in range(0, len(records), batch_size):
+        payloads = [json.dumps(data)
+                    for data in records[start:start + batch_size]]
+        with engine.begin() as connection:
+            sink.write(connection, "X" * 64, "/bench", payloads)
+
+
+def run(url, count, batch_size):
+    """ Run both paths on a freshly created logs table """
+    engine = sqlalchemy.create_engine(url)
+    records = _records(count)
+    results = {}
+    for name, func in (("orm", bench_orm), ("sink", bench_sink)):
+        models.BASE.metadata.drop_all(bind=engine)
+        models.BASE.metadata.create_all(bind=engine)
+        start = time.perf_counter()
+        func(engine, records, batch_size)
+        elapsed = time.perf_counter() - start
+        results[name] = count / elapsed
+        print("{:>6}: {:>12,.0f} lines/sec".format(name, results[name]))
+    print("speedup: {:.1f}x".format(results["sink"] / results["orm"]))
+    return results
+
+
+def main(argv=None):
+    """ Command line entrypoint """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="sqlite:////tmp/logsql_bench.db")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+    run(args.url, args.lines, args.batch_size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Offline benchmark suite, no docker daemon needed.
+
+    python3 -m benchmarks.suite --lines 200000 --output results.json
+    python3 -m benchmarks.suite --compare results.json --output new.json
+
+Generates json-file logs in a temporary directory (see
+benchmarks.generator), then runs every stage in a fresh process so that
+its peak RSS is its own:
+
+    read        LogPath.readlines() over the rotated and live files
+    decode      decoding the lines with the configured JSON codec
+    transform   the transform() hook on the decoded records
+    nginx       utils.parse_nginx_combined() on the log messages
+    ingest_*    read_batch() and the sink into SQLite (and PostgreSQL with
+                --postgresql-url, which should be a scratch database)
+
+Reports lines/sec, MB/sec (of json-file input) and peak RSS, and writes
+them to a JSON file that --compare reads back.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import argparse
+import resource
+import datetime
+import concurrent.futures
+import multiprocessing
+import typing
+
+from benchmarks import generator
+from logsql import client, db, migrations, utils
+from logsql.codec import get_codec
+from logsql.logpath import LogPath
+from logsql.sink import create_sink
+from logsql.transform import transform
+
+STAGES = ("read", "decode", "transform", "nginx", "ingest_sqlite")
+
+
+def _read_lines(files: typing.List[str]) -> typing.List[bytes]:
+    lines = []
+    for path in files:
+        log_path = LogPath(path)
+        lines.extend(bytes(line) for line in log_path.readlines(raw=True))
+        log_path.close()
+    return lines
+
+
+def stage_read(files, options):
+    """ LogPath read throughput """
+    # pylint: disable=unused-argument
+    count = 0
+    start = time.perf_counter()
+    for path in files:
+        log_path = LogPath(path)
+        while True:
+            lines = log_path.readlines(max_lines=10000, raw=True)
+            if not lines:
+                break
+            count += len(lines)
+        log_path.close()
+    return count, time.perf_counter() - start
+
+
+def stage_decode(files, options):
+    """ JSON decoding of the raw lines """
+    # pylint: disable=unused-argument
+    lines = _read_lines(files)
+    codec = get_codec()
+    start = time.perf_counter()
+    for index in range(0, len(lines), 10000):
+        codec.decode_batch(lines[index:index + 10000])
+    return len(lines), time.perf_counter() - start
+
+
+def stage_transform(files, options):
+    """ The transform() hook, per record """
+    # pylint: disable=unused-argument
+    records = get_codec().decode_batch(_read_lines(files))
+    start = time.perf_counter()
+    records = [
+        data for data in (transform("/bench", data) for data in records)
+        if data
+    ]
+    return len(records), time.perf_counter() - start
+
+
+def stage_nginx(files, options):
+    """ parse_nginx_combined() on the log messages """
+    # pylint: disable=unused-argument
+    messages = [
+        data["log"] for data in get_codec().decode_batch(_read_lines(files))
+    ]
+    start = time.perf_counter()
+    for message in messages:
+        utils.parse_nginx_combined(message)
+    return len(messages), time.perf_counter() - start
+
+
+def _ingest(files, url):
+    engine = db.create_engine(url)
+    migrations.migrate(engine)
+    codec = get_codec()
+    sink = create_sink(engine, codec)
+    count = 0
+    start = time.perf_counter()
+    for path in files:
+        log_path = LogPath(path)
+        while True:
+            payloads, envelopes, _ = client.read_batch(
+                log_path, "/bench", 10000, codec
+            )
+            if not payloads:
+                break
+            client.write_batch(
+                engine, sink, generator.CONTAINER_ID, "/bench", payloads,
+                envelopes=envelopes,
+            )
+            count += len(payloads)
+        log_path.close()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    return count, elapsed
+
+
+def stage_ingest_sqlite(files, options):
+    """ End to end into SQLite """
+    return _ingest(files, "sqlite:///" + os.path.join(
+        options["directory"], "bench.db"
+    ))
+
+
+def stage_ingest_postgresql(files, options):
+    """ End to end into PostgreSQL """
+    return _ingest(files, options["postgresql_url"])
+
+
+def _run_stage(name, files, options):
+    """ Run one stage, in the child process """
+    count, elapsed = globals()["stage_" + name](files, options)
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return count, elapsed, peak
+
+
+def run(
+        lines: int,
+        line_size: int,
+        rotate_size: int,
+        partial: bool,
+        stages: typing.Sequence[str],
+        postgresql_url: str = None,
+) -> dict:
+    """ Generate the logs and run the stages, returns the results """
+    context = multiprocessing.get_context("spawn")
+    results = {
+        "meta": {
+            "date": datetime.datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "lines": lines,
+            "line_size": line_size,
+            "rotate_size": rotate_size,
+            "partial": partial,
+        },
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        files = generator.generate(
+            directory, lines, generator.Generator(line_size=line_size),
+            rotate_size=rotate_size, max_files=1000, partial=partial,
+        )
+        size = sum(os.path.getsize(path) for path in files)
+        options = {"directory": directory, "postgresql_url": postgresql_url}
+        if postgresql_url:
+            stages = list(stages) + ["ingest_postgresql"]
+
+        print("{:<18} {:>12} {:>10} {:>10} {:>10}".format(
+            "stage", "lines/sec", "MB/sec", "seconds", "peak MB"
+        ))
+        for name in stages:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=context
+            ) as executor:
+                count, elapsed, peak = executor.submit(
+                    _run_stage, name, files, options
+                ).result()
+            result = {
+                "lines": count,
+                "seconds": elapsed,
+                "lines_per_sec": count / elapsed if elapsed else 0.0,
+                "mb_per_sec": size / elapsed / 1e6 if elapsed else 0.0,
+                "peak_rss_mb": peak / 1024,
+            }
+            results["stages"][name] = result
+            print("{:<18} {:>12,.0f} {:>10.1f} {:>10.3f} {:>10.1f}".format(
+                name, result["lines_per_sec"], result["mb_per_sec"],
+                elapsed, result["peak_rss_mb"]
+            ))
+    return results
+
+
+def compare(previous: dict, current: dict) -> None:
+    """ Print the throughput change of every stage """
+    print("{:<18} {:>12} {:>12} {:>8}".format(
+        "stage", "before", "after", "change"
+    ))
+    for name, result in current["stages"].items():
+        before = previous["stages"].get(name)
+        if not before or not before["lines_per_sec"]:
+            continue
+        print("{:<18} {:>12,.0f} {:>12,.0f} {:>+7.1f}%".format(
+            name, before["lines_per_sec"], result["lines_per_sec"],
+            100 * (result["lines_per_sec"] / before["lines_per_sec"] - 1)
+        ))
+
+
+def main(argv=None):
+    """ Command line entrypoint """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--line-size", type=int, default=120)
+    parser.add_argument(
+        "--rotate-size", type=int, default=0,
+        help="rotate the generated log every this many bytes"
+    )
+    parser.add_argument(
+        "--partial", action="store_true", default=False,
+        help="end the live log file in half a line"
+    )
+    parser.add_argument(
+        "--stage", action="append", choices=STAGES,
+        help="run only this stage, may be repeated"
+    )
+    parser.add_argument("--postgresql-url", default=None)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results of a previous run")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.lines, args.line_size, args.rotate_size, args.partial,
+        args.stage or STAGES, args.postgresql_url,
+    )
+    if args.output:
+        with open(args.output, "w") as filp:
+            json.dump(results, filp, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as filp:
+            compare(json.load(filp), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,16 +5,28 @@ import threading
 import subprocess
 import logging
 import time
+import typing
 import argparse
 import signal
-
-import docker
-from docker.models.containers import Container
-import sqlalchemy
-
-
-from . import client, settings, models
+import datetime
+
+from . import (
+    client, containers, db, discovery, lag, metrics, migrations, notify,
+    query, settings,
+)
+from .checkpoint import OffsetFileStore, store_from_settings
+from .engine import Engine
 from .offsetfile import OffsetFile
+from .partitions import manager_from_settings
+from .registry import ContainerRegistry
+from .spool import spool_from_settings
+from .supervisor import Supervisor
+from .workers import WorkerPool
+
+ENGINE_PROCESS = "process"
+ENGINE_ASYNCIO = "asyncio"
+ENGINE_POOL = "pool"
+ENGINES = (ENGINE_PROCESS, ENGINE_ASYNCIO, ENGINE_POOL)
 
 
 def sigterm_handler(signo, _stack_frame):
@@ -26,27 +38,87 @@ def sigterm_handler(signo, _stack_frame):
 class Monitor:
     """ Monitor of all containers on the system. """
 
-    def __init__(self, debug=False):
+    def __init__(
+            self,
+            debug=False,
+            engine: Engine = None,
+            watch=False,
+            pool: WorkerPool = None,
+    ):
         self.debug = debug
+        self.engine = engine
+        self.watch = watch
+        self.pool = pool
 
-        self.docker_client = docker.from_env()
+        self.docker_client = discovery.create_client()
+        self.registry = ContainerRegistry(
+            self.docker_client, inspect=self.inspect
+        )
         self.clients = {}
+        # containers that aren't tailed, see _should_add_container
+        self.skipped = set()
+        self.checkpoints = OffsetFileStore()
+        # engine of the database recording the containers, if any
+        self.database = None
+        self.supervisor = Supervisor(
+            self.clients, self._spawn, progress=self.progress
+        )
 
         self.quit = False
 
     def add_container(self, container_id: str):
-        """ Add a container with the given id by staring a client process. """
+        """ Add a container with the given id by staring a client process,
+        or a tailer coroutine when running with the asyncio engine or
+        in a worker of the pool.
+        """
+        self.supervisor.start(container_id)
+
+    def _spawn(self, container_id: str):
+        if self.pool:
+            tailer = self.pool.add_container(
+                container_id, self.registry.get(container_id)
+            )
+            logging.info("Starting tailer for container %s", container_id)
+            return tailer
+
+        if self.engine:
+            tailer = self.engine.add_container(
+                container_id, self.registry.get(container_id)
+            )
+            logging.info("Starting tailer for container %s", container_id)
+            return tailer
+
         cmd = [sys.executable, client.__file__, container_id]
         if self.debug:
             cmd.append("--debug")
+        if self.watch:
+            cmd.append("--watch")
 
         process = subprocess.Popen(cmd)
         logging.info(
             "Starting monitoring process PID %d for container %s",
             process.pid, container_id
         )
-
-        self.clients[container_id] = process
+        return process
+
+    def progress(
+            self,
+            container_id: str
+    ) -> typing.Optional[typing.Tuple[int, int]]:
+        """ Size of the container's log file and the checkpointed offset
+        into it, None if they don't refer to the same file
+        """
+        path = self.registry.get(container_id)["LogPath"]
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        checkpoint = self.checkpoints.read(
+            self.checkpoints.key(container_id, path)
+        )
+        if checkpoint is None or checkpoint.inode != stat.st_ino:
+            return None
+        return stat.st_size, checkpoint.offset
 
     def event_handler(self):
         """ Process docker events """
@@ -55,46 +127,91 @@ class Monitor:
                 logging.info("monitor quitting.")
                 return
             logging.debug("%s", str(event))
-            event_type = event.get("Type", "").lower()
-            if event_type == "container":
-                action = event.get("Action", "").lower()
-                if action == "start":
-                    name = event["Actor"]["Attributes"]["name"]
-                    if "logsql" not in name.lower():
-                        self.add_container(event["id"])
+            action = self.registry.handle_event(event)
+            if action == "destroy":
+                self.supervisor.remove(event["id"])
+            elif action == "die" and self.database is not None:
+                db.retry(
+                    containers.stopped, self.database, event["id"],
+                    datetime.datetime.fromtimestamp(
+                        event["time"], datetime.timezone.utc
+                    ) if "time" in event else None
+                )
+            elif action == "start":
+                name = event["Actor"]["Attributes"]["name"]
+                process = self.clients.get(event["id"])
+                if process is not None and process.poll() is None:
+                    # restarted, still being tailed
+                    continue
+                if "logsql" not in name.lower():
+                    self.add_container(event["id"])
 
     def inspect(self, container_id):
-        """ Shortcut to low-level inspect_container"""
-        return self.docker_client.api.inspect_container(container_id)
-
-    def reset(self):
-        """ Remove all offset files """
-        for container in self.docker_client.containers.list(all=True):
-            info = self.inspect(container.id)
-            path = info["LogPath"] + OffsetFile.DEFAULT_SUFFIX
-            if os.path.exists(path):
-                logging.warning("Removing offsetfile: %s", path)
-                os.remove(path)
+        """ Shortcut to low-level inspect_container, recording the
+        container in the containers table
+        """
+        info = self.docker_client.api.inspect_container(container_id)
+        if self.database is not None:
+            db.retry(containers.record, self.database, info)
+        return info
+
+    def reset(self, engine=None):
+        """ Remove all checkpoints, i.e. offset files """
+        if settings.CHECKPOINT_PATH or settings.CHECKPOINT_DATABASE:
+            store = store_from_settings(
+                engine or db.create_engine()
+            )
+            logging.warning("Removed %d checkpoints", store.reset())
+            store.close()
+            return
+
+        self.registry.reconcile()
+        for container_id in list(self.registry.names):
+            info = self.registry.get(container_id)
+            if info["LogPath"] and OffsetFile.remove(info["LogPath"]):
+                logging.warning("Removed offsetfile: %s", info["LogPath"])
+
+
+def _untracked_containers(
+        monitor: Monitor
+) -> typing.List[typing.Tuple[str, str]]:
+    """ (id, name) of the containers that neither have a client nor were
+    skipped before.
+
+    The events keep the registry current, so this is a cheap id diff.
+    """
+    _, removed = monitor.registry.reconcile()
+    monitor.skipped.difference_update(removed)
+    tracked = monitor.skipped.union(monitor.clients)
+    return [
+        (container_id, name)
+        for container_id, name in list(monitor.registry.names.items())
+        if container_id not in tracked
+    ]
 
 
 def _should_add_container(
         monitor: Monitor,
-        container: Container,
+        container_id: str,
+        name: str,
         level=logging.DEBUG,
 ) -> bool:
-    if "logsql" in container.name.lower():
+    if "logsql" in name.lower():
         logging.log(
             level,
             "Skipping container %s [%s]",
-            container.name, container.id
+            name, container_id
         )
+        monitor.skipped.add(container_id)
         return False
-    info = monitor.inspect(container.id)
+    info = monitor.registry.get(container_id)
     if not info["LogPath"]:
+        # not started yet, its start event adds it
         logging.warning(
             "Container %s [%s] has no LogPath, skipping",
-            container.name, container.id
+            name, container_id
         )
+        monitor.skipped.add(container_id)
         return False
     return True
 
@@ -106,11 +223,43 @@ def main(args):
 
     monitor = Monitor()
     monitor.debug = args.debug
+    monitor.watch = bool(args.watch)
+
+    engine = db.create_engine()
+    db.retry(migrations.migrate, engine)
+    monitor.checkpoints = store_from_settings(engine)
+    monitor.database = engine
+    partitions = db.retry(manager_from_settings, engine)
+    if partitions:
+        db.retry(partitions.maintain)
+
+    # sets up the metrics directory the workers and clients export to
+    metrics.serve()
+
+    if (args.engine or ENGINE_PROCESS) == ENGINE_ASYNCIO:
+        # the writer's connection plus one for reading checkpoints
+        shared_engine = db.create_engine(pool_size=settings.POOL_SIZE + 1)
+        monitor.engine = Engine(
+            shared_engine,
+            batch_size=args.batch_size or client.DEFAULT_BATCH_SIZE,
+            watch=monitor.watch,
+            checkpoints=store_from_settings(shared_engine),
+            spool=spool_from_settings("engine"),
+        )
+        monitor.engine.start()
+    elif args.engine == ENGINE_POOL:
+        monitor.pool = WorkerPool(
+            args.workers or settings.WORKERS or None,
+            batch_size=args.batch_size or client.DEFAULT_BATCH_SIZE,
+            watch=monitor.watch,
+            debug=args.debug,
+        )
+        monitor.pool.start()
 
-    engine = sqlalchemy.create_engine(
-        settings.DATABASE_URL, poolclass=sqlalchemy.pool.NullPool
-    )
-    models.BASE.metadata.create_all(bind=engine)
+    metrics.CLIENTS.set_function(lambda: sum(
+        1 for process in list(monitor.clients.values())
+        if process.poll() is None
+    ))
 
     signal.signal(signal.SIGTERM, sigterm_handler)
 
@@ -119,50 +268,76 @@ def main(args):
         thread.daemon = True
         thread.start()
 
-        for container in monitor.docker_client.containers.list(all=True):
-            if container.id not in monitor.clients:
-                if _should_add_container(
-                        monitor, container, level=logging.INFO
-                ):
-                    logging.info(
-                        "Add container %s [%s]",
-                        container.name, container.id
-                    )
-                    monitor.add_container(container.id)
+        for container_id, name in _untracked_containers(monitor):
+            if _should_add_container(
+                    monitor, container_id, name, level=logging.INFO
+            ):
+                logging.info(
+                    "Add container %s [%s]", name, container_id
+                )
+                monitor.add_container(container_id)
 
         while True:
             logging.debug("sleeping main thread")
             time.sleep(args.interval)
 
-            containers = monitor.docker_client.containers.list(all=True)
-            for container in containers:
-                if container.id not in monitor.clients:
-                    if _should_add_container(monitor, container):
-                        logging.warning(
-                            "Manually adding container %s [%s]",
-                            container.name, container.id
-                        )
-                        monitor.add_container(container.id)
-
-            for container_id, process in monitor.clients.items():
-                if process.poll() is None:
+            for container_id, name in _untracked_containers(monitor):
+                if _should_add_container(monitor, container_id, name):
+                    logging.warning(
+                        "Manually adding container %s [%s]",
+                        name, container_id
+                    )
+                    monitor.add_container(container_id)
+
+            monitor.supervisor.check()
+            if partitions:
+                db.retry(partitions.maintain)
+            if monitor.pool:
+                monitor.pool.check()
+                for load in monitor.pool.load():
                     logging.debug(
-                        "Process %s is still running", str(container_id)
+                        "Worker %(worker)d: %(containers)d containers, "
+                        "%(lines)d lines", load
                     )
-                    continue
 
     except SystemExit:
         logging.info("SIGTERM, exiting ...")
         monitor.quit = True
+        if monitor.engine:
+            monitor.engine.stop()
+        if monitor.pool:
+            monitor.pool.stop()
         return 128 + signal.SIGTERM
 
 
 def init():
     """ Module initialization """
     if __name__ == "__main__":
+        if sys.argv[1:2] == ["query"]:
+            sys.exit(query.main(query.parse_args(sys.argv[2:])))
+        if sys.argv[1:2] == ["listen"]:
+            sys.exit(notify.main(notify.parse_args(sys.argv[2:])))
+        if sys.argv[1:2] == ["lag"]:
+            sys.exit(lag.main(lag.parse_args(sys.argv[2:])))
+
         parser = argparse.ArgumentParser()
         parser.add_argument("--debug", action="store_true", default=False)
         parser.add_argument("--interval", default=60.0)
+        parser.add_argument(
+            "--engine", choices=ENGINES, default=ENGINE_PROCESS,
+            help="run a subprocess per container, "
+                 "all containers in one asyncio event loop or "
+                 "sharded across a pool of worker processes"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="worker processes of the pool, one per CPU core by default"
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--watch", action="store_true", default=False,
+            help="wake tailers with inotify instead of polling"
+        )
         sys.exit(main(parser.parse_args()))
 
 
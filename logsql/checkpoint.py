@@ -0,0 +1,316 @@
+"""
+Checkpoint stores.
+
+Instead of one offset file next to every container log, the inode and
+offset of all log files can be kept in a single SQLite database in WAL
+mode, keyed by container id.  Saves are buffered and group-committed at
+most every flush_interval seconds, each flush being one atomic transaction.
+
+Alternatively checkpoints are kept in the logs database itself and written
+in the same transaction as the logs they cover (transactional stores),
+so that a crash can't replay or lose a batch.
+"""
+import time
+import logging
+import sqlite3
+import threading
+import typing
+
+import sqlalchemy
+
+from . import models, settings
+from .offsetfile import OffsetFile
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    key TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class Checkpoint:
+    """ The stored file position, kept in a CheckpointStore.
+
+    Has the same interface as OffsetFile.
+    """
+
+    def __init__(
+            self,
+            store: "CheckpointStore",
+            key: str,
+            *,
+            offset: int = None,
+            inode: int = None
+    ):
+        self.store = store
+        self.key = key
+        self.offset = offset
+        self.inode = inode
+
+    def save(self) -> None:
+        """ Queue the current state for the next flush of the store """
+        assert self.inode >= 0
+        assert self.offset >= 0
+        self.store.save(self)
+
+    def reset(
+            self,
+            inode: int,
+            offset: int = 0
+    ):
+        """ Reset to a new file """
+        self.inode = inode
+        self.offset = offset
+
+
+class OffsetFileStore:
+    """ Checkpoints kept in an offset file next to each log file.
+
+    The key is the path of the log file.
+    """
+    transactional = False
+
+    @staticmethod
+    def key(container_id: str, path: str) -> str:
+        """ The key of the given container's log file """
+        # pylint: disable=unused-argument
+        return path
+
+    @staticmethod
+    def read(key: str) -> typing.Optional[OffsetFile]:
+        """ The saved checkpoint, if any """
+        return OffsetFile.read(key)
+
+    @staticmethod
+    def create(key: str, offset: int, inode: int) -> OffsetFile:
+        """ A new, unsaved checkpoint """
+        return OffsetFile(key, offset=offset, inode=inode)
+
+    @staticmethod
+    def delete(key: str) -> bool:
+        """ Remove the checkpoint, returns whether it existed """
+        return OffsetFile.remove(key)
+
+    def flush(self) -> None:
+        """ Offset files are written on save """
+
+    def close(self) -> None:
+        """ Nothing to release """
+
+
+class CheckpointStore:
+    """ All checkpoints in one SQLite database """
+    transactional = False
+
+    def __init__(
+            self,
+            path: str,
+            flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self.connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+
+        self.lock = threading.Lock()
+        self.pending = {}  # type: typing.Dict[str, typing.Tuple[int, int]]
+        self.flushed_at = time.monotonic()
+
+    @staticmethod
+    def key(container_id: str, path: str) -> str:
+        """ The key of the given container's log file """
+        # pylint: disable=unused-argument
+        return container_id
+
+    def read(self, key: str) -> typing.Optional[Checkpoint]:
+        """ The saved checkpoint, if any """
+        with self.lock:
+            if key in self.pending:
+                inode, offset = self.pending[key]
+                return Checkpoint(self, key, offset=offset, inode=inode)
+            row = self.connection.execute(
+                "SELECT inode, offset FROM checkpoints WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return Checkpoint(self, key, offset=row[1], inode=row[0])
+
+    def create(self, key: str, offset: int, inode: int) -> Checkpoint:
+        """ A new, unsaved checkpoint """
+        return Checkpoint(self, key, offset=offset, inode=inode)
+
+    def save(self, checkpoint: Checkpoint) -> None:
+        """ Queue checkpoint, flushing if flush_interval has passed """
+        with self.lock:
+            self.pending[checkpoint.key] = (checkpoint.inode, checkpoint.offset)
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write all queued checkpoints in one transaction """
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            if not self.pending:
+                return
+            now = time.time()
+            rows = [
+                (key, inode, offset, now)
+                for key, (inode, offset) in self.pending.items()
+            ]
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO checkpoints "
+                    "(key, inode, offset, updated_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+            self.pending.clear()
+
+    def delete(self, key: str) -> bool:
+        """ Remove the checkpoint, returns whether it existed """
+        with self.lock:
+            pending = self.pending.pop(key, None) is not None
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                cursor = self.connection.execute(
+                    "DELETE FROM checkpoints WHERE key = ?", (key,)
+                )
+        return pending or cursor.rowcount > 0
+
+    def reset(self) -> int:
+        """ Remove all checkpoints, returns how many were stored """
+        with self.lock:
+            self.pending.clear()
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                cursor = self.connection.execute("DELETE FROM checkpoints")
+        return cursor.rowcount
+
+    def keys(self) -> typing.List[str]:
+        """ The keys of all saved checkpoints """
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT key FROM checkpoints ORDER BY key"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        """ Flush and close the database """
+        self.flush()
+        self.connection.close()
+
+
+class DatabaseCheckpointStore:
+    """ Checkpoints in the checkpoints table of the logs database """
+    transactional = True
+
+    def __init__(
+            self,
+            engine: sqlalchemy.engine.Engine,
+    ):
+        self.engine = engine
+        self.table = models.Checkpoint.__table__
+
+    @staticmethod
+    def key(container_id: str, path: str) -> str:
+        """ The key of the given container's log file """
+        # pylint: disable=unused-argument
+        return container_id
+
+    def read(self, key: str) -> typing.Optional[Checkpoint]:
+        """ The saved checkpoint, if any """
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                sqlalchemy.select([self.table.c.inode, self.table.c.offset])
+                .where(self.table.c.container_id == key)
+            ).first()
+        if row is None:
+            return None
+        return Checkpoint(self, key, offset=row.offset, inode=row.inode)
+
+    def create(self, key: str, offset: int, inode: int) -> Checkpoint:
+        """ A new, unsaved checkpoint """
+        return Checkpoint(self, key, offset=offset, inode=inode)
+
+    def save(
+            self,
+            checkpoint: Checkpoint,
+            connection: sqlalchemy.engine.Connection = None,
+    ) -> None:
+        """ Write checkpoint as part of connection's transaction, or in a
+        transaction of its own if there is none
+        """
+        if connection is None:
+            with self.engine.begin() as connection:
+                self.save(checkpoint, connection)
+            return
+
+        values = {"inode": checkpoint.inode, "offset": checkpoint.offset}
+        result = connection.execute(
+            self.table.update()
+            .where(self.table.c.container_id == checkpoint.key)
+            .values(**values)
+        )
+        if not result.rowcount:
+            connection.execute(
+                self.table.insert().values(
+                    container_id=checkpoint.key, **values
+                )
+            )
+
+    def flush(self) -> None:
+        """ Checkpoints are written on save """
+
+    def delete(self, key: str) -> bool:
+        """ Remove the checkpoint, returns whether it existed """
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                self.table.delete().where(self.table.c.container_id == key)
+            )
+        return result.rowcount > 0
+
+    def reset(self) -> int:
+        """ Remove all checkpoints, returns how many were stored """
+        with self.engine.begin() as connection:
+            return connection.execute(self.table.delete()).rowcount
+
+    def close(self) -> None:
+        """ The engine belongs to the caller """
+
+
+def create_store(
+        path: str = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+):
+    """ A CheckpointStore at path, or offset files if path is empty """
+    if not path:
+        return OffsetFileStore()
+    return CheckpointStore(path, flush_interval=flush_interval)
+
+
+def store_from_settings(
+        engine: sqlalchemy.engine.Engine
+):
+    """ The checkpoint store configured in settings """
+    if settings.CHECKPOINT_DATABASE:
+        if not settings.SPOOL_DIR:
+            return DatabaseCheckpointStore(engine)
+        # checkpoints move on once a batch is spooled, database or not
+        logger.warning("Spooling, not keeping checkpoints in the database")
+    return create_store(
+        settings.CHECKPOINT_PATH, settings.CHECKPOINT_FLUSH_INTERVAL
+    )
@@ -1,23 +1,118 @@
 """
 This module is the entry point for per-log-file handling.
 """
-import os
 import sys
 import argparse
-import time
+import typing
 import logging
-import json
 
-import docker
 import sqlalchemy
-from sqlalchemy.pool import NullPool
 
-from logsql import models, settings, utils
+from logsql import db, discovery, metrics, settings, utils
+from logsql.lag import idle_interval
 from logsql.logpath import LogPath
-from logsql.offsetfile import OffsetFile
-from logsql.transform import transform
+from logsql.checkpoint import store_from_settings
+from logsql.sink import Envelope, Sink, create_sink, envelope, envelope_fields
+from logsql.spool import Drainer, spool_from_settings
+from logsql.watch import create_waiter
+from logsql.codec import Codec, get_codec
+from logsql.transform import Pipeline, compile_pipeline, transform
+
+IDENTITY = transform
 
 DEFAULT_BATCH_SIZE = 10000
+MAX_NAME_LENGTH = 128
+
+
+def container_name(
+        info: dict
+) -> str:
+    """ The container name as stored in the database """
+    return info["Name"][0:MAX_NAME_LENGTH]
+
+
+def read_batch(
+        log_path: LogPath,
+        name: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        codec: Codec = None,
+        pipeline: Pipeline = None,
+) -> typing.Tuple[typing.List[str], typing.List[Envelope], bool]:
+    """ Read a batch of up to batch_size lines from log_path and turn them
+    into JSON payloads for the sink, transformed by the transform() hook
+    and then the container's pipeline.
+
+    With the default identity transform and an empty pipeline, docker's
+    json-file lines already are the payloads and are neither decoded nor
+    encoded again, only their envelope fields are picked out.
+
+    Returns the payloads, their envelope fields for the sink and whether
+    the file is gone.
+    """
+    codec = codec or get_codec()
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    identity = transform is IDENTITY and \
+        (pipeline is None or pipeline.identity)
+
+    payloads = []  # type: typing.List[str]
+    envelopes = []  # type: typing.List[Envelope]
+    while not payloads:
+        try:
+            raw_lines = log_path.readlines(max_lines=batch_size, raw=True)
+        except FileNotFoundError:
+            logging.info(
+                "FileNotFound %s, container likely removed", log_path.path
+            )
+            return payloads, envelopes, True
+        if not raw_lines:
+            break
+        metrics.LINES_READ.inc(len(raw_lines), name)
+        metrics.BYTES_READ.inc(sum(map(len, raw_lines)), name)
+
+        if identity:
+            payloads = [str(line, log_path.encoding) for line in raw_lines]
+            with metrics.DECODE_SECONDS.time():
+                envelopes = [envelope(codec, payload) for payload in payloads]
+        else:
+            # assumes json formatting
+            with metrics.DECODE_SECONDS.time():
+                records = codec.decode_batch(raw_lines)
+            with metrics.TRANSFORM_SECONDS.time():
+                if transform is not IDENTITY:
+                    records = [
+                        data for data in (
+                            transform(name, data) for data in records
+                        ) if data
+                    ]
+                if pipeline is not None:
+                    records = pipeline(records)
+            payloads = codec.encode_batch(records)
+            envelopes = [envelope_fields(data) for data in records]
+
+        if debug:
+            for payload in payloads:
+                logging.debug("LINE: %s", payload)
+    if payloads:
+        metrics.BATCH_SIZE.observe(len(payloads))
+    return payloads, envelopes, False
+
+
+def write_batch(
+        engine: sqlalchemy.engine.Engine,
+        sink: Sink,
+        container_id: str,
+        name: str,
+        payloads: typing.List[str],
+        log_path: LogPath = None,
+        envelopes: typing.List[Envelope] = None,
+) -> None:
+    """ Insert the payloads in one transaction, together with log_path's
+    checkpoint if given
+    """
+    with sink.begin(engine) as connection:
+        sink.write(connection, container_id, name, payloads, envelopes)
+        if log_path is not None:
+            log_path.commit(connection)
 
 
 def main(
@@ -27,7 +122,7 @@ def main(
     given log file
     """
 
-    client = docker.from_env()
+    client = discovery.create_client()
     info = client.api.inspect_container(args.id)
     run_once = getattr(args, "run_once", False)
 
@@ -37,9 +132,7 @@ def main(
 
     done = False
 
-    name = info["Name"]
-    if len(name) > 128:
-        name = name[0:128]
+    name = container_name(info)
 
     logging.basicConfig(
         format="%(levelname)s:" + name + ":%(message)s",
@@ -49,72 +142,73 @@ def main(
     path = info["LogPath"]
     logging.info("%s started: %s", args.id, path)
 
-    if args.reset:
-        offset_file_path = info["LogPath"] + OffsetFile.DEFAULT_SUFFIX
-        if os.path.exists(offset_file_path):
-            logging.warning("Removing offsetfile: %s", offset_file_path)
-            os.remove(offset_file_path)
+    metrics.start_exporter()
+    engine = db.create_engine()
+    codec = get_codec()
+    sink = create_sink(engine, codec)
+    pipeline = compile_pipeline(info)
 
-    engine = sqlalchemy.create_engine(
-        settings.DATABASE_URL, poolclass=NullPool
-    )
-    models.Session.configure(bind=engine)
-    session = models.Session()
+    checkpoints = store_from_settings(engine)
+    key = checkpoints.key(args.id, path)
+    if args.reset and checkpoints.delete(key):
+        logging.warning("Removed checkpoint: %s", key)
 
     utils.containers_chown(path)
 
-    log_path = LogPath(path)
+    spool = spool_from_settings(args.id)
+    drainer = None
+    if spool is not None:
+        drainer = Drainer(spool, engine, sink)
+        drainer.start()
+
+    waiter = create_waiter(path) if args.watch else None
+    log_path = LogPath(
+        path,
+        waiter=waiter,
+        read_size=settings.READ_SIZE,
+        catchup_size=settings.CATCHUP_SIZE,
+        checkpoints=checkpoints,
+        key=key,
+    )
+    idle = 0
     while not done:
-        lines = []
-        while True:
-            line = None
-            try:
-                line = log_path.readline()
-            except FileNotFoundError:
-                logging.info("FileNotFound %s, container likely removed", path)
-                done = True
-            if not line:
-                break
-
-            # assumes json formatting
-            data = transform(info["Name"], json.loads(line))
-            if not data:
-                continue
-
-            lines.append(data)
-            logging.debug("LINE: %s", str(data))
-
-            if len(lines) >= batch_size:
-                break
-
-        if not lines:
+        payloads, envelopes, done = read_batch(
+            log_path, info["Name"], batch_size, codec, pipeline
+        )
+        lag = log_path.lag()
+        metrics.LAG_BYTES.set(lag.bytes, name)
+        metrics.LAG_SECONDS.set(lag.seconds, name)
+
+        if not payloads:
             if run_once:
                 return log_path  # pragma: no coverage
             logging.debug("sleep")
-            time.sleep(args.interval)
+            log_path.wait(idle_interval(args.interval, idle))
+            idle += 1
             continue
-
-        logs = []
-
-        for data in lines:
-            log = models.Log(
-                container_id=args.id, container_name=name, json=data
+        idle = 0
+
+        if spool is not None:
+            spool.append(args.id, name, payloads, envelopes)
+            logging.debug("Spooled %d lines", len(payloads))
+            log_path.commit()
+        else:
+            db.retry(
+                write_batch, engine, sink, args.id, name, payloads,
+                log_path if checkpoints.transactional else None, envelopes
             )
-            session.add(log)
-            logs.append(log)
-        session.commit()
+            logging.debug("Committed %d lines", len(payloads))
 
-        if args.debug:
-            for log in logs:
-                # careful, this can hang during same-process tests
-                session.refresh(log)
-                logging.debug("LOG: %s", log.as_dict())
-
-        log_path.commit()
+            if not checkpoints.transactional:
+                log_path.commit()
 
         if run_once:
             return log_path
 
+    if drainer is not None:
+        # the container is gone, write what's left before exiting
+        drainer.stop(drain=True)
+        spool.close()
     return 0
 
 
@@ -122,7 +216,11 @@ if __name__ == "__main__":
     PARSER = argparse.ArgumentParser()
     PARSER.add_argument("id")
     PARSER.add_argument("--debug", action="store_true", default=False)
-    PARSER.add_argument("--interval", default=1.0)
+    PARSER.add_argument("--interval", type=float, default=1.0)
+    PARSER.add_argument(
+        "--watch", action="store_true", default=False,
+        help="wake up on inotify events instead of polling every interval"
+    )
     PARSER.add_argument("--reset", action="store_true", default=False)
     PARSER.add_argument("--batch-size", default=DEFAULT_BATCH_SIZE)
 
@@ -0,0 +1,109 @@
+"""
+JSON encoding and decoding.
+
+Uses orjson or ujson when one of them is installed and falls back to the
+standard library otherwise.  Set LOGSQL_JSON_CODEC to force a codec.
+"""
+import json
+import typing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+from . import settings
+
+# bytes, bytearray, memoryview or str
+Line = typing.Union[bytes, bytearray, memoryview, str]
+
+
+class Codec:
+    """ A JSON library adapted to bytes-like input and str output """
+    name = None  # type: str
+
+    def loads(self, line: Line) -> typing.Any:
+        """ Decode one JSON document """
+        raise NotImplementedError()
+
+    def dumps(self, data: typing.Any) -> str:
+        """ Encode one JSON document """
+        raise NotImplementedError()
+
+    def decode_batch(self, lines: typing.List[Line]) -> list:
+        """ Decode a batch of JSON lines """
+        loads = self.loads
+        return [loads(line) for line in lines]
+
+    def encode_batch(self, records: list) -> typing.List[str]:
+        """ Encode a batch of records """
+        dumps = self.dumps
+        return [dumps(data) for data in records]
+
+
+class StdlibCodec(Codec):
+    """ The standard library json module """
+    name = "json"
+
+    def loads(self, line):
+        if isinstance(line, memoryview):
+            line = bytes(line)
+        return json.loads(line)
+
+    def dumps(self, data):
+        return json.dumps(data)
+
+
+class OrjsonCodec(Codec):
+    """ orjson, accepts memoryviews directly """
+    name = "orjson"
+
+    def loads(self, line):
+        return orjson.loads(line)
+
+    def dumps(self, data):
+        return orjson.dumps(data).decode("utf-8")
+
+
+class UjsonCodec(Codec):
+    """ ujson """
+    name = "ujson"
+
+    def loads(self, line):
+        if isinstance(line, (memoryview, bytearray)):
+            line = bytes(line)
+        return ujson.loads(line)
+
+    def dumps(self, data):
+        return ujson.dumps(data, ensure_ascii=False)
+
+
+CODECS = {
+    StdlibCodec.name: StdlibCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    UjsonCodec.name: UjsonCodec,
+}
+
+
+def available() -> typing.List[str]:
+    """ Names of the usable codecs, fastest first """
+    names = []
+    if orjson is not None:
+        names.append(OrjsonCodec.name)
+    if ujson is not None:
+        names.append(UjsonCodec.name)
+    names.append(StdlibCodec.name)
+    return names
+
+
+def get_codec(name: str = None) -> Codec:
+    """ The named codec, or the fastest one available """
+    name = name or settings.JSON_CODEC or available()[0]
+    if name not in available():
+        raise ValueError("JSON codec not available: " + name)
+    return CODECS[name]()
@@ -0,0 +1,106 @@
+"""
+The containers dimension table.
+
+Log entries reference their container by a small integer key instead of
+repeating its id and name on every row.  Writers look up (or create) the
+key of a container once and cache it; the Monitor keeps the name, image,
+labels and start/stop times up to date from the inspect data.
+"""
+import datetime
+import typing
+
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+from . import models, utils
+
+
+TABLE = models.Container.__table__
+MAX_NAME_LENGTH = TABLE.c.name.type.length
+
+
+def _insert_ignore(
+        dialect: sqlalchemy.engine.interfaces.Dialect
+) -> sqlalchemy.sql.Insert:
+    """ An INSERT that does nothing if the container already exists """
+    if dialect.name == "postgresql":
+        return postgresql.insert(TABLE).on_conflict_do_nothing(
+            index_elements=[TABLE.c.container_id]
+        )
+    if dialect.name == "sqlite":
+        return TABLE.insert().prefix_with("OR IGNORE")
+    if dialect.name == "mysql":
+        return TABLE.insert().prefix_with("IGNORE")
+    return TABLE.insert()
+
+
+def ensure(
+        connection: sqlalchemy.engine.Connection,
+        container_id: str,
+        name: str,
+) -> int:
+    """ The key of the container, adding it if it isn't known yet """
+    select = sqlalchemy.select([TABLE.c.id]).where(
+        TABLE.c.container_id == container_id
+    )
+    key = connection.execute(select).scalar()
+    if key is None:
+        connection.execute(
+            _insert_ignore(connection.dialect).values(
+                container_id=container_id, name=name[0:MAX_NAME_LENGTH]
+            )
+        )
+        key = connection.execute(select).scalar()
+    return key
+
+
+def _docker_time(value: str) -> typing.Optional[datetime.datetime]:
+    result = utils.parse_docker_time(value)
+    if result is None or result.year <= 1:
+        # docker's zero time, i.e. never
+        return None
+    return result
+
+
+def fields(info: dict) -> dict:
+    """ The columns of the containers table from docker's inspect data """
+    state = info.get("State") or {}
+    config = info.get("Config") or {}
+    return {
+        "name": info["Name"][0:MAX_NAME_LENGTH],
+        "image": config.get("Image"),
+        "labels": config.get("Labels") or {},
+        "started_at": _docker_time(state.get("StartedAt")),
+        "stopped_at": None if state.get("Running")
+        else _docker_time(state.get("FinishedAt")),
+    }
+
+
+def record(
+        engine: sqlalchemy.engine.Engine,
+        info: dict,
+) -> None:
+    """ Add or update the container from its inspect data """
+    values = fields(info)
+    with engine.begin() as connection:
+        ensure(connection, info["Id"], values["name"])
+        connection.execute(
+            TABLE.update()
+            .where(TABLE.c.container_id == info["Id"])
+            .values(**values)
+        )
+
+
+def stopped(
+        engine: sqlalchemy.engine.Engine,
+        container_id: str,
+        stopped_at: datetime.datetime = None,
+) -> None:
+    """ Record that the container stopped """
+    stopped_at = stopped_at or datetime.datetime.now(datetime.timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(
+            TABLE.update()
+            .where(TABLE.c.container_id == container_id)
+            .values(stopped_at=stopped_at)
+        )
@@ -0,0 +1,84 @@
+"""
+Database connection management.
+
+Writers keep a small pool of long-lived, health-checked connections
+instead of connecting for every commit, and retry with exponential
+backoff while the database is unreachable.
+"""
+import time
+import logging
+import typing
+
+import sqlalchemy
+import sqlalchemy.exc
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+# errors meaning the connection (not the statement) failed
+RETRY_ERRORS = (
+    sqlalchemy.exc.OperationalError,
+    sqlalchemy.exc.InterfaceError,
+)
+
+
+def create_engine(
+        url: str = None,
+        **kwargs
+) -> sqlalchemy.engine.Engine:
+    """ An engine with a persistent connection pool configured in settings """
+    url = url or settings.DATABASE_URL
+    if url.startswith("sqlite"):
+        # SQLite uses its own pool classes, without a size
+        kwargs.pop("pool_size", None)
+    else:
+        kwargs.setdefault("pool_size", settings.POOL_SIZE)
+        kwargs.setdefault("max_overflow", settings.POOL_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", settings.POOL_TIMEOUT)
+        kwargs.setdefault("pool_recycle", settings.POOL_RECYCLE)
+        kwargs.setdefault("pool_pre_ping", True)
+    return sqlalchemy.create_engine(url, **kwargs)
+
+
+def _is_retriable(ex: Exception) -> bool:
+    if isinstance(ex, RETRY_ERRORS):
+        return True
+    return isinstance(ex, sqlalchemy.exc.DBAPIError) \
+        and ex.connection_invalidated
+
+
+def retry(
+        func: typing.Callable,
+        *args,
+        attempts: int = None,
+        min_delay: float = None,
+        max_delay: float = None,
+        **kwargs
+):
+    """ Call func until it doesn't fail because of the database connection.
+
+    Waits min_delay seconds after the first failure, doubling up to
+    max_delay.  Retries forever unless attempts is given.
+    """
+    delay = min_delay if min_delay is not None else settings.RETRY_MIN_DELAY
+    max_delay = max_delay if max_delay is not None \
+        else settings.RETRY_MAX_DELAY
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func(*args, **kwargs)
+        except sqlalchemy.exc.DBAPIError as ex:
+            if not _is_retriable(ex):
+                raise
+            if attempts is not None and attempt >= attempts:
+                raise
+            logger.warning(
+                "Database unavailable (%s), retrying in %.1fs",
+                str(ex.orig).strip() or type(ex.orig).__name__, delay
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
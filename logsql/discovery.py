@@ -0,0 +1,367 @@
+"""
+Container discovery without the docker daemon.
+
+Listing and inspecting every container through the docker socket is slow
+on hosts with hundreds of them, and it fails exactly when dockerd is under
+pressure.  With LOGSQL_DISCOVERY=directory, containers are found by reading
+the config.v2.json docker keeps for each of them in
+
+    /var/lib/docker/containers/<id>/config.v2.json
+
+(LOGSQL_CONTAINERS_DIR), which has the name, state, labels and LogPath.
+DirectoryClient provides the part of docker.DockerClient that logsql uses,
+so the Monitor, the registry and the client processes work unchanged.  Its
+events are derived from the changes of the configs, found with inotify on
+the directory or by rescanning it every interval where inotify isn't
+available.
+
+The configs are docker's private state: they are only read, and a fixture
+directory laid out the same way is enough to run without a daemon.
+"""
+import os
+import json
+import time
+import select
+import logging
+import threading
+import typing
+
+import docker
+
+from . import settings, utils
+from .watch import (
+    Inotify, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_FROM,
+    IN_MOVED_TO, IN_Q_OVERFLOW
+)
+
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_DOCKER = "docker"
+DISCOVERY_DIRECTORY = "directory"
+DISCOVERIES = (DISCOVERY_DOCKER, DISCOVERY_DIRECTORY)
+
+CONFIG = "config.v2.json"
+# docker writes the config to a temporary file and renames it
+ROOT_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+CONTAINER_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+
+# name, running, started at, finished at
+State = typing.Tuple[str, bool, str, str]
+
+
+def inspect_config(config: dict) -> dict:
+    """ The inspect result of a container from its config.v2.json """
+    info = dict(config)
+    info["Id"] = config["ID"]
+    state = dict(config.get("State") or {})
+    if "Status" not in state:
+        if state.get("Running"):
+            state["Status"] = "paused" if state.get("Paused") else "running"
+        elif state.get("Dead"):
+            state["Status"] = "dead"
+        elif _never(state.get("StartedAt")):
+            state["Status"] = "created"
+        else:
+            state["Status"] = "exited"
+    info["State"] = state
+    return info
+
+
+def _never(value: typing.Optional[str]) -> bool:
+    moment = utils.parse_docker_time(value)
+    # docker's zero time
+    return moment is None or moment.year <= 1
+
+
+def container_state(info: dict) -> State:
+    """ What the events are derived from """
+    state = info.get("State") or {}
+    return (
+        info["Name"].lstrip("/"),
+        bool(state.get("Running")),
+        state.get("StartedAt") or "",
+        state.get("FinishedAt") or "",
+    )
+
+
+def _event(
+        action: str,
+        container_id: str,
+        name: str,
+        moment: float = None,
+) -> dict:
+    return {
+        "Type": "container",
+        "Action": action,
+        "id": container_id,
+        "time": moment if moment is not None else time.time(),
+        "Actor": {"ID": container_id, "Attributes": {"name": name}},
+    }
+
+
+def _finished(state: State) -> typing.Optional[float]:
+    moment = utils.parse_docker_time(state[3])
+    if moment is None or moment.year <= 1:
+        return None
+    return moment.timestamp()
+
+
+def changes(
+        old: typing.Dict[str, State],
+        new: typing.Dict[str, State],
+) -> typing.List[dict]:
+    """ The docker events that turn the containers old into new """
+    events = []
+    for container_id, state in new.items():
+        name, running, started_at, _ = state
+        before = old.get(container_id)
+        if before is None:
+            events.append(_event("create", container_id, name))
+            if running:
+                events.append(_event("start", container_id, name))
+            continue
+        if before[0] != name:
+            events.append(_event("rename", container_id, name))
+        if before[1] and (not running or before[2] != started_at):
+            # stopped, or restarted between two scans
+            events.append(_event(
+                "die", container_id, name,
+                _finished(state) if not running else None
+            ))
+        if running and (not before[1] or before[2] != started_at):
+            events.append(_event("start", container_id, name))
+    for container_id, before in old.items():
+        if container_id not in new:
+            if before[1]:
+                events.append(_event("die", container_id, before[0]))
+            events.append(_event("destroy", container_id, before[0]))
+    return events
+
+
+class DirectoryAPI:
+    """ The low-level API calls, answered from the configs """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # id: (mtime, inspect result), configs are only re-read if changed
+        self.cache = {}  # type: typing.Dict[str, typing.Tuple[int, dict]]
+
+    def path(self, container_id: str) -> str:
+        """ The config of the container """
+        return os.path.join(self.directory, container_id, CONFIG)
+
+    def ids(self) -> typing.List[str]:
+        """ The ids of all containers with a config """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            logger.warning("No containers directory %s", self.directory)
+            return []
+        return sorted(
+            name for name in names if os.path.isfile(self.path(name))
+        )
+
+    def read(self, container_id: str) -> typing.Optional[dict]:
+        """ The inspect result of the container, None if it is gone """
+        path = self.path(container_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            cached = self.cache.get(container_id)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(path, "rb") as filp:
+                info = inspect_config(json.loads(filp.read()))
+        except (OSError, ValueError, KeyError) as ex:
+            # removed or being written
+            logger.debug("Can't read %s: %s", path, ex)
+            self.cache.pop(container_id, None)
+            return None
+        self.cache[container_id] = (mtime, info)
+        return info
+
+    def inspect_container(self, container: str) -> dict:
+        """ Like docker's inspect, raises docker.errors.NotFound """
+        info = self.read(container)
+        if info is None:
+            raise docker.errors.NotFound(
+                "No such container: {}".format(container)
+            )
+        return info
+
+    def containers(self, all: bool = False) -> typing.List[dict]:
+        """ Like docker's container listing, running containers only unless
+        all is set
+        """
+        # pylint: disable=redefined-builtin
+        result = []
+        for container_id in self.ids():
+            info = self.read(container_id)
+            if info is None or not (all or info["State"].get("Running")):
+                continue
+            result.append({
+                "Id": container_id,
+                "Names": [info["Name"]],
+                "Image": (info.get("Config") or {}).get("Image"),
+                "State": info["State"]["Status"],
+            })
+        return result
+
+    def states(
+            self,
+            ids: typing.Iterable[str] = None,
+    ) -> typing.Dict[str, State]:
+        """ The state of the given containers (all of them if None) that
+        still exist
+        """
+        result = {}
+        for container_id in self.ids() if ids is None else ids:
+            info = self.read(container_id)
+            if info is not None:
+                result[container_id] = container_state(info)
+        return result
+
+
+class DirectoryContainer:
+    """ A container of a sparse listing """
+
+    def __init__(self, attrs: dict):
+        self.attrs = attrs
+        self.id = attrs["Id"]  # pylint: disable=invalid-name
+
+
+class DirectoryContainers:
+    """ The containers collection """
+
+    def __init__(self, api: DirectoryAPI):
+        self.api = api
+
+    def list(self, all: bool = False, sparse: bool = False):
+        """ The containers, always sparse """
+        # pylint: disable=redefined-builtin,unused-argument
+        return [
+            DirectoryContainer(attrs)
+            for attrs in self.api.containers(all=all)
+        ]
+
+
+class DirectoryClient:
+    """ Stands in for docker.DockerClient, reading the containers directory
+    instead of asking the daemon
+    """
+
+    def __init__(
+            self,
+            directory: str = None,
+            interval: float = 1.0,
+    ):
+        self.directory = directory or settings.CONTAINERS_DIR
+        self.interval = interval
+        self.api = DirectoryAPI(self.directory)
+        self.containers = DirectoryContainers(self.api)
+        self.closed = threading.Event()
+
+    def close(self) -> None:
+        """ End the event streams, within interval seconds """
+        self.closed.set()
+
+    def events(self, decode: bool = True) -> typing.Iterator[dict]:
+        """ Container events from now on: create, start, die, rename and
+        destroy.  Runs until closed.
+        """
+        # pylint: disable=unused-argument
+        try:
+            inotify = Inotify()
+            inotify.add_watch(self.directory, ROOT_MASK)
+        except OSError as ex:
+            logger.warning(
+                "inotify unavailable for %s (%s), rescanning every %.1fs",
+                self.directory, ex, self.interval
+            )
+            inotify = None
+
+        watches = {}  # type: typing.Dict[int, str]
+        try:
+            if inotify is not None:
+                for container_id in self.api.ids():
+                    self._watch(inotify, watches, container_id)
+            current = self.api.states()
+            while not self.closed.is_set():
+                ids = self._wait(inotify, watches)
+                if ids is None:
+                    new = self.api.states()
+                else:
+                    new = dict(current)
+                    for container_id in ids:
+                        new.pop(container_id, None)
+                    new.update(self.api.states(ids))
+                for event in changes(current, new):
+                    yield event
+                current = new
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _watch(
+            self,
+            inotify: Inotify,
+            watches: typing.Dict[int, str],
+            container_id: str,
+    ) -> None:
+        try:
+            wd = inotify.add_watch(
+                os.path.join(self.directory, container_id), CONTAINER_MASK
+            )
+        except OSError as ex:
+            # gone already, or out of watches; the rescans still see it
+            logger.debug("Can't watch container %s: %s", container_id, ex)
+            return
+        watches[wd] = container_id
+
+    def _wait(
+            self,
+            inotify: typing.Optional[Inotify],
+            watches: typing.Dict[int, str],
+    ) -> typing.Optional[typing.Set[str]]:
+        """ The ids of the containers that changed, None to rescan all """
+        if inotify is None:
+            self.closed.wait(self.interval)
+            return None
+
+        ids = set()  # type: typing.Set[str]
+        while not ids and not self.closed.is_set():
+            select.select([inotify.fileno()], [], [], self.interval)
+            for wd, mask, name in inotify.read():
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if wd in watches:
+                    ids.add(watches[wd])
+                    continue
+                if not name:
+                    continue
+                ids.add(name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch(inotify, watches, name)
+                else:
+                    for key in [
+                            key for key, value in watches.items()
+                            if value == name
+                    ]:
+                        del watches[key]
+        return ids
+
+
+def create_client(discovery: str = None):
+    """ The docker client, or the DirectoryClient standing in for it, as
+    configured in settings
+    """
+    discovery = (discovery or settings.DISCOVERY).lower()
+    if discovery == DISCOVERY_DIRECTORY:
+        return DirectoryClient(settings.CONTAINERS_DIR)
+    if discovery != DISCOVERY_DOCKER:
+        raise ValueError(
+            "Invalid discovery {!r}, expected one of {}".format(
+                discovery, ", ".join(DISCOVERIES)
+            )
+        )
+    return docker.from_env()
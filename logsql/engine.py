@@ -0,0 +1,380 @@
+"""
+Single-process tailing engine.
+
+Every container log is tailed by a coroutine running in one asyncio event
+loop instead of a client subprocess per container.  All tailers hand their
+batches to a single shared writer so that only one database connection is
+used, regardless of the number of containers.  Tailers are scheduled by
+their lag, see the lag module.
+
+The loop only schedules: reading and decoding the logs and the checkpoint
+I/O run in a pool of reader threads, the writes in the default executor,
+so a slow disk or a big catch-up doesn't stall the other tailers.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import typing
+import functools
+import concurrent.futures
+
+import sqlalchemy
+
+from . import client, db, metrics, settings
+from .checkpoint import OffsetFileStore
+from .codec import get_codec
+from .lag import MAX_BATCH_FACTOR, Lag, batch_size, idle_interval
+from .logpath import LogPath
+from .sink import Envelope, create_sink
+from .spool import Drainer, Spool
+from .transform import Pipeline, compile_pipeline
+from .watch import create_waiter
+
+
+logger = logging.getLogger(__name__)
+
+
+class Tailer:
+    """ Handle for one container tailed by the engine.
+
+    Mimics the part of subprocess.Popen used by the Monitor.
+    """
+
+    def __init__(
+            self,
+            container_id: str,
+            info: dict,
+            loop: asyncio.AbstractEventLoop = None,
+    ):
+        self.loop = loop
+        self.container_id = container_id
+        self.info = info
+        self.name = client.container_name(info)
+        self.task = None  # type: typing.Optional[asyncio.Task]
+        self.returncode = None
+        self.lag = Lag()
+        # reads in a row that found nothing
+        self.idle = 0
+
+    def poll(self) -> typing.Optional[int]:
+        """ None while the tailer is running, otherwise its return code """
+        return self.returncode
+
+    def terminate(self) -> None:
+        """ Stop tailing, callable from any thread """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+
+class Engine:
+    """ Runs the tailers of all containers in one event loop """
+
+    def __init__(
+            self,
+            engine: sqlalchemy.engine.Engine,
+            batch_size: int = client.DEFAULT_BATCH_SIZE,
+            interval: float = 1.0,
+            watch: bool = False,
+            checkpoints=None,
+            spool: Spool = None,
+            max_lines: int = None,
+    ):
+        self.engine = engine
+        self.codec = get_codec()
+        self.sink = create_sink(engine, self.codec)
+        self.spool = spool
+        self.drainer = Drainer(spool, engine, self.sink) \
+            if spool is not None else None
+        self.batch_size = batch_size
+        # lines committed per transaction at most, unless a single batch is
+        # bigger
+        self.max_lines = max_lines or batch_size * MAX_BATCH_FACTOR
+        self.interval = interval
+        self.watch = watch
+        self.checkpoints = checkpoints or OffsetFileStore()
+        if spool is not None and self.checkpoints.transactional:
+            # spooled batches aren't committed with their checkpoints
+            raise ValueError(
+                "A spool can't be used with a transactional checkpoint store"
+            )
+
+        self.loop = asyncio.new_event_loop()
+        self.reader = concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix="logsql-read"
+        )
+        self.queue = None  # type: typing.Optional[asyncio.PriorityQueue]
+        self.sequence = itertools.count()
+        self.tailers = {}  # type: typing.Dict[str, Tailer]
+        self.thread = None  # type: typing.Optional[threading.Thread]
+        # file descriptors watched by the loop for the waiters
+        self.readers = set()  # type: typing.Set[int]
+        self.lines_written = 0
+
+    def start(self) -> None:
+        """ Run the event loop in a background thread """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self) -> None:
+        """ Run the event loop in the current thread until stopped """
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.PriorityQueue()
+        writer = self.loop.create_task(self._writer())
+        if self.drainer is not None:
+            self.drainer.start()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self._shutdown(writer))
+            self.reader.shutdown(wait=True)
+            if hasattr(self.loop, "shutdown_default_executor"):
+                self.loop.run_until_complete(
+                    self.loop.shutdown_default_executor()
+                )
+            for fd in self.readers:
+                self.loop.remove_reader(fd)
+            self.readers.clear()
+            self.loop.close()
+            self.checkpoints.flush()
+            if self.drainer is not None:
+                self.drainer.stop()
+                self.spool.close()
+
+    async def _shutdown(self, writer: asyncio.Task) -> None:
+        """ Stop the writer, then the tailers.  The batch being written is
+        finished first, so that the checkpoints of its tailers are saved
+        instead of the batch being replayed on restart.
+        """
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+        tasks = [
+            tailer.task for tailer in self.tailers.values() if tailer.task
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        """ Stop the event loop """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread:
+            self.thread.join()
+
+    def add_container(
+            self,
+            container_id: str,
+            info: dict
+    ) -> Tailer:
+        """ Start tailing the given container, callable from any thread """
+        tailer = Tailer(container_id, info, self.loop)
+        self.tailers[container_id] = tailer
+        self.loop.call_soon_threadsafe(self._start_tailer, tailer)
+        return tailer
+
+    def _start_tailer(self, tailer: Tailer) -> None:
+        tailer.task = self.loop.create_task(self._tail(tailer))
+        tailer.task.add_done_callback(
+            lambda task: self._tailer_done(tailer, task)
+        )
+
+    def _tailer_done(self, tailer: Tailer, task: asyncio.Task) -> None:
+        if self.tailers.get(tailer.container_id) is tailer:
+            del self.tailers[tailer.container_id]
+        if task.cancelled():
+            tailer.returncode = -1
+            return
+        exc = task.exception()
+        if exc:
+            logger.error(
+                "Tailer for container %s failed: %r",
+                tailer.container_id, exc
+            )
+            tailer.returncode = 1
+        else:
+            tailer.returncode = 0
+
+    async def _call(
+            self,
+            func: typing.Callable,
+            *args,
+            cancelled: typing.Callable = None,
+    ):
+        """ Run func in a reader thread.  Cancelling waits for it to return,
+        then passes its result to cancelled: the tailer's LogPath can't be
+        closed while it is used.
+        """
+        future = self.loop.run_in_executor(self.reader, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            if cancelled is not None and not future.exception():
+                cancelled(future.result())
+            raise
+
+    async def _tail(self, tailer: Tailer) -> None:
+        path = tailer.info["LogPath"]
+        logger.info("%s started: %s", tailer.container_id, path)
+
+        # loads the checkpoint
+        log_path = await self._call(functools.partial(
+            LogPath,
+            path,
+            waiter=create_waiter(path) if self.watch else None,
+            read_size=settings.READ_SIZE,
+            catchup_size=settings.CATCHUP_SIZE,
+            checkpoints=self.checkpoints,
+            key=self.checkpoints.key(tailer.container_id, path),
+        ), cancelled=LogPath.close)
+        pipeline = compile_pipeline(tailer.info)
+        try:
+            done = False
+            while not done:
+                payloads, envelopes, done = await self._call(
+                    self._read, tailer, log_path, pipeline
+                )
+                if not payloads:
+                    if not done:
+                        await self._wait(
+                            log_path,
+                            idle_interval(self.interval, tailer.idle)
+                        )
+                        tailer.idle += 1
+                    continue
+                tailer.idle = 0
+
+                # the furthest behind are committed first
+                future = self.loop.create_future()
+                await self.queue.put((
+                    -tailer.lag.bytes, next(self.sequence),
+                    (tailer, log_path, payloads, envelopes, future)
+                ))
+                await future
+
+                if not self.checkpoints.transactional:
+                    await self._call(log_path.commit)
+        finally:
+            log_path.close()
+            metrics.LAG_BYTES.remove(tailer.name)
+            metrics.LAG_SECONDS.remove(tailer.name)
+
+    def _read(
+            self,
+            tailer: Tailer,
+            log_path: LogPath,
+            pipeline: Pipeline,
+    ) -> typing.Tuple[typing.List[str], typing.List[Envelope], bool]:
+        """ The next batch of the tailer, in a reader thread """
+        result = client.read_batch(
+            log_path, tailer.info["Name"],
+            batch_size(self.batch_size, tailer.lag), self.codec, pipeline
+        )
+        self._measure(tailer, log_path)
+        return result
+
+    @staticmethod
+    def _measure(tailer: Tailer, log_path: LogPath) -> None:
+        tailer.lag = log_path.lag()
+        metrics.LAG_BYTES.set(tailer.lag.bytes, tailer.name)
+        metrics.LAG_SECONDS.set(tailer.lag.seconds, tailer.name)
+
+    def lag(self) -> typing.Dict[str, Lag]:
+        """ The lag of every tailer as of its last batch, by container id """
+        return {
+            container_id: tailer.lag
+            for container_id, tailer in list(self.tailers.items())
+        }
+
+    async def _wait(self, log_path: LogPath, interval: float = None) -> None:
+        """ Asynchronous version of LogPath.wait """
+        interval = interval or self.interval
+        await self._call(self.checkpoints.flush)
+        waiter = log_path.waiter
+        fd = waiter.fileno() if waiter else None
+        if fd is None:
+            delay = waiter.delay(interval) if waiter else interval
+            await asyncio.sleep(delay)
+            return
+
+        # the inotify instance is shared by all tailers, its events are
+        # dispatched to their waiters by a single reader
+        if fd not in self.readers:
+            self.loop.add_reader(fd, waiter.hub.dispatch)
+            self.readers.add(fd)
+        if not waiter.pending:
+            ready = self.loop.create_future()
+            waiter.callback = lambda: ready.done() or ready.set_result(None)
+            try:
+                await asyncio.wait_for(ready, interval)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiter.callback = None
+        waiter.drain()
+
+    async def _writer(self) -> None:
+        """ Commit the batches of all tailers, one transaction of up to
+        max_lines lines at a time
+        """
+        while True:
+            items = [(await self.queue.get())[-1]]
+            lines = len(items[0][2])
+            while not self.queue.empty() and lines < self.max_lines:
+                items.append(self.queue.get_nowait()[-1])
+                lines += len(items[-1][2])
+
+            write = self.loop.run_in_executor(
+                None, db.retry, self._write, items
+            )
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # stopping, see _shutdown(): the write can't be interrupted
+                await asyncio.wait([write])
+                self._written(write, items)
+                raise
+            except Exception:  # pylint: disable=broad-except
+                # handed to the tailers
+                pass
+            self._written(write, items)
+
+    @staticmethod
+    def _written(write: asyncio.Future, items: list) -> None:
+        """ Wake up the tailers of the items once their write is done """
+        ex = write.exception()
+        for _, _, _, _, future in items:
+            if future.done():
+                # the tailer was terminated meanwhile
+                continue
+            if ex is not None:
+                future.set_exception(ex)
+            else:
+                future.set_result(None)
+
+    def _write(self, items: list) -> None:
+        if self.spool is not None:
+            self._spool(items)
+            return
+        with self.sink.begin(self.engine) as connection:
+            for tailer, log_path, payloads, envelopes, _ in items:
+                self.sink.write(
+                    connection, tailer.container_id, tailer.name, payloads,
+                    envelopes
+                )
+                if self.checkpoints.transactional:
+                    log_path.commit(connection)
+        self.lines_written += sum(len(item[2]) for item in items)
+
+    def _spool(self, items: list) -> None:
+        """ Append the batches to the spool, the drainer writes them """
+        for tailer, _, payloads, envelopes, _ in items:
+            self.spool.append(
+                tailer.container_id, tailer.name, payloads, envelopes
+            )
+        self.lines_written += sum(len(item[2]) for item in items)
@@ -0,0 +1,208 @@
+"""
+Ingest lag of the tailers.
+
+A tailer is behind by the bytes between its offset and the end of the log
+file, and by the time between the newest line docker wrote and the last
+line it read, both from docker's "time" field.  Only the tail of the file
+is read to find the newest line, so the lag is cheap enough to measure
+after every batch.
+
+The asyncio engine schedules its tailers by lag: the furthest behind get
+bigger batches and are committed first when the writer can't keep up,
+while idle ones are polled less and less often.
+
+    python3 -m logsql lag
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import datetime
+import typing
+
+from . import db, discovery, utils
+from .checkpoint import store_from_settings
+
+# bytes read from the end of the file to find the time of its last line
+TAIL_SIZE = 16 * 1024
+TIME_REGEX = re.compile(rb'"time":\s*"([^"]+)"')
+
+# lag over which batches grow, by one batch size per step
+LAG_STEP = 4 * 1024 * 1024
+MAX_BATCH_FACTOR = 4
+# idle tailers wait up to this many times the interval
+MAX_IDLE_FACTOR = 8
+
+
+class Lag:
+    """ How far a tailer is behind its log file """
+
+    def __init__(self, behind: int = 0, seconds: float = 0.0):
+        self.bytes = behind
+        self.seconds = seconds
+
+    def as_dict(self) -> dict:
+        """ The lag as a JSON serializable dict """
+        return {"bytes": self.bytes, "seconds": self.seconds}
+
+    def __eq__(self, other):
+        return isinstance(other, Lag) \
+            and (self.bytes, self.seconds) == (other.bytes, other.seconds)
+
+    def __repr__(self):
+        return "Lag(bytes={}, seconds={})".format(self.bytes, self.seconds)
+
+
+def line_time(
+        line: typing.Union[bytes, str, memoryview, None],
+) -> typing.Optional[datetime.datetime]:
+    """ The docker time of a json-file line, None if it has none """
+    if not line:
+        return None
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+    matches = TIME_REGEX.findall(line)
+    if not matches:
+        return None
+    return utils.parse_docker_time(matches[-1].decode("ascii", "replace"))
+
+
+def last_time(fd: int, end: int) -> typing.Optional[datetime.datetime]:
+    """ The docker time of the last line ending before end in the file """
+    size = min(TAIL_SIZE, end)
+    if size <= 0:
+        return None
+    data = os.pread(fd, size, end - size).rstrip()
+    return line_time(data[data.rfind(b"\n") + 1:])
+
+
+def first_time(fd: int, start: int) -> typing.Optional[datetime.datetime]:
+    """ The docker time of the line starting at start in the file """
+    data = os.pread(fd, TAIL_SIZE, start)
+    end = data.find(b"\n")
+    return line_time(data[:end] if end != -1 else data)
+
+
+def measure(
+        fd: int,
+        size: int,
+        offset: int,
+        ingested: datetime.datetime = None,
+) -> Lag:
+    """ The lag of a reader at offset of the open file, whose last line
+    read had the time ingested if known.  Before anything is read, that's
+    the time of the first line.
+    """
+    behind = max(0, size - offset)
+    if not behind:
+        return Lag()
+    if ingested is None:
+        ingested = last_time(fd, offset) if offset else first_time(fd, 0)
+    newest = last_time(fd, size)
+    seconds = 0.0
+    if newest is not None and ingested is not None:
+        seconds = max(0.0, (newest - ingested).total_seconds())
+    return Lag(behind, seconds)
+
+
+def measure_path(path: str, offset: int, inode: int) -> Lag:
+    """ The lag of a checkpoint of the file at path """
+    with open(path, "rb") as filp:
+        fd = filp.fileno()
+        stat = os.fstat(fd)
+        if stat.st_ino == inode:
+            return measure(fd, stat.st_size, offset)
+        newest = last_time(fd, stat.st_size)
+        ingested = first_time(fd, 0)
+
+    # rotated since, the reader resumes in the rotated file of the
+    # checkpoint (or the oldest one left) and reads all files after it
+    behind = stat.st_size
+    for rotated in reversed(utils.rotated_paths(path)):
+        try:
+            filp = open(rotated, "rb")
+        except FileNotFoundError:
+            continue
+        with filp:
+            fd = filp.fileno()
+            stat = os.fstat(fd)
+            if stat.st_ino == inode:
+                behind += max(0, stat.st_size - offset)
+                ingested = last_time(fd, offset) if offset \
+                    else first_time(fd, 0)
+                break
+            behind += stat.st_size
+            ingested = first_time(fd, 0)
+
+    if not behind:
+        return Lag()
+    seconds = 0.0
+    if newest is not None and ingested is not None:
+        seconds = max(0.0, (newest - ingested).total_seconds())
+    return Lag(behind, seconds)
+
+
+def batch_size(base: int, lag: Lag) -> int:
+    """ The batch size of a tailer, growing with its lag """
+    factor = 1 + lag.bytes // LAG_STEP
+    return base * min(factor, MAX_BATCH_FACTOR)
+
+
+def idle_interval(base: float, idle: int) -> float:
+    """ The polling interval of a tailer that read nothing idle times in a
+    row, doubling up to MAX_IDLE_FACTOR times base
+    """
+    return base * min(2 ** idle, MAX_IDLE_FACTOR)
+
+
+def main(args, out: typing.TextIO = None) -> int:
+    """ Lag entrypoint: the lag of every running container's checkpoint """
+    out = out or sys.stdout
+    engine = db.create_engine()
+    checkpoints = store_from_settings(engine)
+    client = discovery.create_client()
+
+    rows = []
+    for container in client.api.containers():
+        info = client.api.inspect_container(container["Id"])
+        path = info.get("LogPath")
+        if not path:
+            continue
+        checkpoint = checkpoints.read(checkpoints.key(info["Id"], path))
+        try:
+            lag = measure_path(
+                path,
+                checkpoint.offset if checkpoint else 0,
+                checkpoint.inode if checkpoint else -1,
+            )
+        except FileNotFoundError:
+            continue
+        rows.append((info["Name"], info["Id"], lag))
+    checkpoints.close()
+
+    rows.sort(key=lambda row: row[2].bytes, reverse=True)
+    if args.json:
+        for name, container_id, lag in rows:
+            out.write(json.dumps(dict(
+                lag.as_dict(), container_id=container_id, name=name
+            )) + "\n")
+    else:
+        out.write("{:<32} {:>14} {:>10}\n".format(
+            "container", "bytes", "seconds"
+        ))
+        for name, _, lag in rows:
+            out.write("{:<32} {:>14,d} {:>10.1f}\n".format(
+                name[:32], lag.bytes, lag.seconds
+            ))
+    return 0
+
+
+def parse_args(argv: typing.List[str] = None) -> argparse.Namespace:
+    """ Parse the arguments of the lag subcommand """
+    parser = argparse.ArgumentParser(prog="python3 -m logsql lag")
+    parser.add_argument(
+        "--json", action="store_true", default=False,
+        help="print NDJSON instead of a table"
+    )
+    return parser.parse_args(argv)
@@ -1,120 +1,455 @@
 """ Individual log file handling """
 import os
+import mmap
+import time
 import typing
 import logging
 
-from . import utils
-from .offsetfile import OffsetFile
+from . import metrics, utils
+from .checkpoint import OffsetFileStore
+from .lag import Lag, last_time, line_time, measure
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_READ_SIZE = 1024 * 1024
+
+WHITESPACE = frozenset(b" \t\r\n\x0b\x0c")
+
+# (path, file, inode) of the files of a log, see LogPath._open_chain()
+Chain = typing.List[typing.Tuple[str, typing.BinaryIO, int]]
+
 
 class LogPath:
-    """ Class representation of a particular log file. """
+    """ Class representation of a particular log file.
+
+    Data is read in chunks of at most read_size bytes into one reusable
+    buffer, so memory use is bounded by read_size (or the longest line)
+    no matter how far behind the reader is.
+
+    When more than catchup_size bytes are unread on open, the backlog is
+    first replayed from a read-only memory map of the file (catch-up mode)
+    and lines are sliced directly out of the mapping.
+
+    Rotations are followed through docker's rotated files (path.1, path.2,
+    ...): a checkpoint of a file rotated while nobody was reading resumes
+    in that file, and the reader walks forward from one file to the next
+    until it reaches the live one.
+    """
 
     def __init__(
             self,
             path: str,
             encoding: str = "utf-8",
             newline: bytes = b"\n",
+            waiter=None,
+            read_size: int = DEFAULT_READ_SIZE,
+            catchup_size: int = None,
+            checkpoints=None,
+            key: str = None,
     ):
         self.path = path
         self.encoding = encoding
         self.newline = newline
+        # optional logsql.watch waiter, see wait()
+        self.waiter = waiter
+        self.read_size = read_size
+        # where the offset is kept, by default an offset file next to path
+        self.checkpoints = checkpoints or OffsetFileStore()
+        self.key = key or path
 
-        self.offsetfile = OffsetFile.read(path)
-        self.buffer = b""
-        self.lines = []  # buffered lines
+        self.offsetfile = self.checkpoints.read(self.key)
+        # unconsumed data is buffer[start:end]
+        self.buffer = bytearray(read_size)
+        self.start = 0
+        self.end = 0
         self.count = 0  # number of read lines
+        # docker time of the last line read, see lag()
+        self.last_time = None
+        # reading a rotated file rather than the one at path
+        self.following = False
+        # reading what was written to the file after it was rotated
+        self.draining = False
+
+        # catch-up mode: unconsumed data is mapping[position:mapped_size]
+        self.mapping = None  # type: typing.Optional[mmap.mmap]
+        self.view = None  # type: typing.Optional[memoryview]
+        self.position = 0
+        self.mapped_size = 0
 
         inode = utils.inode_number(self.path)
 
         self.filp = open(self.path, "rb", buffering=0)
         if self.offsetfile:
-            if inode == self.offsetfile.inode:
-                self.filp.seek(self.offsetfile.offset, os.SEEK_SET)
-            else:
+            if inode != self.offsetfile.inode and not self._resume():
                 # There is no way to see if the file still exists but
-                # was renamed, i.e. we can't open by ino.
+                # was renamed elsewhere, i.e. we can't open by ino.
                 logger.warning("Inode changed, possible data loss")
                 self.offsetfile.reset(inode=inode)
+            self.filp.seek(self.offsetfile.offset, os.SEEK_SET)
         else:
-            self.offsetfile = OffsetFile(path, offset=0, inode=inode)
+            self.offsetfile = self.checkpoints.create(
+                self.key, offset=0, inode=inode
+            )
 
-    def _read_last_chunk(self):
-        chunk = self.filp.read()
-        if not chunk:
-            return
+        if catchup_size:
+            self._start_catchup(catchup_size)
 
-        last_index = chunk.rfind(self.newline)
-        if last_index != -1:
-            if last_index + len(self.newline) < len(chunk):
-                logger.warning(
-                    "Partial last line (not logged): %s",
-                    chunk[last_index + len(self.newline):].decode(
-                        self.encoding
-                    )
-                )
-            self.buffer += chunk[0: last_index]
+    def _open_chain(self) -> Chain:
+        """ Open the rotated files and the live one, oldest first.  The
+        inodes are those of the open files, so renames can't mix them up.
+        """
+        chain = []
+        for path in utils.rotated_paths(self.path) + [self.path]:
+            try:
+                filp = open(path, "rb", buffering=0)
+            except FileNotFoundError:
+                continue
+            chain.append((path, filp, os.fstat(filp.fileno()).st_ino))
+        return chain
+
+    def _switch(self, chain: Chain, index: int) -> None:
+        """ Continue with the index-th file of chain, closing the others """
+        for position, (_, filp, _) in enumerate(chain):
+            if position != index:
+                filp.close()
+        path, self.filp, _ = chain[index]
+        self.following = path != self.path
+
+    @staticmethod
+    def _next(chain: Chain, inode: int) -> int:
+        """ The index of the file written after the one with inode in
+        chain.  If that one is gone, e.g. rotated out by max-file, it's
+        the oldest file left.
+        """
+        for index, (_, _, other) in enumerate(chain):
+            if other == inode:
+                return index + 1
+        return 0
+
+    def _resume(self) -> bool:
+        """ On open, continue in the rotated file the checkpoint refers to.
+
+        If it was rotated out, starts at the beginning of the oldest file
+        left.  Returns False when there are no rotated files.
+        """
+        chain = self._open_chain()
+        if len(chain) < 2:
+            for _, filp, _ in chain:
+                filp.close()
+            return False
+
+        index = self._next(chain, self.offsetfile.inode) - 1
+        if index >= 0:
+            logger.info(
+                "Resuming %s from rotated %s", self.path, chain[index][0]
+            )
         else:
+            index = 0
             logger.warning(
-                "Partial chunk (not logged): %s",
+                "%s rotated past the checkpoint, possible data loss; "
+                "resuming from %s", self.path, chain[index][0]
             )
+            self.offsetfile.reset(inode=chain[index][2])
+        self.filp.close()
+        self._switch(chain, index)
+        return True
 
-        lines = self.buffer.split(self.newline)
-        for line in lines:
-            line = line.strip()
-            if line:
-                self.lines.append(line.decode(self.encoding))
-        self.buffer = b""
-
-    def _readline_from_buffer(self):
-        index = self.buffer.find(self.newline)
-        if index == -1:
-            return None
-        result = self.buffer[0:index]
-        length = index + len(self.newline)
-        self.offsetfile.offset += length
-        self.buffer = self.buffer[length:]
-        return result.decode(self.encoding).strip() or None
+    def _start_catchup(self, catchup_size: int) -> None:
+        size = os.fstat(self.filp.fileno()).st_size
+        if size - self.offsetfile.offset < catchup_size:
+            return
 
-    def readline(self) -> typing.Optional[str]:
-        """ Read one line of the log file if available """
-        inode = utils.inode_number(self.path)
-        if inode != self.offsetfile.inode:
-            # file change/rotation, read all remaining data.
-            self._read_last_chunk()
-            self.offsetfile.reset(inode=inode)
+        logger.info(
+            "Catching up on %d bytes of %s",
+            size - self.offsetfile.offset, self.path
+        )
+        self.mapping = mmap.mmap(
+            self.filp.fileno(), size, access=mmap.ACCESS_READ
+        )
+        if hasattr(self.mapping, "madvise"):
+            self.mapping.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self.mapping)
+        self.position = self.offsetfile.offset
+        self.mapped_size = size
 
-            if inode != -1:
-                self.offsetfile.save()
+    def _stop_catchup(self) -> None:
+        """ Continue with the regular reader where the mapping ends """
+        self.filp.seek(self.position, os.SEEK_SET)
+        self.view.release()
+        self.view = None
+        try:
+            self.mapping.close()
+        except BufferError:
+            # raw lines still reference it, it's unmapped once they are gone
+            pass
+        self.mapping = None
 
-            self.filp.close()
+    def _readlines_mapped(
+            self,
+            max_lines: int = None,
+            max_bytes: int = None,
+            raw: bool = False,
+    ) -> list:
+        """ readlines() in catch-up mode.
+
+        Raw lines are memoryview slices of the mapping instead of copies.
+        """
+        mapping = self.mapping
+        view = self.view
+        newline_length = len(self.newline)
+        start = self.position
+        lines = []
+        while True:
+            index = mapping.find(self.newline, self.position, self.mapped_size)
+            if index == -1:
+                self._stop_catchup()
+                break
 
-            if inode != -1:
-                self.filp = open(self.path, "rb")
+            begin = self.position
+            self.position = index + newline_length
+            if begin == index:
+                continue
+            if mapping[begin] in WHITESPACE or \
+                    mapping[index - 1] in WHITESPACE:
+                line = bytes(view[begin:index]).strip()
+                if not line:
+                    continue
+                lines.append(line if raw else line.decode(self.encoding))
+            elif raw:
+                lines.append(view[begin:index])
             else:
-                self.filp = None
+                lines.append(str(view[begin:index], self.encoding))
+
+            if max_lines is not None and len(lines) >= max_lines:
+                break
+            if max_bytes is not None and self.position - start >= max_bytes:
+                break
+
+        self.offsetfile.offset += self.position - start
+        self.count += len(lines)
+        if lines:
+            self.last_time = line_time(lines[-1]) or self.last_time
+        return lines
+
+    def _fill(self) -> bool:
+        """ Read the next chunk into the buffer.
+
+        Returns False when there is nothing more to read right now.
+        """
+        remaining = self.end - self.start
+        if self.start:
+            # move the partial line to the front, in place
+            with memoryview(self.buffer) as view:
+                view[0:remaining] = view[self.start:self.end]
+            self.start = 0
+            self.end = remaining
+
+        if self.end == len(self.buffer):
+            # a single line longer than the buffer
+            self.buffer.extend(bytes(len(self.buffer)))
+        elif self.end < self.read_size < len(self.buffer):
+            # the long line is gone, shrink back
+            del self.buffer[self.read_size:]
+
+        with memoryview(self.buffer) as view:
+            count = self.filp.readinto(
+                view[self.end:self.end + self.read_size]
+            )
+        if count:
+            self.end += count
+            return True
+        return self._rotate()
+
+    def _rotate(self) -> bool:
+        """ At EOF, switch to the next file if the log was rotated.
+
+        That is the live file unless the log rotated more than once since,
+        then the rotated files in between are read first.
+        """
+        if not self.following and not self.draining \
+                and self.waiter is not None and not self.waiter.rotated():
+            return False
+
+        inode = utils.inode_number(self.path)
+        if inode == self.offsetfile.inode:
+            return False
 
-        # Cached line, nothing else is changed
-        if self.lines:
-            return self.lines.pop(0)
+        # docker may have written more between our EOF and the stat: read
+        # the old file to its end first, its lines count to its offset
+        with memoryview(self.buffer) as view:
+            count = self.filp.readinto(
+                view[self.end:self.end + self.read_size]
+            )
+        if count:
+            self.end += count
+            self.draining = True
+            return True
+        self.draining = False
+
+        if self.end > self.start:
+            logger.warning(
+                "Partial last line (not logged): %s",
+                self.buffer[self.start:self.end].decode(
+                    self.encoding, errors="replace"
+                )
+            )
+        self.start = self.end = 0
+
+        chain = self._open_chain()
+        index = self._next(chain, self.offsetfile.inode)
+        self.filp.close()
+
+        if index == len(chain):
+            # removed, the current file was the last one
+            for _, filp, _ in chain:
+                filp.close()
+            self.offsetfile.reset(inode=-1)
+            self.filp = None
+            self.following = False
+            return False
+
+        self._switch(chain, index)
+        # only committed with the batch: until then, a restart resumes in
+        # the old file, found among the rotated ones
+        self.offsetfile.reset(inode=chain[index][2])
+        if self.following:
+            logger.info("Following %s to %s", self.path, chain[index][0])
+
+        if self.waiter is not None:
+            self.waiter.rewatch()
+        return True
+
+    def readlines(
+            self,
+            max_lines: int = None,
+            max_bytes: int = None,
+            raw: bool = False,
+    ) -> typing.List[typing.Union[str, bytes]]:
+        """ Read the complete lines that are available, up to max_lines
+        lines and (roughly) max_bytes bytes.
 
+        Blank lines are skipped, the others are stripped and decoded
+        unless raw is set.  Raw lines are bytes, or memoryview slices of
+        the mapping in catch-up mode.  The offset is advanced once for the
+        batch.
+        """
         if self.filp is None:
             raise FileNotFoundError(self.path)
 
-        self.buffer += self.filp.read()
+        if self.mapping is not None:
+            return self._readlines_mapped(max_lines, max_bytes, raw)
 
-        result = self._readline_from_buffer()
-        if result:
-            self.count += 1
-        return result
+        newline_length = len(self.newline)
+        lines = []
+        consumed = 0  # not yet added to the offset
+        total = 0
+        full = False
+        while True:
+            with memoryview(self.buffer) as view:
+                while True:
+                    index = self.buffer.find(
+                        self.newline, self.start, self.end
+                    )
+                    if index == -1:
+                        break
+                    line = bytes(view[self.start:index]).strip()
+                    length = index + newline_length - self.start
+                    self.start += length
+                    consumed += length
+                    total += length
+                    if line:
+                        lines.append(
+                            line if raw else line.decode(self.encoding)
+                        )
+                    if max_lines is not None and len(lines) >= max_lines:
+                        full = True
+                    elif max_bytes is not None and total >= max_bytes:
+                        full = True
+                    if full:
+                        break
+            if full:
+                break
+            # offsets must be accounted to the file they came from
+            self.offsetfile.offset += consumed
+            consumed = 0
+            if not self._fill():
+                break
+
+        self.offsetfile.offset += consumed
+        self.count += len(lines)
+        if lines:
+            self.last_time = line_time(lines[-1]) or self.last_time
+            if self.waiter is not None:
+                self.waiter.reset()
+        return lines
+
+    def readline(self) -> typing.Optional[str]:
+        """ Read one line of the log file if available """
+        lines = self.readlines(max_lines=1)
+        return lines[0] if lines else None
+
+    def lag(self) -> Lag:
+        """ How far the reader is behind the end of the file """
+        if self.filp is None:
+            return Lag()
+        fd = self.filp.fileno()
+        lag = measure(
+            fd, os.fstat(fd).st_size, self.offsetfile.offset, self.last_time
+        )
+        if self.following:
+            lag = self._chain_lag(lag)
+        return lag
+
+    def _chain_lag(self, lag: Lag) -> Lag:
+        """ Add the files written after the rotated one being read """
+        chain = self._open_chain()
+        try:
+            newer = chain[self._next(chain, self.offsetfile.inode):]
+            if not newer:
+                return lag
+            behind = lag.bytes
+            for _, filp, _ in newer:
+                behind += os.fstat(filp.fileno()).st_size
+            fd = newer[-1][1].fileno()
+            newest = last_time(fd, os.fstat(fd).st_size)
+        finally:
+            for _, filp, _ in chain:
+                filp.close()
+        seconds = lag.seconds
+        if newest is not None and self.last_time is not None:
+            seconds = max(0.0, (newest - self.last_time).total_seconds())
+        return Lag(behind, seconds)
 
-    def commit(self) -> None:
-        """ Write the offset to disk """
-        self.offsetfile.save()
+    def wait(self, timeout: float) -> None:
+        """ Block until new data may be available, at most timeout seconds.
+
+        Without a waiter this simply sleeps for timeout.  Being idle,
+        queued checkpoints are flushed first.
+        """
+        self.checkpoints.flush()
+        if self.waiter is None:
+            time.sleep(timeout)
+        else:
+            self.waiter.wait(timeout)
+
+    def commit(self, connection=None) -> None:
+        """ Write the offset to disk.
+
+        With a transactional checkpoint store, the offset is written as
+        part of the given database connection's transaction instead.
+        """
+        with metrics.CHECKPOINT_SECONDS.time():
+            if connection is not None:
+                self.checkpoints.save(self.offsetfile, connection)
+            else:
+                self.offsetfile.save()
 
     def close(self) -> None:
         """ Release all resources """
-        self.filp.close()
+        if self.mapping is not None:
+            self._stop_catchup()
+        if self.filp:
+            self.filp.close()
+        if self.waiter is not None:
+            self.waiter.close()
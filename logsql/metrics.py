@@ -0,0 +1,492 @@
+"""
+Runtime metrics in the Prometheus text format.
+
+With LOGSQL_METRICS_PORT set, the monitor serves /metrics on
+LOGSQL_METRICS_ADDRESS.  Client subprocesses and pool workers can't be
+scraped themselves: every LOGSQL_METRICS_INTERVAL seconds they write a
+snapshot of their metrics to <pid>.json in LOGSQL_METRICS_DIR, which the
+monitor sums into its own on every scrape.  Counters and histograms of
+exited processes are kept, their gauges are dropped.
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import tempfile
+import threading
+import typing
+import http.server
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = typing.Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(names: typing.Sequence[str], values: Labels) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, _escape(value))
+        for name, value in zip(names, values)
+    ) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """ Base class of the metric types, values are kept by label values """
+    type = ""
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}  # type: typing.Dict[Labels, typing.Any]
+
+    def snapshot(self) -> dict:
+        """ The metric as JSON serializable data """
+        with self.lock:
+            values = [[list(labels), self.copy(value)]
+                      for labels, value in self.values.items()]
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "values": values,
+        }
+
+    @staticmethod
+    def copy(value: typing.Any) -> typing.Any:
+        """ A copy of a value that isn't changed by later updates """
+        return value
+
+    def remove(self, *labels: str) -> None:
+        """ Forget the value of the given label values """
+        with self.lock:
+            self.values.pop(labels, None)
+
+    def reset(self) -> None:
+        """ Forget all values """
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    """ A monotonically increasing value """
+    type = COUNTER
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        """ Increase the value of the given label values """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """ A value that goes up and down, or is computed when collected """
+    type = GAUGE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.function = None  # type: typing.Optional[typing.Callable]
+
+    def set(self, value: float, *labels: str) -> None:
+        """ Set the value of the given label values """
+        with self.lock:
+            self.values[labels] = value
+
+    def set_function(
+            self,
+            function: typing.Optional[typing.Callable[[], typing.Any]],
+    ) -> None:
+        """ Compute the value when collected.  With labels, the function
+        returns the values by label values.
+        """
+        self.function = function
+        if function is None:
+            self.reset()
+
+    def snapshot(self):
+        if self.function is not None:
+            value = self.function()
+            with self.lock:
+                if self.labelnames:
+                    self.values = dict(value)
+                else:
+                    self.values[()] = value
+        return super().snapshot()
+
+
+class Histogram(Metric):
+    """ Observations counted in buckets, kept as the count per bucket
+    followed by the sum
+    """
+    type = HISTOGRAM
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = (),
+            buckets: typing.Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, *labels: str) -> None:
+        """ Count an observation """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * len(self.buckets) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self) -> "Timer":
+        """ A context manager observing its duration in seconds """
+        return Timer(self)
+
+    @staticmethod
+    def copy(value):
+        return list(value)
+
+    def snapshot(self):
+        result = super().snapshot()
+        result["buckets"] = [
+            _format_value(bucket) for bucket in self.buckets
+        ]
+        return result
+
+
+class Timer:
+    """ Observes the time spent in a with block """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """ The metrics of the process """
+
+    def __init__(self):
+        self.metrics = {}  # type: typing.Dict[str, Metric]
+
+    def register(self, metric: Metric) -> Metric:
+        """ Add a metric, returns it """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> typing.Dict[str, dict]:
+        """ All metrics as JSON serializable data """
+        return {
+            name: metric.snapshot() for name, metric in self.metrics.items()
+        }
+
+
+def merge(
+        target: typing.Dict[str, dict],
+        source: typing.Dict[str, dict],
+        gauges: bool = True,
+) -> typing.Dict[str, dict]:
+    """ Add the values of the source snapshot to the target snapshot """
+    for name, metric in source.items():
+        if metric["type"] == GAUGE and not gauges:
+            continue
+        merged = target.setdefault(name, dict(metric, values=[]))
+        values = {tuple(labels): value for labels, value in merged["values"]}
+        for labels, value in metric["values"]:
+            labels = tuple(labels)
+            if labels not in values:
+                values[labels] = value
+            elif metric["type"] == HISTOGRAM:
+                values[labels] = [
+                    mine + theirs
+                    for mine, theirs in zip(values[labels], value)
+                ]
+            else:
+                values[labels] += value
+        merged["values"] = [
+            [list(labels), value] for labels, value in values.items()
+        ]
+    return target
+
+
+def render(snapshot: typing.Dict[str, dict]) -> str:
+    """ A snapshot in the Prometheus text format """
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        names = metric["labelnames"]
+        lines.append("# HELP {} {}".format(name, metric["help"]))
+        lines.append("# TYPE {} {}".format(name, metric["type"]))
+        for labels, value in sorted(metric["values"]):
+            labels = tuple(labels)
+            if metric["type"] != HISTOGRAM:
+                lines.append("{}{} {}".format(
+                    name, _format_labels(names, labels), _format_value(value)
+                ))
+                continue
+            cumulative = 0
+            for bucket, count in zip(metric["buckets"], value):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    name,
+                    _format_labels(names + ["le"], labels + (bucket,)),
+                    cumulative
+                ))
+            lines.append("{}_sum{} {}".format(
+                name, _format_labels(names, labels), _format_value(value[-1])
+            ))
+            lines.append("{}_count{} {}".format(
+                name, _format_labels(names, labels), cumulative
+            ))
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+LINES_READ = REGISTRY.register(Counter(
+    "logsql_lines_read_total", "Log lines read", ["container"]
+))
+BYTES_READ = REGISTRY.register(Counter(
+    "logsql_bytes_read_total", "Bytes of log lines read", ["container"]
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "logsql_batch_lines", "Lines per batch", buckets=SIZE_BUCKETS
+))
+DECODE_SECONDS = REGISTRY.register(Histogram(
+    "logsql_decode_seconds", "Time decoding the JSON lines of a batch"
+))
+TRANSFORM_SECONDS = REGISTRY.register(Histogram(
+    "logsql_transform_seconds", "Time transforming a batch"
+))
+COMMIT_SECONDS = REGISTRY.register(Histogram(
+    "logsql_commit_seconds", "Time writing and committing a transaction"
+))
+CHECKPOINT_SECONDS = REGISTRY.register(Histogram(
+    "logsql_checkpoint_save_seconds", "Time saving a log checkpoint"
+))
+LAG_BYTES = REGISTRY.register(Gauge(
+    "logsql_lag_bytes", "Bytes of the log not read yet", ["container"]
+))
+LAG_SECONDS = REGISTRY.register(Gauge(
+    "logsql_lag_seconds",
+    "Time between the newest log line and the last one read", ["container"]
+))
+CLIENTS = REGISTRY.register(Gauge(
+    "logsql_clients", "Live client subprocesses of the monitor"
+))
+WORKER_CONTAINERS = REGISTRY.register(Gauge(
+    "logsql_worker_containers", "Containers tailed by a worker of the pool",
+    ["worker"]
+))
+WORKER_LINES = REGISTRY.register(Gauge(
+    "logsql_worker_lines", "Lines written by a worker since it started",
+    ["worker"]
+))
+SPOOL_SEGMENTS = REGISTRY.register(Gauge(
+    "logsql_spool_segments", "Segments of a spool not written yet",
+    ["spool"]
+))
+SPOOL_BYTES = REGISTRY.register(Gauge(
+    "logsql_spool_bytes", "Bytes of a spool not written yet", ["spool"]
+))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Collector:
+    """ The metrics of this process and the snapshots of its children """
+
+    def __init__(self, directory: str, registry: Registry = REGISTRY):
+        self.directory = directory
+        self.registry = registry
+        # counters and histograms of exited children
+        self.exited = {}  # type: typing.Dict[str, dict]
+        self.lock = threading.Lock()
+
+    def collect(self) -> typing.Dict[str, dict]:
+        """ The snapshot of the whole host """
+        result = merge({}, self.registry.snapshot())
+        with self.lock:
+            for filename in sorted(os.listdir(self.directory)):
+                stem, suffix = os.path.splitext(filename)
+                if suffix != ".json" or not stem.isdigit():
+                    continue
+                path = os.path.join(self.directory, filename)
+                try:
+                    with open(path) as filp:
+                        snapshot = json.load(filp)
+                except (OSError, ValueError):
+                    continue
+                if _pid_alive(int(stem)):
+                    merge(result, snapshot)
+                else:
+                    merge(self.exited, snapshot, gauges=False)
+                    os.remove(path)
+            merge(result, self.exited)
+        return result
+
+
+def write_snapshot(directory: str, registry: Registry = REGISTRY) -> None:
+    """ Replace this process' snapshot in directory """
+    path = os.path.join(directory, "{}.json".format(os.getpid()))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as filp:
+        json.dump(registry.snapshot(), filp)
+    os.replace(tmp_path, path)
+
+
+class Exporter:
+    """ Writes the snapshots of a child process """
+
+    def __init__(
+            self,
+            directory: str,
+            interval: float = 5.0,
+            registry: Registry = REGISTRY,
+    ):
+        self.directory = directory
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = None  # type: typing.Optional[threading.Thread]
+
+    def write(self) -> None:
+        """ Write the snapshot now """
+        try:
+            write_snapshot(self.directory, self.registry)
+        except OSError as ex:
+            logger.debug("Writing metrics failed: %s", ex)
+
+    def run(self) -> None:
+        """ Write the snapshot every interval until stopped """
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start(self) -> None:
+        """ Write in a background thread, and once more at exit """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """ Stop the background thread after a last write """
+        self.stopped.set()
+        self.write()
+
+
+def start_exporter() -> typing.Optional[Exporter]:
+    """ Export the metrics of a child process if the monitor collects
+    them
+    """
+    if not settings.METRICS_DIR:
+        return None
+    exporter = Exporter(settings.METRICS_DIR, settings.METRICS_INTERVAL)
+    exporter.start()
+    return exporter
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serves GET /metrics """
+    collector = None  # type: Collector
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Respond with the collected metrics """
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render(self.collector.collect()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+def serve(
+        port: int = None,
+        address: str = None,
+        directory: str = None,
+) -> typing.Optional[http.server.HTTPServer]:
+    """ Serve the metrics of this process and its children in a background
+    thread, None if no port is configured.
+
+    The children find the snapshot directory in the environment.
+    """
+    port = port if port is not None else settings.METRICS_PORT
+    if not port:
+        return None
+    directory = directory or settings.METRICS_DIR \
+        or tempfile.mkdtemp(prefix="logsql-metrics-")
+    os.makedirs(directory, exist_ok=True)
+    settings.METRICS_DIR = directory
+    os.environ["LOGSQL_METRICS_DIR"] = directory
+
+    handler = type("Handler", (Handler,), {
+        "collector": Collector(directory)
+    })
+    server = http.server.ThreadingHTTPServer(
+        (address or settings.METRICS_ADDRESS, port), handler
+    )
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info(
+        "Serving metrics on http://%s:%d/metrics", *server.server_address[:2]
+    )
+    return server
@@ -0,0 +1,226 @@
+"""
+Schema upgrades of existing databases.
+
+create_all() only creates missing tables, so columns and indexes added to
+the models later are added here.
+
+A logs table from before the containers table is renamed to logs_legacy
+and replaced by the logs view.  Its rows are moved into log_entries, and
+rows written before the typed columns existed are backfilled from their
+JSON payload, with:
+
+    python3 -m logsql.migrations --backfill
+"""
+import sys
+import logging
+import argparse
+import typing
+
+import sqlalchemy
+
+from . import containers, db, models, utils
+from .sink import envelope_fields
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+LEGACY_TABLE = "logs_legacy"
+
+
+def migrate(
+        engine: sqlalchemy.engine.Engine
+) -> None:
+    """ Bring the schema up to date, cheap if it already is """
+    inspector = sqlalchemy.inspect(engine)
+    if models.LOGS_VIEW in inspector.get_table_names():
+        logger.warning(
+            "Renaming table %s to %s, move its rows with --backfill",
+            models.LOGS_VIEW, LEGACY_TABLE
+        )
+        with engine.begin() as connection:
+            connection.execute("ALTER TABLE {} RENAME TO {}".format(
+                models.LOGS_VIEW, LEGACY_TABLE
+            ))
+    models.BASE.metadata.create_all(bind=engine)
+    upgrade(engine)
+    models.create_views(engine)
+
+
+def upgrade(
+        engine: sqlalchemy.engine.Engine,
+        table: sqlalchemy.Table = models.Log.__table__,
+) -> typing.List[str]:
+    """ Add the (nullable) columns and the indexes of table that are
+    missing in the database, returns their names
+    """
+    inspector = sqlalchemy.inspect(engine)
+    if table.name not in inspector.get_table_names():
+        return []
+    columns = {column["name"] for column in inspector.get_columns(table.name)}
+    indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+
+    added = []
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                raise RuntimeError(
+                    "Can't add NOT NULL column {}.{}".format(
+                        table.name, column.name
+                    )
+                )
+            if isinstance(column.type, sqlalchemy.Enum):
+                column.type.create(connection, checkfirst=True)
+            connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                table.name, column.name,
+                column.type.compile(dialect=engine.dialect)
+            ))
+            added.append(column.name)
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                index.create(connection)
+                added.append(index.name)
+
+    for name in added:
+        logger.info("Added %s to table %s", name, table.name)
+    return added
+
+
+def move_legacy(
+        engine: sqlalchemy.engine.Engine,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """ Move the rows of the legacy logs table into log_entries, one
+    transaction per batch, and drop it once empty.  Returns the number of
+    rows moved.
+    """
+    if LEGACY_TABLE not in sqlalchemy.inspect(engine).get_table_names():
+        return 0
+    legacy = sqlalchemy.Table(
+        LEGACY_TABLE, sqlalchemy.MetaData(), autoload_with=engine
+    )
+    log = models.Log.__table__
+    container = models.Container.__table__
+
+    with engine.begin() as connection:
+        for container_id, name in connection.execute(
+                sqlalchemy.select([
+                    legacy.c.container_id,
+                    sqlalchemy.func.max(legacy.c.container_name),
+                ]).group_by(legacy.c.container_id)
+        ):
+            containers.ensure(connection, container_id, name)
+
+    # the typed columns may not have been added to the legacy table
+    columns = [
+        name for name in ("json", "created_at", "event_time", "stream",
+                          "message")
+        if name in legacy.c
+    ]
+    next_id = sqlalchemy.select([legacy.c.id]).order_by(legacy.c.id) \
+        .offset(batch_size - 1).limit(1)
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            upto = connection.execute(next_id).scalar()
+            if upto is None:
+                upto = connection.execute(
+                    sqlalchemy.select([sqlalchemy.func.max(legacy.c.id)])
+                ).scalar()
+                if upto is None:
+                    break
+            select = sqlalchemy.select(
+                [container.c.id] + [legacy.c[name] for name in columns]
+            ).select_from(legacy.join(
+                container, legacy.c.container_id == container.c.container_id
+            )).where(legacy.c.id <= upto).order_by(legacy.c.id)
+            moved = connection.execute(log.insert().from_select(
+                ["container_key"] + columns, select
+            )).rowcount
+            connection.execute(legacy.delete().where(legacy.c.id <= upto))
+        total += moved
+        logger.info("Moved %d rows from %s", total, LEGACY_TABLE)
+
+    legacy.drop(bind=engine)
+    logger.info("Dropped %s", LEGACY_TABLE)
+    return total
+
+
+def backfill(
+        engine: sqlalchemy.engine.Engine,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """ Fill the envelope columns of the logs written before they existed,
+    one transaction per batch.  Returns the number of rows updated.
+    """
+    table = models.Log.__table__
+    select = sqlalchemy.select([table.c.id, table.c.json]).where(
+        sqlalchemy.and_(
+            table.c.event_time.is_(None),
+            table.c.stream.is_(None),
+            table.c.message.is_(None),
+            table.c.id > sqlalchemy.bindparam("after"),
+        )
+    ).order_by(table.c.id).limit(batch_size)
+    update = table.update().where(
+        table.c.id == sqlalchemy.bindparam("row_id")
+    ).values(
+        event_time=sqlalchemy.bindparam("new_event_time"),
+        stream=sqlalchemy.bindparam("new_stream"),
+        message=sqlalchemy.bindparam("new_message"),
+    )
+
+    total = 0
+    after = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select, after=after).fetchall()
+            if not rows:
+                break
+            params = []
+            for row in rows:
+                event_time, stream, message = envelope_fields(row.json)
+                if event_time or stream or message is not None:
+                    params.append({
+                        "row_id": row.id,
+                        "new_event_time": utils.parse_docker_time(event_time),
+                        "new_stream": stream,
+                        "new_message": message,
+                    })
+            if params:
+                connection.execute(update, params)
+        total += len(params)
+        after = rows[-1].id
+        logger.info("Backfilled %d rows, up to id %d", total, after)
+    return total
+
+
+def main(args) -> int:
+    """ Upgrade the schema and optionally backfill the logs """
+    logging.basicConfig(level=logging.INFO)
+    engine = db.create_engine()
+    db.retry(migrate, engine)
+    if args.backfill:
+        move_legacy(engine, args.batch_size)
+        backfill(engine, args.batch_size)
+    return 0
+
+
+def init():
+    """ Module initialization """
+    if __name__ == "__main__":
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            "--backfill", action="store_true", default=False,
+            help="move the rows of the legacy logs table and fill the "
+                 "typed columns of existing logs"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=DEFAULT_BATCH_SIZE
+        )
+        sys.exit(main(parser.parse_args()))
+
+
+init()
@@ -3,17 +3,26 @@
 import datetime
 
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import declarative_base
 
+from . import settings
+
 
 BASE = declarative_base()
 Session = sessionmaker()
 
+# values of the stream column, anything else is stored as NULL
+STREAMS = ("stdout", "stderr")
+
+# the view joining log entries with their container, see create_views()
+LOGS_VIEW = "logs"
 
-class Log(BASE):
-    """ An instance representing one line of a log file """
-    __tablename__ = "logs"
+
+class Container(BASE):
+    """ A docker container, referenced by its log entries """
+    __tablename__ = "containers"
 
     id = sqlalchemy.Column(
         sqlalchemy.Integer,
@@ -24,11 +33,72 @@ class Log(BASE):
     container_id = sqlalchemy.Column(
         sqlalchemy.String(64),
         nullable=False,
+        unique=True,
     )
 
-    container_name = sqlalchemy.Column(
+    name = sqlalchemy.Column(
         sqlalchemy.String(128),
-        nullable=False
+        nullable=False,
+    )
+
+    image = sqlalchemy.Column(
+        sqlalchemy.String(256),
+        nullable=True,
+    )
+
+    labels = sqlalchemy.Column(
+        sqlalchemy.JSON,
+        nullable=True,
+    )
+
+    started_at = sqlalchemy.Column(
+        sqlalchemy.DateTime(timezone=True),
+        nullable=True,
+    )
+
+    stopped_at = sqlalchemy.Column(
+        sqlalchemy.DateTime(timezone=True),
+        nullable=True,
+    )
+
+
+class Log(BASE):
+    """ An instance representing one line of a log file """
+    __tablename__ = "log_entries"
+    __table_args__ = (
+        sqlalchemy.Index(
+            "ix_log_entries_container_key_event_time",
+            "container_key", "event_time"
+        ),
+        # keyset pagination, see logsql.query
+        sqlalchemy.Index(
+            "ix_log_entries_created_at_id", "created_at", "id"
+        ),
+        # partitions are managed by logsql.partitions
+        {"postgresql_partition_by": "RANGE (created_at)"}
+        if settings.PARTITION_INTERVAL else {},
+    )
+
+    id = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        primary_key=True,
+        autoincrement=True,
+    )
+
+    container_key = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey(Container.id),
+        nullable=False,
+    )
+
+    container = relationship(Container)
+    container_id = association_proxy(
+        "container", "container_id",
+        creator=lambda container_id: Container(container_id=container_id)
+    )
+    container_name = association_proxy(
+        "container", "name",
+        creator=lambda name: Container(name=name)
     )
 
     json = sqlalchemy.Column(
@@ -36,10 +106,29 @@ class Log(BASE):
         nullable=False,
     )
 
+    # the partition key has to be part of the primary key
     created_at = sqlalchemy.Column(
         sqlalchemy.DateTime,
         default=datetime.datetime.utcnow,
         nullable=False,
+        primary_key=bool(settings.PARTITION_INTERVAL),
+    )
+
+    # the fields of docker's json-file envelope, NULL if missing
+    event_time = sqlalchemy.Column(
+        sqlalchemy.DateTime(timezone=True),
+        nullable=True,
+        index=True,
+    )
+
+    stream = sqlalchemy.Column(
+        sqlalchemy.Enum(*STREAMS, name="log_stream"),
+        nullable=True,
+    )
+
+    message = sqlalchemy.Column(
+        sqlalchemy.Text,
+        nullable=True,
     )
 
     def as_dict(self):
@@ -49,5 +138,66 @@ class Log(BASE):
             "container_id": self.container_id,
             "container_name": self.container_name,
             "json": self.json,
-            "created_at": self.created_at.isoformat()
+            "created_at": self.created_at.isoformat(),
+            "event_time": self.event_time.isoformat()
+            if self.event_time else None,
+            "stream": self.stream,
+            "message": self.message,
         }
+
+
+class Checkpoint(BASE):
+    """ The read position of a container's log file, written in the same
+    transaction as its logs
+    """
+    __tablename__ = "checkpoints"
+
+    container_id = sqlalchemy.Column(
+        sqlalchemy.String(64),
+        primary_key=True,
+    )
+
+    inode = sqlalchemy.Column(
+        sqlalchemy.BigInteger,
+        nullable=False,
+    )
+
+    offset = sqlalchemy.Column(
+        sqlalchemy.BigInteger,
+        nullable=False,
+    )
+
+    updated_at = sqlalchemy.Column(
+        sqlalchemy.DateTime,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+        nullable=False,
+    )
+
+
+def create_views(
+        engine: sqlalchemy.engine.Engine
+) -> None:
+    """ Create the logs view, with the columns the logs table had before
+    the containers were split off, unless it exists
+    """
+    log = Log.__table__
+    container = Container.__table__
+    select = sqlalchemy.select([
+        log.c.id,
+        container.c.container_id,
+        container.c.name.label("container_name"),
+        log.c.json,
+        log.c.created_at,
+        log.c.event_time,
+        log.c.stream,
+        log.c.message,
+    ]).select_from(
+        log.join(container, log.c.container_key == container.c.id)
+    )
+    sql = str(select.compile(
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+    ))
+    with engine.begin() as connection:
+        if LOGS_VIEW not in sqlalchemy.inspect(connection).get_view_names():
+            connection.execute("CREATE VIEW {} AS {}".format(LOGS_VIEW, sql))
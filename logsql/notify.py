@@ -0,0 +1,196 @@
+"""
+Live tail with PostgreSQL LISTEN/NOTIFY.
+
+After each batch the COPY sink sends a compact notification on
+LOGSQL_NOTIFY_CHANNEL with the container and the id range of the batch;
+PostgreSQL only delivers it once the batch is committed.  Subscribers
+LISTEN on the channel and fetch just the announced rows, instead of
+polling the logs table:
+
+    python3 -m logsql listen --container web --where attrs.level=error
+"""
+import sys
+import json
+import select
+import logging
+import argparse
+import typing
+
+import sqlalchemy
+
+from . import db, models, query, settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Notification:
+    """ A batch of rows committed for one container """
+
+    def __init__(
+            self,
+            container_id: str,
+            key: int,
+            first: int,
+            last: int,
+            count: int,
+    ):
+        self.container_id = container_id
+        self.key = key
+        self.first = first
+        self.last = last
+        self.count = count
+
+    def encode(self) -> str:
+        """ The notification payload """
+        return json.dumps({
+            "container_id": self.container_id,
+            "key": self.key,
+            "first": self.first,
+            "last": self.last,
+            "count": self.count,
+        }, separators=(",", ":"))
+
+    @classmethod
+    def decode(cls, payload: str) -> "Notification":
+        """ Parse a notification payload """
+        data = json.loads(payload)
+        return cls(
+            data["container_id"], data["key"],
+            data["first"], data["last"], data["count"]
+        )
+
+
+def publish(
+        connection,
+        channel: str,
+        notification: Notification,
+) -> None:
+    """ Send the notification with the DBAPI connection's transaction """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT pg_notify(%s, %s)", (channel, notification.encode())
+        )
+    finally:
+        cursor.close()
+
+
+class Subscriber:
+    """ Receives the rows of new batches as they are committed.
+
+    statement filters the rows, see query.build_select().
+    """
+
+    def __init__(
+            self,
+            engine: sqlalchemy.engine.Engine,
+            statement: sqlalchemy.sql.Select = None,
+            channel: str = None,
+    ):
+        self.engine = engine
+        self.statement = statement if statement is not None \
+            else query.build_select()
+        self.channel = channel or settings.NOTIFY_CHANNEL
+        if not self.channel:
+            raise ValueError("No notification channel configured")
+        self.connection = None
+
+    def listen(self) -> None:
+        """ Start receiving notifications, rows committed before are not
+        returned
+        """
+        self.connection = self.engine.raw_connection()
+        # autocommit so notifications are delivered, never back to the pool
+        self.connection.detach()
+        self.connection.connection.autocommit = True
+        cursor = self.connection.cursor()
+        try:
+            # the channel name is an identifier, it can't be a parameter
+            cursor.execute('LISTEN "{}"'.format(self.channel))
+        finally:
+            cursor.close()
+
+    def close(self) -> None:
+        """ Stop receiving notifications """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def notifications(
+            self,
+            timeout: float = None,
+    ) -> typing.List[Notification]:
+        """ The notifications received within timeout seconds """
+        if self.connection is None:
+            self.listen()
+        dbapi_connection = self.connection.connection
+        if not dbapi_connection.notifies:
+            select.select([dbapi_connection], [], [], timeout)
+            dbapi_connection.poll()
+        result = []
+        while dbapi_connection.notifies:
+            notify = dbapi_connection.notifies.pop(0)
+            try:
+                result.append(Notification.decode(notify.payload))
+            except (ValueError, KeyError):
+                logger.warning("Invalid notification: %r", notify.payload)
+        return result
+
+    def fetch(
+            self,
+            notification: Notification,
+    ) -> typing.List[sqlalchemy.engine.RowProxy]:
+        """ The rows of the batch matching the statement """
+        log = models.Log.__table__
+        statement = self.statement.where(sqlalchemy.and_(
+            log.c.container_key == notification.key,
+            log.c.id.between(notification.first, notification.last),
+        )).order_by(log.c.id)
+        with self.engine.connect() as connection:
+            return connection.execute(statement).fetchall()
+
+    def rows(
+            self,
+            timeout: float = None,
+    ) -> typing.Iterator[sqlalchemy.engine.RowProxy]:
+        """ The rows of new batches, forever """
+        if self.connection is None:
+            self.listen()
+        while True:
+            for notification in self.notifications(timeout):
+                for row in self.fetch(notification):
+                    yield row
+
+
+def main(args, out: typing.TextIO = None) -> int:
+    """ Listen entrypoint """
+    engine = db.create_engine()
+    subscriber = Subscriber(
+        engine,
+        query.build_select(args.container, predicates=args.where),
+        channel=args.channel,
+    )
+    subscriber.listen()
+    try:
+        query.write(subscriber.rows(), out or sys.stdout, flush=True)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        subscriber.close()
+    return 0
+
+
+def parse_args(argv: typing.List[str] = None) -> argparse.Namespace:
+    """ Parse the arguments of the listen subcommand """
+    parser = argparse.ArgumentParser(prog="python3 -m logsql listen")
+    parser.add_argument(
+        "--container", action="append", default=[],
+        help="container id (prefix) or name, may be repeated"
+    )
+    parser.add_argument(
+        "--where", type=query.parse_predicate, action="append", default=[],
+        help="JSON path predicate PATH=VALUE or PATH!=VALUE, may be repeated"
+    )
+    parser.add_argument("--channel", default=settings.NOTIFY_CHANNEL)
+    return parser.parse_args(argv)
@@ -33,13 +33,21 @@ class OffsetFile:
         self.inode = inode
 
     def save(self) -> None:
-        """ Write the current state to disk. """
+        """ Write the current state to disk.
+
+        The file is replaced atomically so that a crash never leaves a
+        truncated offset file behind.
+        """
         assert self.path
         assert self.inode >= 0
         assert self.offset >= 0
-        with open(self.path, "w") as filp:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as filp:
             print(str(self.inode), file=filp)
             print(str(self.offset), file=filp)
+            filp.flush()
+            os.fsync(filp.fileno())
+        os.replace(tmp_path, self.path)
 
     def reset(
             self,
@@ -79,3 +87,18 @@ class OffsetFile:
             raise IOError("Invalid offsetfile format: " + str(ex))
 
         return offsetfile
+
+    @classmethod
+    def remove(
+            cls,
+            path: str,
+            suffix=DEFAULT_SUFFIX
+    ) -> bool:
+        """ Delete the offset file, returns whether it existed """
+        if not path.endswith(suffix):
+            path = path + suffix
+
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
@@ -0,0 +1,349 @@
+"""
+Access log parsing.
+
+Format specs are compiled once into parsers with their type converters
+resolved up front:
+
+    parser = parsing.compile_format("nginx_combined")
+    parser.parse_many(lines)  # a dict, or None, per line
+
+A spec is one of the FORMATS names, "nginx:" followed by an nginx
+log_format string, "apache:" followed by an Apache LogFormat string, or
+"regex:" followed by a regular expression whose named groups are the
+fields (a group named e.g. status__int is converted to int).  nginx and
+Apache formats are turned into a regular expression in which every
+variable matches up to the next literal character, so matching never
+backtracks across fields.
+"""
+import re
+import functools
+import operator
+import typing
+
+Converter = typing.Callable[[str], typing.Any]
+
+
+def _converter(func: Converter) -> Converter:
+    """ func, but "-" (no value) becomes None and values it can't convert
+    are kept as they are
+    """
+    def convert(value):
+        if value == "-" or value is None:
+            return None
+        try:
+            return func(value)
+        except ValueError:
+            return value
+    return convert
+
+
+INT = _converter(int)
+FLOAT = _converter(float)
+
+CONVERTERS = {
+    "int": INT,
+    "float": FLOAT,
+}
+
+# types of the nginx variables (and the Apache directives named after them)
+TYPES = {
+    "status": INT,
+    "body_bytes_sent": INT,
+    "bytes_sent": INT,
+    "request_length": INT,
+    "connection": INT,
+    "connection_requests": INT,
+    "server_port": INT,
+    "upstream_status": INT,
+    "request_time_us": INT,
+    "request_time": FLOAT,
+    "upstream_connect_time": FLOAT,
+    "upstream_header_time": FLOAT,
+    "upstream_response_time": FLOAT,
+    "msec": FLOAT,
+}
+
+NGINX_VARIABLE_REGEX = re.compile(r"\$(?:(\w+)|\{(\w+)\})")
+APACHE_DIRECTIVE_REGEX = re.compile(r"%[<>]?(?:\{([^}]*)\})?([a-zA-Z%])")
+
+APACHE_DIRECTIVES = {
+    "a": "client_addr",
+    "h": "remote_addr",
+    "l": "remote_logname",
+    "u": "remote_user",
+    "t": "time_local",
+    "r": "request",
+    "s": "status",
+    "b": "body_bytes_sent",
+    "B": "body_bytes_sent",
+    "O": "bytes_sent",
+    "I": "request_length",
+    "D": "request_time_us",
+    "T": "request_time",
+    "m": "request_method",
+    "U": "uri",
+    "q": "query_string",
+    "H": "server_protocol",
+    "p": "server_port",
+    "v": "server_name",
+    "V": "server_name",
+}
+
+NGINX_COMBINED = "$remote_addr - $remote_user [$time_local] " \
+    '"$request" $status $body_bytes_sent "$http_referer" "$http_user_agent"'
+APACHE_COMMON = '%h %l %u %t "%r" %>s %b'
+APACHE_COMBINED = APACHE_COMMON + ' "%{Referer}i" "%{User-agent}i"'
+
+LOGFMT_REGEX = re.compile(r'([^\s=]+)(=("(?:[^"\\]|\\.)*"|\S*))?')
+LOGFMT_ESCAPE_REGEX = re.compile(r"\\(.)")
+
+# a field, with the regular expression it matches or None for "up to the
+# next literal character"
+Token = typing.Union[str, typing.Tuple[str, typing.Optional[str]]]
+
+
+class Parser:
+    """ Parses lines into dicts """
+
+    def parse(self, line: str) -> typing.Optional[dict]:
+        """ The fields of the line, None if it doesn't match """
+        raise NotImplementedError()
+
+    def parse_many(
+            self,
+            lines: typing.Iterable[str],
+    ) -> typing.List[typing.Optional[dict]]:
+        """ The fields of every line, None for the ones that don't match """
+        parse = self.parse
+        return [parse(line) for line in lines]
+
+
+class RegexParser(Parser):
+    """ The named groups of a regular expression, groups named
+    <field>__<type> are converted with CONVERTERS[type]
+    """
+
+    def __init__(
+            self,
+            regex: typing.Pattern,
+            converters: typing.Dict[str, Converter] = None,
+    ):
+        self.regex = regex
+        converters = dict(converters or {})
+        fields = sorted(regex.groupindex.items(), key=lambda item: item[1])
+        names = []
+        for group, _ in fields:
+            name, _, type_name = group.partition("__")
+            if type_name:
+                if type_name not in CONVERTERS:
+                    raise ValueError(
+                        "Unknown type {!r} of group {}".format(
+                            type_name, group
+                        )
+                    )
+                converters[name] = CONVERTERS[type_name]
+            names.append(name)
+        self.names = tuple(names)
+        self.converters = tuple(
+            (name, func) for name, func in converters.items()
+            if name in self.names
+        )
+
+        indices = [index - 1 for _, index in fields]
+        if indices == list(range(regex.groups)):
+            self._select = None
+        elif len(indices) == 1:
+            index = indices[0]
+            self._select = lambda groups: (groups[index],)
+        else:
+            self._select = operator.itemgetter(*indices)
+
+    def parse(self, line):
+        match = self.regex.match(line)
+        if match is None:
+            return None
+        groups = match.groups()
+        if self._select is not None:
+            groups = self._select(groups)
+        result = dict(zip(self.names, groups))
+        for name, func in self.converters:
+            result[name] = func(result[name])
+        return result
+
+    def parse_many(self, lines):
+        match = self.regex.match
+        select = self._select
+        names = self.names
+        converters = self.converters
+        results = []
+        append = results.append
+        for line in lines:
+            found = match(line)
+            if found is None:
+                append(None)
+                continue
+            groups = found.groups()
+            if select is not None:
+                groups = select(groups)
+            result = dict(zip(names, groups))
+            for name, func in converters:
+                result[name] = func(result[name])
+            append(result)
+        return results
+
+
+class LogfmtParser(Parser):
+    """ key=value pairs, values are strings unless types says otherwise and
+    keys without a value are True
+    """
+
+    def __init__(self, types: typing.Dict[str, Converter] = None):
+        self.types = types or {}
+
+    def parse(self, line):
+        result = {}
+        types = self.types
+        for key, equals, value in LOGFMT_REGEX.findall(line):
+            if not equals:
+                result[key] = True
+                continue
+            if value[:1] == '"':
+                value = value[1:-1]
+                if "\\" in value:
+                    value = LOGFMT_ESCAPE_REGEX.sub(r"\1", value)
+            if types and key in types:
+                value = types[key](value)
+            result[key] = value
+        return result or None
+
+
+def _build(tokens: typing.Sequence[Token]) -> RegexParser:
+    """ The parser of a sequence of literals and fields """
+    parts = []
+    seen = set()
+    for index, token in enumerate(tokens):
+        if isinstance(token, str):
+            parts.append(re.escape(token))
+            continue
+        name, pattern = token
+        if pattern is None:
+            following = tokens[index + 1] if index + 1 < len(tokens) else None
+            if following is None:
+                pattern = ".*"
+            elif isinstance(following, str):
+                pattern = "[^{}]*".format(re.escape(following[0]))
+            else:
+                pattern = r"\S*"
+        if name in seen:
+            parts.append("(?:{})".format(pattern))
+        else:
+            seen.add(name)
+            parts.append("(?P<{}>{})".format(name, pattern))
+    return RegexParser(
+        re.compile("".join(parts)),
+        {name: TYPES[name] for name in seen if name in TYPES},
+    )
+
+
+def _tokenize(
+        regex: typing.Pattern,
+        log_format: str,
+        field: typing.Callable[[typing.Match], typing.Optional[Token]],
+) -> typing.List[Token]:
+    tokens = []  # type: typing.List[Token]
+    position = 0
+    for match in regex.finditer(log_format):
+        literal = log_format[position:match.start()]
+        token = field(match)
+        if isinstance(token, str):
+            literal += token
+            token = None
+        if literal:
+            if tokens and isinstance(tokens[-1], str):
+                tokens[-1] += literal
+            else:
+                tokens.append(literal)
+        if token is not None:
+            tokens.append(token)
+        position = match.end()
+    literal = log_format[position:]
+    if literal:
+        if tokens and isinstance(tokens[-1], str):
+            tokens[-1] += literal
+        else:
+            tokens.append(literal)
+    return tokens
+
+
+def compile_nginx(log_format: str) -> RegexParser:
+    """ The parser of an nginx log_format, fields are named after the
+    variables
+    """
+    return _build(_tokenize(
+        NGINX_VARIABLE_REGEX, log_format,
+        lambda match: (match.group(1) or match.group(2), None)
+    ))
+
+
+def _apache_field(match: typing.Match) -> Token:
+    argument, directive = match.groups()
+    if directive == "%":
+        return "%"
+    if directive == "i" and argument:
+        name = "http_" + re.sub(r"\W", "_", argument.lower())
+        return name, None
+    if directive == "t" and not argument:
+        # [10/Oct/2000:13:55:36 -0700], brackets included
+        return "time_local", r"\[[^\]]*\]"
+    if directive not in APACHE_DIRECTIVES or argument:
+        raise ValueError("Unsupported Apache directive " + match.group(0))
+    return APACHE_DIRECTIVES[directive], None
+
+
+def compile_apache(log_format: str) -> RegexParser:
+    """ The parser of an Apache LogFormat, fields are named after the
+    equivalent nginx variables
+    """
+    parser = _build(
+        _tokenize(APACHE_DIRECTIVE_REGEX, log_format, _apache_field)
+    )
+    if "time_local" in parser.names:
+        # strip the brackets of %t
+        parser.converters += (("time_local", lambda value: value[1:-1]),)
+    return parser
+
+
+FORMATS = {
+    "nginx_combined": lambda: compile_nginx(NGINX_COMBINED),
+    "apache_common": lambda: compile_apache(APACHE_COMMON),
+    "apache_combined": lambda: compile_apache(APACHE_COMBINED),
+    "logfmt": LogfmtParser,
+}  # type: typing.Dict[str, typing.Callable[[], Parser]]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_format(spec: str) -> Parser:
+    """ The parser of a format spec, compiled once """
+    if spec in FORMATS:
+        return FORMATS[spec]()
+    kind, _, value = spec.partition(":")
+    if kind == "nginx" and value:
+        return compile_nginx(value)
+    if kind == "apache" and value:
+        return compile_apache(value)
+    if kind == "regex" and value:
+        return RegexParser(re.compile(value))
+    raise ValueError(
+        "Invalid format {!r}, expected one of {} or nginx:, apache: or "
+        "regex: followed by the format".format(
+            spec, ", ".join(sorted(FORMATS))
+        )
+    )
+
+
+def parse_many(
+        spec: str,
+        lines: typing.Iterable[str],
+) -> typing.List[typing.Optional[dict]]:
+    """ Parse lines with the given format spec """
+    return compile_format(spec).parse_many(lines)
@@ -0,0 +1,197 @@
+"""
+Time partitioning of the log entries table (PostgreSQL only).
+
+With LOGSQL_PARTITION_INTERVAL set, the log_entries table is created range
+partitioned on created_at, with one partition per day or hour.
+Partitions are created a few intervals ahead of time, and retention is
+enforced by dropping (or detaching) whole partitions instead of deleting
+rows, which leaves neither bloat nor vacuum work behind.  Queries that
+filter on created_at only scan the partitions in range.
+"""
+import datetime
+import logging
+import typing
+
+import sqlalchemy
+
+from . import models, settings
+
+
+logger = logging.getLogger(__name__)
+
+DAY = "day"
+HOUR = "hour"
+INTERVALS = {
+    DAY: (datetime.timedelta(days=1), "%Y%m%d"),
+    HOUR: (datetime.timedelta(hours=1), "%Y%m%d%H"),
+}
+
+PARTITIONS_SQL = """
+SELECT child.relname
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relname = :table
+"""
+
+PARTITIONED_SQL = """
+SELECT count(*)
+FROM pg_partitioned_table
+JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid
+WHERE pg_class.relname = :table
+"""
+
+
+class PartitionManager:
+    """ Creates and expires the partitions of the log_entries table """
+
+    def __init__(
+            self,
+            engine: sqlalchemy.engine.Engine,
+            interval: str = DAY,
+            premake: int = 3,
+            retention: datetime.timedelta = None,
+            detach: bool = False,
+            table: str = models.Log.__tablename__,
+    ):
+        if interval not in INTERVALS:
+            raise ValueError(
+                "Invalid partition interval {!r}, expected one of {}".format(
+                    interval, ", ".join(sorted(INTERVALS))
+                )
+            )
+        self.engine = engine
+        self.interval = interval
+        self.step, self.format = INTERVALS[interval]
+        self.premake = premake
+        self.retention = retention
+        self.detach = detach
+        self.table = table
+
+    def start(self, moment: datetime.datetime) -> datetime.datetime:
+        """ Start of the partition containing moment """
+        if self.interval == DAY:
+            return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+    def name(self, start: datetime.datetime) -> str:
+        """ Name of the partition starting at start """
+        return "{}_p{}".format(self.table, start.strftime(self.format))
+
+    def parse(self, name: str) -> typing.Optional[datetime.datetime]:
+        """ Start of the partition with the given name, None if it isn't
+        one of ours
+        """
+        prefix = self.table + "_p"
+        if not name.startswith(prefix):
+            return None
+        try:
+            return datetime.datetime.strptime(name[len(prefix):], self.format)
+        except ValueError:
+            return None
+
+    def is_partitioned(self) -> bool:
+        """ Whether the table was created partitioned """
+        with self.engine.connect() as connection:
+            return bool(connection.execute(
+                sqlalchemy.text(PARTITIONED_SQL), table=self.table
+            ).scalar())
+
+    def partitions(self) -> typing.Dict[str, datetime.datetime]:
+        """ Name and start of the existing partitions """
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                sqlalchemy.text(PARTITIONS_SQL), table=self.table
+            ).fetchall()
+        result = {}
+        for (name,) in rows:
+            start = self.parse(name)
+            if start is not None:
+                result[name] = start
+        return result
+
+    def create(self, now: datetime.datetime = None) -> typing.List[str]:
+        """ Create the current partition and premake ones after it """
+        start = self.start(now or datetime.datetime.utcnow())
+        existing = self.partitions()
+        created = []
+        with self.engine.begin() as connection:
+            for _ in range(self.premake + 1):
+                name = self.name(start)
+                if name not in existing:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} "
+                        "FOR VALUES FROM ('{}') TO ('{}')".format(
+                            name, self.table,
+                            start.isoformat(), (start + self.step).isoformat()
+                        )
+                    )
+                    created.append(name)
+                start += self.step
+        for name in created:
+            logger.info("Created partition %s", name)
+        return created
+
+    def expire(self, now: datetime.datetime = None) -> typing.List[str]:
+        """ Drop or detach the partitions past the retention period """
+        if not self.retention:
+            return []
+        cutoff = (now or datetime.datetime.utcnow()) - self.retention
+        expired = sorted(
+            name for name, start in self.partitions().items()
+            if start + self.step <= cutoff
+        )
+        with self.engine.begin() as connection:
+            for name in expired:
+                if self.detach:
+                    connection.execute(
+                        "ALTER TABLE {} DETACH PARTITION {}".format(
+                            self.table, name
+                        )
+                    )
+                else:
+                    connection.execute("DROP TABLE {}".format(name))
+        for name in expired:
+            logger.info(
+                "%s expired partition %s",
+                "Detached" if self.detach else "Dropped", name
+            )
+        return expired
+
+    def maintain(
+            self,
+            now: datetime.datetime = None
+    ) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """ Create upcoming partitions and expire old ones """
+        now = now or datetime.datetime.utcnow()
+        return self.create(now), self.expire(now)
+
+
+def manager_from_settings(
+        engine: sqlalchemy.engine.Engine
+) -> typing.Optional[PartitionManager]:
+    """ The partition manager configured in settings, None when the
+    log_entries table isn't partitioned
+    """
+    if not settings.PARTITION_INTERVAL:
+        return None
+    if engine.dialect.name != "postgresql":
+        logger.warning(
+            "Partitioning requires PostgreSQL, not %s", engine.dialect.name
+        )
+        return None
+    manager = PartitionManager(
+        engine,
+        interval=settings.PARTITION_INTERVAL,
+        premake=settings.PARTITION_PREMAKE,
+        retention=datetime.timedelta(hours=settings.RETENTION_HOURS)
+        if settings.RETENTION_HOURS else None,
+        detach=settings.RETENTION_DETACH,
+    )
+    if not manager.is_partitioned():
+        logger.warning(
+            "Table %s exists but isn't partitioned, not managing partitions",
+            manager.table
+        )
+        return None
+    return manager
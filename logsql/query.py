@@ -0,0 +1,341 @@
+"""
+Reading logs back out.
+
+    python3 -m logsql query --container web --since 1h \
+        --where stream=stderr --where attrs.level=error --follow
+
+Rows are printed as NDJSON in (event_time, id) order, docker's time of the
+line, which --since and --until filter on; rows without one come first.
+Pages are fetched by keyset instead of OFFSET, each through a server-side
+cursor, so neither the database nor the client hold more than a page at a
+time.  --follow then keeps printing rows as they are committed, see
+follow().
+"""
+import re
+import sys
+import time
+import datetime
+import argparse
+import typing
+
+import sqlalchemy
+
+from . import db, models
+from .codec import Codec, get_codec
+
+
+DEFAULT_PAGE_SIZE = 10000
+# rows fetched from the server-side cursor at a time
+FETCH_SIZE = 1000
+DEFAULT_INTERVAL = 1.0
+# rows may be committed this long after their created_at, see follow()
+DEFAULT_WINDOW = 60.0
+
+DURATION_REGEX = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# event_time, None for the rows without one, and id
+Key = typing.Tuple[typing.Optional[datetime.datetime], int]
+
+
+def parse_time(
+        value: str,
+        now: datetime.datetime = None,
+) -> datetime.datetime:
+    """ A naive UTC datetime from an ISO 8601 time or a duration ago,
+    e.g. 90s, 15m, 2h or 7d
+    """
+    match = DURATION_REGEX.match(value)
+    if match:
+        seconds = float(match.group(1)) * DURATION_UNITS[match.group(2)]
+        now = now or datetime.datetime.utcnow()
+        return now - datetime.timedelta(seconds=seconds)
+
+    try:
+        result = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid time: " + value)
+    if result.tzinfo is not None:
+        result = result.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return result
+
+
+def parse_predicate(value: str) -> typing.Tuple[typing.List[str], str, str]:
+    """ A JSON path predicate, e.g. attrs.level=error or stream!=stdout """
+    match = re.match(r"^([^=!]+)(!?=)(.*)$", value)
+    if not match:
+        raise argparse.ArgumentTypeError("invalid predicate: " + value)
+    path, operator, expected = match.groups()
+    return path.split("."), operator, expected
+
+
+def build_select(
+        containers: typing.Sequence[str] = (),
+        since: datetime.datetime = None,
+        until: datetime.datetime = None,
+        predicates: typing.Sequence[tuple] = (),
+) -> sqlalchemy.sql.Select:
+    """ The filtered rows, with the columns of the logs view, unordered """
+    log = models.Log.__table__
+    container = models.Container.__table__
+    select = sqlalchemy.select([
+        log.c.id,
+        container.c.container_id,
+        container.c.name.label("container_name"),
+        log.c.json,
+        log.c.created_at,
+        log.c.event_time,
+        log.c.stream,
+        log.c.message,
+    ]).select_from(
+        log.join(container, log.c.container_key == container.c.id)
+    )
+
+    if containers:
+        # container id prefix or name, with or without the leading slash
+        select = select.where(sqlalchemy.or_(*[
+            sqlalchemy.or_(
+                container.c.container_id.startswith(value),
+                container.c.name == "/" + value.lstrip("/"),
+            ) for value in containers
+        ]))
+    if since is not None:
+        select = select.where(log.c.event_time >= _utc(since))
+        # rows are written after their event: a bound on the partition key
+        # that prunes the older partitions
+        select = select.where(
+            log.c.created_at >= _utc(since).replace(tzinfo=None)
+        )
+    if until is not None:
+        select = select.where(log.c.event_time < _utc(until))
+    for path, operator, expected in predicates:
+        value = log.c.json[tuple(path)].as_string()
+        if operator == "=":
+            select = select.where(value == expected)
+        else:
+            select = select.where(sqlalchemy.or_(
+                value.is_(None), value != expected
+            ))
+    return select
+
+
+def _utc(moment: datetime.datetime) -> datetime.datetime:
+    # event_time is timezone aware, naive times are UTC
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc)
+
+
+def _after(
+        columns: typing.Sequence[sqlalchemy.Column],
+        key: typing.Sequence[typing.Any],
+):
+    """ The condition of the rows after key in the order of columns,
+    written so that an index on the first column is used
+    """
+    first, value = columns[0], key[0]
+    if len(columns) == 1:
+        return first > value
+    return sqlalchemy.and_(first >= value, sqlalchemy.or_(
+        first > value, _after(columns[1:], key[1:])
+    ))
+
+
+def _paginate(
+        engine: sqlalchemy.engine.Engine,
+        select: sqlalchemy.sql.Select,
+        columns: typing.Sequence[sqlalchemy.Column],
+        after: typing.Sequence[typing.Any] = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        limit: int = None,
+) -> typing.Iterator[sqlalchemy.engine.RowProxy]:
+    """ The rows of select after the key, page by page in the order of
+    columns, which must not be NULL
+    """
+    count = 0
+    while limit is None or count < limit:
+        page = select
+        if after:
+            page = page.where(_after(columns, after))
+        size = page_size if limit is None else min(page_size, limit - count)
+        page = page.order_by(*columns).limit(size)
+
+        rows = 0
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True
+            ).execute(page)
+            while True:
+                chunk = result.fetchmany(FETCH_SIZE)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield row
+                rows += len(chunk)
+                after = [chunk[-1][column.name] for column in columns]
+        count += rows
+        if rows < size:
+            return
+
+
+def fetch(
+        engine: sqlalchemy.engine.Engine,
+        select: sqlalchemy.sql.Select,
+        after: Key = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        limit: int = None,
+) -> typing.Iterator[sqlalchemy.engine.RowProxy]:
+    """ The rows of select after the key, page by page in (event_time, id)
+    order.  The rows without an event_time come first, by id.
+    """
+    log = models.Log.__table__
+    count = 0
+    if after is None or after[0] is None:
+        for row in _paginate(
+                engine, select.where(log.c.event_time.is_(None)),
+                [log.c.id], after[1:] if after else None, page_size, limit
+        ):
+            count += 1
+            yield row
+        after = None
+        if limit is not None and count >= limit:
+            return
+    yield from _paginate(
+        engine, select.where(log.c.event_time.isnot(None)),
+        [log.c.event_time, log.c.id], after, page_size,
+        limit - count if limit is not None else None
+    )
+
+
+def follow(
+        engine: sqlalchemy.engine.Engine,
+        select: sqlalchemy.sql.Select,
+        since: datetime.datetime = None,
+        interval: float = DEFAULT_INTERVAL,
+        window: float = DEFAULT_WINDOW,
+        page_size: int = DEFAULT_PAGE_SIZE,
+) -> typing.Iterator[sqlalchemy.engine.RowProxy]:
+    """ The rows of select created from since on, by default window
+    seconds ago, then the new ones as they are committed, forever.
+
+    The writers set created_at when their transaction starts, so rows
+    become visible up to a transaction later.  Every scan goes back to
+    window seconds before the previous one started, skipping the ids
+    already returned: only rows of a transaction longer than window are
+    missed.  A retried batch gets a new created_at.
+    """
+    log = models.Log.__table__
+    lookback = datetime.timedelta(seconds=window)
+    scanned = datetime.datetime.utcnow()
+    since = _utc(since).replace(tzinfo=None) if since is not None \
+        else scanned - lookback
+    rows = fetch(
+        engine, select.where(log.c.created_at >= since), page_size=page_size
+    )
+    # ids returned that the next scan sees again, with their created_at
+    seen = {}  # type: typing.Dict[int, datetime.datetime]
+    while True:
+        horizon = scanned - lookback
+        seen = {
+            row_id: created_at for row_id, created_at in seen.items()
+            if created_at >= horizon
+        }
+        for row in rows:
+            if row.id in seen:
+                continue
+            if row.created_at >= horizon:
+                seen[row.id] = row.created_at
+            yield row
+        time.sleep(interval)
+        scanned = datetime.datetime.utcnow()
+        rows = _paginate(
+            engine, select.where(log.c.created_at >= horizon),
+            [log.c.created_at, log.c.id], page_size=page_size
+        )
+
+
+def as_dict(row: sqlalchemy.engine.RowProxy) -> dict:
+    """ A row as a JSON serializable dict """
+    result = dict(row)
+    for key in ("created_at", "event_time"):
+        if result[key] is not None:
+            result[key] = result[key].isoformat()
+    return result
+
+
+def write(
+        rows: typing.Iterable[sqlalchemy.engine.RowProxy],
+        out: typing.TextIO,
+        codec: Codec = None,
+        flush: bool = False,
+) -> int:
+    """ Print the rows as NDJSON, returns their number.  Flushes after
+    every row if flush is set.
+    """
+    codec = codec or get_codec()
+    count = 0
+    for row in rows:
+        out.write(codec.dumps(as_dict(row)))
+        out.write("\n")
+        if flush:
+            out.flush()
+        count += 1
+    out.flush()
+    return count
+
+
+def main(args, out: typing.TextIO = None) -> int:
+    """ Query entrypoint """
+    engine = db.create_engine()
+    select = build_select(
+        args.container, args.since, args.until, args.where
+    )
+    if args.follow:
+        rows = follow(
+            engine, select, since=args.since,
+            interval=args.interval, window=args.window,
+            page_size=args.page_size
+        )
+    else:
+        rows = fetch(
+            engine, select, page_size=args.page_size, limit=args.limit
+        )
+    try:
+        write(rows, out or sys.stdout, flush=args.follow)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    return 0
+
+
+def parse_args(argv: typing.List[str] = None) -> argparse.Namespace:
+    """ Parse the arguments of the query subcommand """
+    parser = argparse.ArgumentParser(prog="python3 -m logsql query")
+    parser.add_argument(
+        "--container", action="append", default=[],
+        help="container id (prefix) or name, may be repeated"
+    )
+    parser.add_argument(
+        "--since", type=parse_time,
+        help="ISO 8601 UTC time or duration ago, e.g. 15m, 2h, 7d"
+    )
+    parser.add_argument("--until", type=parse_time)
+    parser.add_argument(
+        "--where", type=parse_predicate, action="append", default=[],
+        help="JSON path predicate PATH=VALUE or PATH!=VALUE, "
+             "e.g. attrs.level=error, may be repeated"
+    )
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--page-size", type=int, default=DEFAULT_PAGE_SIZE
+    )
+    parser.add_argument(
+        "--follow", action="store_true", default=False,
+        help="keep printing new rows"
+    )
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL)
+    parser.add_argument(
+        "--window", type=float, default=DEFAULT_WINDOW,
+        help="seconds --follow looks back for rows committed late, and "
+             "for the first rows without --since"
+    )
+    return parser.parse_args(argv)
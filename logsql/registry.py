@@ -0,0 +1,129 @@
+"""
+In-memory registry of the containers on the host.
+
+The registry is kept up to date by the docker events stream and caches the
+inspect result of every container, so each container is inspected once per
+start instead of on every reconciliation.  Reconciliation only diffs the
+ids of a sparse container listing against the registry.
+"""
+import logging
+import threading
+import typing
+
+import docker
+
+
+logger = logging.getLogger(__name__)
+
+
+class ContainerRegistry:
+    """ Known containers and their cached inspect results """
+
+    def __init__(
+            self,
+            docker_client: docker.DockerClient,
+            inspect: typing.Callable[[str], dict] = None,
+    ):
+        self.docker_client = docker_client
+        self.inspect = inspect or docker_client.api.inspect_container
+
+        self.lock = threading.Lock()
+        self.names = {}  # type: typing.Dict[str, str]
+        self.infos = {}  # type: typing.Dict[str, dict]
+
+    def __contains__(self, container_id: str) -> bool:
+        return container_id in self.names
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def name(self, container_id: str) -> typing.Optional[str]:
+        """ The name of a known container, without the leading slash """
+        return self.names.get(container_id)
+
+    def get(self, container_id: str) -> dict:
+        """ The inspect result of the container, cached """
+        with self.lock:
+            info = self.infos.get(container_id)
+        if info is None:
+            info = self.refresh(container_id)
+        return info
+
+    def refresh(self, container_id: str) -> dict:
+        """ Inspect the container again, e.g. because it was (re)started """
+        info = self.inspect(container_id)
+        name = info.get("Name")
+        with self.lock:
+            self.infos[container_id] = info
+            if name:
+                self.names[container_id] = name.lstrip("/")
+            else:
+                # keep the name of the listing, if any
+                self.names.setdefault(container_id, container_id)
+        return info
+
+    def remove(self, container_id: str) -> None:
+        """ Forget about the container """
+        with self.lock:
+            self.names.pop(container_id, None)
+            self.infos.pop(container_id, None)
+
+    def handle_event(self, event: dict) -> typing.Optional[str]:
+        """ Update the registry from a docker event.
+
+        Returns the (lower case) action of container events, None for
+        other events.
+        """
+        if event.get("Type", "").lower() != "container":
+            return None
+
+        action = event.get("Action", "").lower()
+        container_id = event["id"]
+        if action == "destroy":
+            self.remove(container_id)
+        elif action == "start":
+            # LogPath etc. are only final once the container started
+            try:
+                self.refresh(container_id)
+            except docker.errors.NotFound:
+                self.remove(container_id)
+        elif action in ("create", "rename", "die"):
+            with self.lock:
+                self.infos.pop(container_id, None)
+                self.names[container_id] = \
+                    event["Actor"]["Attributes"]["name"]
+        return action
+
+    def reconcile(
+            self
+    ) -> typing.Tuple[typing.List[typing.Tuple[str, str]], typing.List[str]]:
+        """ Diff the registry against the current container list.
+
+        Returns the (id, name) of new containers and the ids of those that
+        are gone, only containers that are new are inspected (lazily).
+        """
+        containers = self.docker_client.containers.list(
+            all=True, sparse=True
+        )
+        current = {
+            container.id: container.attrs["Names"][0].lstrip("/")
+            for container in containers
+        }
+        with self.lock:
+            added = [
+                (container_id, name)
+                for container_id, name in current.items()
+                if container_id not in self.names
+            ]
+            removed = [
+                container_id for container_id in self.names
+                if container_id not in current
+            ]
+            self.names.update(added)
+            for container_id in removed:
+                self.names.pop(container_id)
+                self.infos.pop(container_id, None)
+
+        for container_id in removed:
+            logger.debug("Container %s is gone", container_id)
+        return added, removed
@@ -2,3 +2,88 @@
 import os
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://localhost/logsql")
+
+# bytes read from a log file at a time, bounds the reader's memory use
+READ_SIZE = int(os.environ.get("LOGSQL_READ_SIZE", 1024 * 1024))
+
+# backlogs of at least this many bytes are replayed from a memory map
+CATCHUP_SIZE = int(os.environ.get("LOGSQL_CATCHUP_SIZE", 64 * 1024 * 1024))
+
+# orjson, ujson or json; the fastest installed one when empty
+JSON_CODEC = os.environ.get("LOGSQL_JSON_CODEC", "")
+
+# a single SQLite checkpoint store instead of per-log offset files if set
+CHECKPOINT_PATH = os.environ.get("LOGSQL_CHECKPOINT_PATH", "")
+# seconds between group commits of the checkpoint store
+CHECKPOINT_FLUSH_INTERVAL = float(
+    os.environ.get("LOGSQL_CHECKPOINT_FLUSH_INTERVAL", 1.0)
+)
+
+# keep checkpoints in the logs database, committed together with the logs
+CHECKPOINT_DATABASE = os.environ.get(
+    "LOGSQL_CHECKPOINT_DATABASE", ""
+).lower() in ("1", "true", "yes")
+
+# connection pool of each writer process
+POOL_SIZE = int(os.environ.get("LOGSQL_POOL_SIZE", 1))
+POOL_MAX_OVERFLOW = int(os.environ.get("LOGSQL_POOL_MAX_OVERFLOW", 0))
+POOL_TIMEOUT = float(os.environ.get("LOGSQL_POOL_TIMEOUT", 30))
+POOL_RECYCLE = int(os.environ.get("LOGSQL_POOL_RECYCLE", 3600))
+
+# backoff while the database is unavailable, in seconds
+RETRY_MIN_DELAY = float(os.environ.get("LOGSQL_RETRY_MIN_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.environ.get("LOGSQL_RETRY_MAX_DELAY", 60))
+
+# worker processes of --engine pool, one per CPU core if 0
+WORKERS = int(os.environ.get("LOGSQL_WORKERS", 0))
+
+# range partition the logs table by created_at, "day" or "hour" (PostgreSQL)
+PARTITION_INTERVAL = os.environ.get("LOGSQL_PARTITION_INTERVAL", "").lower()
+# partitions created ahead of time, besides the current one
+PARTITION_PREMAKE = int(os.environ.get("LOGSQL_PARTITION_PREMAKE", 3))
+# partitions older than this many hours are dropped, 0 keeps them all
+RETENTION_HOURS = float(os.environ.get("LOGSQL_RETENTION_HOURS", 0))
+# detach expired partitions instead of dropping them, e.g. to archive them
+RETENTION_DETACH = os.environ.get(
+    "LOGSQL_RETENTION_DETACH", ""
+).lower() in ("1", "true", "yes")
+
+# channel the COPY sink notifies of committed batches on, empty disables
+NOTIFY_CHANNEL = os.environ.get("LOGSQL_NOTIFY_CHANNEL", "logsql_logs")
+
+# comma separated modules registering transformation steps, see transform
+TRANSFORMS = os.environ.get("LOGSQL_TRANSFORMS", "")
+
+# spool batches to segment files in this directory before the database
+SPOOL_DIR = os.environ.get("LOGSQL_SPOOL_DIR", "")
+# size at which a segment is closed and a new one started
+SPOOL_SEGMENT_SIZE = int(
+    os.environ.get("LOGSQL_SPOOL_SEGMENT_SIZE", 16 * 1024 * 1024)
+)
+# tailers wait for the drainer beyond this many bytes per spool, 0 for none
+SPOOL_MAX_BYTES = int(
+    os.environ.get("LOGSQL_SPOOL_MAX_BYTES", 1024 * 1024 * 1024)
+)
+# when segments are fsynced: "always", "interval" or "never" (on close only)
+SPOOL_FSYNC = os.environ.get("LOGSQL_SPOOL_FSYNC", "interval").lower()
+SPOOL_FSYNC_INTERVAL = float(
+    os.environ.get("LOGSQL_SPOOL_FSYNC_INTERVAL", 1.0)
+)
+# seconds after its first batch a segment is closed for the drainer at
+# the latest
+SPOOL_MAX_AGE = float(os.environ.get("LOGSQL_SPOOL_MAX_AGE", 1.0))
+
+# serve Prometheus metrics on this port of METRICS_ADDRESS, 0 disables
+METRICS_PORT = int(os.environ.get("LOGSQL_METRICS_PORT", 0))
+METRICS_ADDRESS = os.environ.get("LOGSQL_METRICS_ADDRESS", "127.0.0.1")
+# where child processes leave their metrics, set up by the monitor
+METRICS_DIR = os.environ.get("LOGSQL_METRICS_DIR", "")
+# seconds between the metrics snapshots of child processes
+METRICS_INTERVAL = float(os.environ.get("LOGSQL_METRICS_INTERVAL", 5.0))
+
+# where containers are found: "docker" asks the daemon, "directory" reads
+# the container configs in CONTAINERS_DIR without going through the daemon
+DISCOVERY = os.environ.get("LOGSQL_DISCOVERY", "docker").lower()
+CONTAINERS_DIR = os.environ.get(
+    "LOGSQL_CONTAINERS_DIR", "/var/lib/docker/containers"
+)
@@ -0,0 +1,293 @@
+"""
+Bulk insertion of log batches.
+
+A sink writes a whole batch of already serialized JSON payloads into the
+logs table with as few round-trips as the database allows: COPY on
+PostgreSQL and a Core executemany INSERT everywhere else.
+
+With a notification channel, the COPY sink reserves the ids of the batch
+and announces them with NOTIFY in the same transaction, see logsql.notify.
+
+The time, stream and log fields of docker's json-file envelope are copied
+into the typed event_time, stream and message columns on the way, and the
+container is referenced by its key in the containers table.
+"""
+import io
+import re
+import datetime
+import contextlib
+import typing
+
+import sqlalchemy
+
+from . import containers, metrics, models, notify, settings, utils
+from .codec import Codec, get_codec
+
+# COPY text format escapes, see "File Formats" in the PostgreSQL COPY docs
+COPY_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r",
+})
+
+# COPY text format NULL
+COPY_NULL = "\\N"
+
+# event time (as written by docker), stream and message of a payload
+Envelope = typing.Tuple[
+    typing.Optional[str], typing.Optional[str], typing.Optional[str]
+]
+NO_ENVELOPE = (None, None, None)  # type: Envelope
+
+# stands in for NUL characters in the message column
+NUL_REPLACEMENT = "\ufffd"
+
+# a json-file line as docker's encoder writes it: log, stream, the optional
+# attrs of the log-opt labels and env, then time
+DOCKER_LINE_REGEX = re.compile(
+    r'^\{"log":"((?:[^"\\]|\\.)*)","stream":"([a-z]+)",'
+    r'(?:"attrs":\{.*\},)?"time":"([^"\\]*)"\}$'
+)
+
+
+def envelope(codec: Codec, payload: str) -> Envelope:
+    """ The envelope fields of a JSON payload, None where missing or
+    invalid.  Docker's own lines are picked apart without decoding the
+    whole document, usually the log string needs no unescaping but for
+    its trailing newline.
+    """
+    match = DOCKER_LINE_REGEX.match(payload)
+    if match is not None:
+        message, stream, event_time = match.groups()
+        if "\\" in message:
+            if message.endswith("\\n") and "\\" not in message[:-2]:
+                message = message[:-2] + "\n"
+            else:
+                try:
+                    message = codec.loads('"' + message + '"')
+                except ValueError:
+                    return NO_ENVELOPE
+        return envelope_fields(
+            {"log": message, "stream": stream, "time": event_time}
+        )
+    try:
+        data = codec.loads(payload)
+    except ValueError:
+        return NO_ENVELOPE
+    return envelope_fields(data)
+
+
+def envelope_fields(data: typing.Any) -> Envelope:
+    """ The envelope fields of a decoded payload """
+    if not isinstance(data, dict):
+        return NO_ENVELOPE
+
+    event_time = data.get("time")
+    if not isinstance(event_time, str) or \
+            not utils.DOCKER_TIME_REGEX.match(event_time):
+        event_time = None
+    stream = data.get("stream")
+    if stream not in models.STREAMS:
+        stream = None
+    message = data.get("log")
+    if isinstance(message, str):
+        if message.endswith("\n"):
+            message = message[:-1]
+        if "\x00" in message:
+            # PostgreSQL text can't hold NUL, docker escapes it as \u0000
+            message = message.replace("\x00", NUL_REPLACEMENT)
+    else:
+        message = None
+    return event_time, stream, message
+
+
+class Sink:
+    """ Base class for writing batches to the logs table """
+
+    def __init__(self, codec: Codec = None):
+        self.codec = codec or get_codec()
+        # container id -> key in the containers table
+        self.keys = {}  # type: typing.Dict[str, int]
+
+    def container_key(
+            self,
+            connection: sqlalchemy.engine.Connection,
+            container_id: str,
+            container_name: str,
+    ) -> int:
+        """ The container's key, cached """
+        key = self.keys.get(container_id)
+        if key is None:
+            key = self.keys[container_id] = containers.ensure(
+                connection, container_id, container_name
+            )
+        return key
+
+    @contextlib.contextmanager
+    def begin(self, engine: sqlalchemy.engine.Engine):
+        """ engine.begin() forgetting the cached keys on rollback, they
+        may refer to containers added by the rolled back transaction
+        """
+        try:
+            with metrics.COMMIT_SECONDS.time(), \
+                    engine.begin() as connection:
+                yield connection
+        except Exception:
+            self.keys.clear()
+            raise
+
+    def envelopes(self, payloads: typing.List[str]) -> typing.List[Envelope]:
+        """ The envelope fields of every payload """
+        codec = self.codec
+        return [envelope(codec, payload) for payload in payloads]
+
+    def write(
+            self,
+            connection: sqlalchemy.engine.Connection,
+            container_id: str,
+            container_name: str,
+            payloads: typing.List[str],
+            envelopes: typing.List[Envelope] = None,
+    ) -> None:
+        """ Insert one row per JSON payload using the given connection.
+
+        envelopes are the envelope fields of the payloads if the caller
+        has them already, see client.read_batch(), otherwise they are
+        taken from the payloads.
+        """
+        raise NotImplementedError()
+
+
+class InsertSink(Sink):
+    """ Portable sink using a single Core executemany INSERT """
+
+    def __init__(self, codec: Codec = None):
+        super().__init__(codec)
+        table = models.Log.__table__
+        # bind the payload as text so the JSON type doesn't encode it again
+        self.statement = table.insert().values(
+            json=sqlalchemy.bindparam("payload", type_=sqlalchemy.Text)
+        )
+
+    def write(
+            self, connection, container_id, container_name, payloads,
+            envelopes=None
+    ):
+        if not payloads:
+            return
+        if envelopes is None:
+            envelopes = self.envelopes(payloads)
+        created_at = datetime.datetime.utcnow()
+        key = self.container_key(connection, container_id, container_name)
+        connection.execute(self.statement, [
+            {
+                "container_key": key,
+                "created_at": created_at,
+                "payload": payload,
+                "event_time": utils.parse_docker_time(event_time),
+                "stream": stream,
+                "message": message,
+            } for payload, (event_time, stream, message) in zip(
+                payloads, envelopes
+            )
+        ])
+
+
+class CopySink(Sink):
+    """ PostgreSQL sink streaming the batch with COPY ... FROM STDIN """
+
+    COLUMNS = "container_key, created_at, json, event_time, stream, message"
+    COPY_SQL = "COPY {} ({}) FROM STDIN".format(
+        models.Log.__tablename__, COLUMNS
+    )
+    COPY_IDS_SQL = "COPY {} (id, {}) FROM STDIN".format(
+        models.Log.__tablename__, COLUMNS
+    )
+    IDS_SQL = "SELECT nextval(%s) FROM generate_series(1, %s)"
+
+    def __init__(self, codec: Codec = None, channel: str = None):
+        super().__init__(codec)
+        self.channel = channel
+        self.sequence = None  # type: typing.Optional[str]
+
+    def _reserve_ids(self, cursor, count: int) -> typing.List[int]:
+        if self.sequence is None:
+            cursor.execute(
+                "SELECT pg_get_serial_sequence(%s, 'id')",
+                (models.Log.__tablename__,)
+            )
+            self.sequence = cursor.fetchone()[0]
+        cursor.execute(self.IDS_SQL, (self.sequence, count))
+        return [row[0] for row in cursor.fetchall()]
+
+    def write(
+            self, connection, container_id, container_name, payloads,
+            envelopes=None
+    ):
+        if not payloads:
+            return
+        if envelopes is None:
+            envelopes = self.envelopes(payloads)
+        key = self.container_key(connection, container_id, container_name)
+        prefix = "\t".join((
+            str(key), datetime.datetime.utcnow().isoformat(),
+        )) + "\t"
+
+        cursor = connection.connection.cursor()
+        try:
+            ids = self._reserve_ids(cursor, len(payloads)) \
+                if self.channel else None
+            cursor.copy_expert(
+                self.COPY_IDS_SQL if ids else self.COPY_SQL,
+                self._buffer(prefix, payloads, envelopes, ids)
+            )
+            if ids:
+                notify.publish(
+                    connection.connection, self.channel, notify.Notification(
+                        container_id, key, min(ids), max(ids), len(ids)
+                    )
+                )
+        finally:
+            cursor.close()
+
+    def _buffer(
+            self,
+            prefix: str,
+            payloads: typing.List[str],
+            envelopes: typing.List[Envelope],
+            ids: typing.List[int] = None,
+    ) -> io.StringIO:
+        buf = io.StringIO()
+        for index, (payload, (event_time, stream, message)) in enumerate(
+                zip(payloads, envelopes)
+        ):
+            if ids:
+                buf.write(str(ids[index]))
+                buf.write("\t")
+            # PostgreSQL parses docker's timestamps itself
+            buf.write(prefix)
+            buf.write(payload.translate(COPY_ESCAPES))
+            buf.write("\t")
+            buf.write(event_time or COPY_NULL)
+            buf.write("\t")
+            buf.write(stream or COPY_NULL)
+            buf.write("\t")
+            buf.write(
+                COPY_NULL if message is None
+                else message.translate(COPY_ESCAPES)
+            )
+            buf.write("\n")
+        buf.seek(0)
+        return buf
+
+
+def create_sink(
+        engine: sqlalchemy.engine.Engine,
+        codec: Codec = None,
+) -> Sink:
+    """ The fastest sink supported by the engine's dialect """
+    if engine.dialect.name == "postgresql" and \
+            engine.dialect.driver == "psycopg2":
+        return CopySink(codec, settings.NOTIFY_CHANNEL)
+    return InsertSink(codec)
@@ -0,0 +1,484 @@
+"""
+Local disk spool.
+
+With LOGSQL_SPOOL_DIR set, tailers append their batches to a spool of
+segment files and move their checkpoints forward as soon as a batch is on
+disk, so that a slow or unavailable database doesn't hold them back while
+docker keeps rotating the logs.  A drainer thread replays the segments
+into the database, one transaction per segment, and deletes them once
+committed.  A segment is drained once it is closed, at segment_size or
+max_age seconds after its first batch, whichever comes first.  A segment
+the database refuses (bad data rather than an outage) is set aside as
+<segment>.bad instead of blocking the spool.
+
+Segments are named after their sequence number and hold records of
+
+    length (4 bytes) | crc32 (4 bytes) | zlib compressed batch
+
+A record cut short by a crash fails its length or checksum and ends the
+segment.  Replay is at least once: a segment committed right before a
+crash is written again.
+
+Spools left behind by a crash of a client subprocess are replayed with
+
+    python3 -m logsql.spool --drain
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import logging
+import argparse
+import threading
+import typing
+
+import sqlalchemy
+
+from . import db, metrics, settings
+from .sink import Envelope, create_sink
+
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">II")
+SUFFIX = ".seg"
+BAD_SUFFIX = ".bad"
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+# container id, name, payloads and their envelope fields if known
+Batch = typing.Tuple[
+    str, str, typing.List[str], typing.Optional[typing.List[Envelope]]
+]
+
+
+class SpoolFull(Exception):
+    """ The spool stayed at its size cap for the whole timeout """
+
+
+def encode(
+        container_id: str,
+        name: str,
+        payloads: typing.List[str],
+        envelopes: typing.List[Envelope] = None,
+) -> bytes:
+    """ A batch as a spool record """
+    # payloads are JSON documents, which can't contain a raw newline
+    header = {"container_id": container_id, "name": name}
+    if envelopes is not None:
+        header["envelopes"] = envelopes
+    header = json.dumps(header)
+    data = "\n".join([header] + payloads).encode("utf-8")
+    compressed = zlib.compress(data, 1)
+    return HEADER.pack(len(compressed), zlib.crc32(compressed)) + compressed
+
+
+def decode(data: bytes) -> Batch:
+    """ The batch of a record's compressed data """
+    lines = zlib.decompress(data).decode("utf-8").split("\n")
+    header = json.loads(lines[0])
+    envelopes = header.get("envelopes")
+    if envelopes is not None:
+        envelopes = [tuple(fields) for fields in envelopes]
+    return header["container_id"], header["name"], lines[1:], envelopes
+
+
+class Spool:
+    """ The segment files in directory """
+
+    def __init__(
+            self,
+            directory: str,
+            segment_size: int = 16 * 1024 * 1024,
+            max_bytes: int = 0,
+            fsync: str = FSYNC_INTERVAL,
+            fsync_interval: float = 1.0,
+            max_age: float = 1.0,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(
+                "Invalid fsync policy {!r}, expected one of {}".format(
+                    fsync, ", ".join(FSYNC_POLICIES)
+                )
+            )
+        self.directory = directory
+        self.name = os.path.basename(directory.rstrip(os.sep))
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_age = max_age
+
+        self.condition = threading.Condition()
+        sequences = self.sequences()
+        self.sequence = sequences[-1] + 1 if sequences else 0
+        self.file = None  # type: typing.Optional[typing.BinaryIO]
+        self.segment_bytes = 0
+        self.opened_at = self.synced_at = time.monotonic()
+        self.segment_count = len(sequences)
+        self.bytes = sum(
+            os.path.getsize(self.path(sequence)) for sequence in sequences
+        )
+
+        self.appended_batches = 0
+        self.appended_lines = 0
+        self.drained_batches = 0
+        self.drained_lines = 0
+        self.full_waits = 0
+        self.quarantined = 0
+        self._measure()
+
+    def path(self, sequence: int) -> str:
+        """ The path of the segment with the given sequence number """
+        return os.path.join(
+            self.directory, "{:016d}{}".format(sequence, SUFFIX)
+        )
+
+    def sequences(self) -> typing.List[int]:
+        """ The sequence numbers of the segments on disk, oldest first """
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for filename in os.listdir(self.directory):
+            stem, suffix = os.path.splitext(filename)
+            if suffix == SUFFIX and stem.isdigit():
+                result.append(int(stem))
+        return sorted(result)
+
+    def append(
+            self,
+            container_id: str,
+            name: str,
+            payloads: typing.List[str],
+            envelopes: typing.List[Envelope] = None,
+            timeout: float = None,
+    ) -> None:
+        """ Add a batch, waiting up to timeout seconds (forever if None)
+        for the drainer to make room under max_bytes
+        """
+        record = encode(container_id, name, payloads, envelopes)
+        with self.condition:
+            if self._full(len(record)):
+                self.full_waits += 1
+                logger.warning(
+                    "Spool %s is full, waiting for the database",
+                    self.directory
+                )
+                if not self.condition.wait_for(
+                        lambda: not self._full(len(record)), timeout
+                ):
+                    raise SpoolFull(self.directory)
+
+            if self.file is None:
+                # close() removes the directory once empty
+                os.makedirs(self.directory, exist_ok=True)
+                self.file = open(self.path(self.sequence), "ab")
+                self.segment_bytes = 0
+                self.opened_at = time.monotonic()
+                self.segment_count += 1
+            self.file.write(record)
+            self.file.flush()
+            self.segment_bytes += len(record)
+            self.bytes += len(record)
+            self.appended_batches += 1
+            self.appended_lines += len(payloads)
+
+            if self.segment_bytes >= self.segment_size:
+                self._seal()
+            elif self.fsync == FSYNC_ALWAYS:
+                os.fsync(self.file.fileno())
+            elif self.fsync == FSYNC_INTERVAL:
+                now = time.monotonic()
+                if now - self.synced_at >= self.fsync_interval:
+                    os.fsync(self.file.fileno())
+                    self.synced_at = now
+            self._measure()
+            self.condition.notify_all()
+
+    def _full(self, size: int) -> bool:
+        # a single batch larger than the cap is let through an empty spool
+        return bool(self.max_bytes) and self.bytes > 0 \
+            and self.bytes + size > self.max_bytes
+
+    def _seal(self) -> None:
+        """ Close the current segment, the next append starts a new one """
+        if self.file is None:
+            return
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        self.sequence += 1
+
+    def _measure(self) -> None:
+        metrics.SPOOL_SEGMENTS.set(self.segment_count, self.name)
+        metrics.SPOOL_BYTES.set(self.bytes, self.name)
+
+    def _ready_in(self) -> typing.Optional[float]:
+        """ Seconds until there is a segment to drain, None if empty """
+        current = self.segment_bytes if self.file is not None else 0
+        if self.bytes > current:
+            return 0.0
+        if self.file is None:
+            return None
+        return max(0.0, self.max_age - (time.monotonic() - self.opened_at))
+
+    def segments(self, seal: bool = False) -> typing.List[str]:
+        """ The paths of the segments to drain, oldest first.  The current
+        segment is only sealed and included once it is max_age seconds
+        old, or if seal is set.
+        """
+        with self.condition:
+            if self.file is not None and (
+                    seal or time.monotonic() - self.opened_at >= self.max_age
+            ):
+                self._seal()
+            sequences = self.sequences()
+            if self.file is not None:
+                sequences.remove(self.sequence)
+            return [self.path(sequence) for sequence in sequences]
+
+    @staticmethod
+    def read(path: str) -> typing.Iterator[Batch]:
+        """ The batches of a segment, up to the first damaged record """
+        with open(path, "rb") as filp:
+            while True:
+                header = filp.read(HEADER.size)
+                if not header:
+                    return
+                data = b""
+                if len(header) == HEADER.size:
+                    length, checksum = HEADER.unpack(header)
+                    data = filp.read(length)
+                if len(header) < HEADER.size or len(data) < length \
+                        or zlib.crc32(data) != checksum:
+                    logger.warning(
+                        "Damaged record in %s at offset %d, skipping the "
+                        "rest of the segment", path,
+                        filp.tell() - len(header) - len(data)
+                    )
+                    return
+                yield decode(data)
+
+    def remove(self, path: str, batches: int = 0, lines: int = 0) -> None:
+        """ Delete a drained segment """
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self.condition:
+            self.bytes -= size
+            self.segment_count -= 1
+            self.drained_batches += batches
+            self.drained_lines += lines
+            self._measure()
+            self.condition.notify_all()
+
+    def quarantine(self, path: str) -> str:
+        """ Set a segment that can't be written aside, returns its new
+        path
+        """
+        size = os.path.getsize(path)
+        bad = path + BAD_SUFFIX
+        os.rename(path, bad)
+        with self.condition:
+            self.bytes -= size
+            self.segment_count -= 1
+            self.quarantined += 1
+            self._measure()
+            self.condition.notify_all()
+        return bad
+
+    def wait(self, timeout: float) -> bool:
+        """ Wait up to timeout seconds for a segment to drain, returns
+        whether there is any
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                ready_in = self._ready_in()
+                if ready_in == 0:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if ready_in is not None:
+                    remaining = min(remaining, ready_in)
+                self.condition.wait(remaining)
+
+    def wakeup(self) -> None:
+        """ Interrupt wait() """
+        with self.condition:
+            self.condition.notify_all()
+
+    def stats(self) -> typing.Dict[str, float]:
+        """ Size and counters of the spool """
+        with self.condition:
+            sequences = self.sequences()
+            oldest = 0.0
+            if sequences:
+                oldest = max(0.0, time.time() - os.path.getmtime(
+                    self.path(sequences[0])
+                ))
+            return {
+                "segments": len(sequences),
+                "bytes": self.bytes,
+                "oldest_seconds": oldest,
+                "appended_batches": self.appended_batches,
+                "appended_lines": self.appended_lines,
+                "drained_batches": self.drained_batches,
+                "drained_lines": self.drained_lines,
+                "full_waits": self.full_waits,
+                "quarantined": self.quarantined,
+            }
+
+    def close(self) -> None:
+        """ Seal the current segment, remove the directory if empty """
+        with self.condition:
+            self._seal()
+            metrics.SPOOL_SEGMENTS.remove(self.name)
+            metrics.SPOOL_BYTES.remove(self.name)
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
+
+
+class Drainer:
+    """ Replays the segments of a spool into the database """
+
+    def __init__(
+            self,
+            spool: Spool,
+            engine: sqlalchemy.engine.Engine,
+            sink,
+            interval: float = 1.0,
+    ):
+        self.spool = spool
+        self.engine = engine
+        self.sink = sink
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None  # type: typing.Optional[threading.Thread]
+
+    def drain(self, seal: bool = False) -> int:
+        """ Write and remove every closed segment, and the current one if
+        seal is set.  Returns the number of lines.
+        """
+        total = 0
+        for path in self.spool.segments(seal=seal):
+            if self.stopped.is_set():
+                break
+            try:
+                batches = list(self.spool.read(path))
+                if batches:
+                    db.retry(self._write, batches)
+            except (sqlalchemy.exc.StatementError, ValueError) as ex:
+                # retrying wouldn't help, don't let it block the rest
+                logger.error(
+                    "Can't write %s, moved to %s: %s",
+                    path, self.spool.quarantine(path), ex
+                )
+                continue
+            lines = sum(len(batch[2]) for batch in batches)
+            self.spool.remove(path, len(batches), lines)
+            logger.debug("Drained %d lines from %s", lines, path)
+            total += lines
+        return total
+
+    def _write(self, batches: typing.List[Batch]) -> None:
+        with self.sink.begin(self.engine) as connection:
+            for container_id, name, payloads, envelopes in batches:
+                self.sink.write(
+                    connection, container_id, name, payloads, envelopes
+                )
+
+    def run(self) -> None:
+        """ Drain until stopped """
+        while not self.stopped.is_set():
+            try:
+                self.drain()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Draining %s failed", self.spool.directory)
+                self.stopped.wait(self.interval)
+                continue
+            self.spool.wait(self.interval)
+
+    def start(self) -> None:
+        """ Drain in a background thread """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, drain: bool = False) -> None:
+        """ Stop the background thread, then write the remaining segments
+        if drain is set
+        """
+        self.stopped.set()
+        self.spool.wakeup()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if drain:
+            self.stopped.clear()
+            self.drain(seal=True)
+            self.stopped.set()
+
+
+def spool_from_settings(name: str) -> typing.Optional[Spool]:
+    """ The spool of the named writer in the directory configured in
+    settings, None when spooling is disabled
+    """
+    if not settings.SPOOL_DIR:
+        return None
+    return Spool(
+        os.path.join(settings.SPOOL_DIR, name),
+        segment_size=settings.SPOOL_SEGMENT_SIZE,
+        max_bytes=settings.SPOOL_MAX_BYTES,
+        fsync=settings.SPOOL_FSYNC,
+        fsync_interval=settings.SPOOL_FSYNC_INTERVAL,
+        max_age=settings.SPOOL_MAX_AGE,
+    )
+
+
+def main(args) -> int:
+    """ Print the state of the spools, drain them if asked to """
+    logging.basicConfig(level=logging.INFO)
+    if not os.path.isdir(args.directory):
+        logger.error("No spool directory %s", args.directory)
+        return 1
+
+    engine = db.create_engine() if args.drain else None
+    for name in sorted(os.listdir(args.directory)):
+        path = os.path.join(args.directory, name)
+        if not os.path.isdir(path):
+            continue
+        spool = Spool(path)
+        print(name, json.dumps(spool.stats(), sort_keys=True))
+        if args.drain:
+            lines = Drainer(spool, engine, create_sink(engine)).drain()
+            logger.info("Drained %d lines from %s", lines, path)
+    return 0
+
+
+def init():
+    """ Module initialization """
+    if __name__ == "__main__":
+        parser = argparse.ArgumentParser(
+            description="Inspect or replay the spools of stopped writers"
+        )
+        parser.add_argument(
+            "directory", nargs="?", default=settings.SPOOL_DIR
+        )
+        parser.add_argument(
+            "--drain", action="store_true", default=False,
+            help="write the spooled batches to the database; only while "
+                 "logsql isn't running"
+        )
+        sys.exit(main(parser.parse_args()))
+
+
+init()
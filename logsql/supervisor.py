@@ -0,0 +1,174 @@
+"""
+Supervision of the per-container clients.
+
+Exited clients are reaped; those that failed are restarted with an
+exponential backoff, those of removed containers are dropped.  Clients whose
+log file keeps growing while their checkpoint doesn't move are flagged as
+stalled.
+"""
+import time
+import logging
+import typing
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 300.0
+DEFAULT_STALL_CHECKS = 3
+
+
+class Child:
+    """ Supervision state of one container's client """
+
+    def __init__(self, container_id: str, started_at: float):
+        self.container_id = container_id
+        self.started_at = started_at
+        self.failures = 0  # consecutive
+        self.restart_at = None  # type: typing.Optional[float]
+
+        self.size = None  # type: typing.Optional[int]
+        self.offset = None  # type: typing.Optional[int]
+        self.stalled_checks = 0
+        self.stalled = False
+
+
+class Supervisor:
+    """ Keeps one live client per container in clients.
+
+    spawn(container_id) starts a client and returns an object with
+    poll(), like subprocess.Popen.  progress(container_id) returns the
+    size of the log file and the checkpointed offset into it, or None if
+    unknown.
+    """
+
+    def __init__(
+            self,
+            clients: dict,
+            spawn: typing.Callable[[str], typing.Any],
+            progress: typing.Callable[
+                [str], typing.Optional[typing.Tuple[int, int]]
+            ] = None,
+            min_backoff: float = DEFAULT_MIN_BACKOFF,
+            max_backoff: float = DEFAULT_MAX_BACKOFF,
+            stall_checks: int = DEFAULT_STALL_CHECKS,
+    ):
+        self.clients = clients
+        self.spawn = spawn
+        self.progress = progress
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stall_checks = stall_checks
+
+        self.children = {}  # type: typing.Dict[str, Child]
+
+    def start(self, container_id: str) -> None:
+        """ Start supervising a new client of the container """
+        self.clients[container_id] = self.spawn(container_id)
+        child = self.children.get(container_id)
+        if child is None:
+            self.children[container_id] = Child(
+                container_id, time.monotonic()
+            )
+        else:
+            child.started_at = time.monotonic()
+            child.restart_at = None
+
+    def remove(self, container_id: str) -> None:
+        """ The container is gone: stop its client and forget about it """
+        process = self.clients.pop(container_id, None)
+        self.children.pop(container_id, None)
+        if process is not None and process.poll() is None:
+            logger.info("Stopping client of removed container %s",
+                        container_id)
+            process.terminate()
+
+    def backoff(self, failures: int) -> float:
+        """ Delay before restarting after the given number of failures """
+        return min(
+            self.min_backoff * 2 ** (failures - 1), self.max_backoff
+        )
+
+    def check(self) -> None:
+        """ Reap, restart and check the progress of all clients """
+        now = time.monotonic()
+        for container_id, process in list(self.clients.items()):
+            child = self.children.get(container_id)
+            if child is None:
+                # added without start(), e.g. by tests
+                child = self.children[container_id] = Child(
+                    container_id, now
+                )
+
+            if child.restart_at is not None:
+                if now >= child.restart_at:
+                    logger.warning(
+                        "Restarting client of container %s (failure %d)",
+                        container_id, child.failures
+                    )
+                    self.start(container_id)
+                continue
+
+            returncode = process.poll()
+            if returncode is None:
+                logger.debug("Process %s is still running", container_id)
+                self._check_progress(child)
+                continue
+
+            self._exited(child, returncode, now)
+
+    def _exited(self, child: Child, returncode: int, now: float) -> None:
+        if returncode == 0:
+            # the log file is gone, i.e. the container was removed
+            logger.info(
+                "Client of container %s exited", child.container_id
+            )
+            self.clients.pop(child.container_id, None)
+            self.children.pop(child.container_id, None)
+            return
+
+        if now - child.started_at >= self.max_backoff:
+            # ran fine for a while, this is a new series of failures
+            child.failures = 0
+        child.failures += 1
+        delay = self.backoff(child.failures)
+        child.restart_at = now + delay
+        logger.error(
+            "Client of container %s failed with %d, restarting in %.0fs",
+            child.container_id, returncode, delay
+        )
+
+    def _check_progress(self, child: Child) -> None:
+        if self.progress is None:
+            return
+        progress = self.progress(child.container_id)
+        if progress is None:
+            return
+
+        size, offset = progress
+        growing = child.size is not None and size > child.size
+        if growing and offset == child.offset and offset < size:
+            child.stalled_checks += 1
+        else:
+            child.stalled_checks = 0
+            if child.stalled:
+                logger.info(
+                    "Client of container %s is making progress again",
+                    child.container_id
+                )
+            child.stalled = False
+        child.size, child.offset = size, offset
+
+        if child.stalled_checks >= self.stall_checks and not child.stalled:
+            child.stalled = True
+            logger.warning(
+                "Client of container %s is stalled at offset %d of %d",
+                child.container_id, offset, size
+            )
+
+    def stalled(self) -> typing.List[str]:
+        """ Ids of the containers whose client is stalled """
+        return [
+            container_id for container_id, child in self.children.items()
+            if child.stalled
+        ]
@@ -1,7 +1,323 @@
-""" Line/data transformation """
+""" Line/data transformation
+
+Besides the single transform() hook, transformation steps are registered
+for the containers they apply to, selected by name, image or label:
+
+    from logsql import transform
+
+    transform.register(
+        transform.Filter(lambda data: data.get("stream") == "stderr"),
+        transform.Enrich(lambda info: {"image": info["Config"]["Image"]}),
+        image="nginx*",
+    )
+
+When a container is added, the steps matching it are compiled into a
+Pipeline that transforms whole batches of records, stopping as soon as
+a step dropped all of them.  Plain functions taking (container_name, data)
+are wrapped as single-record steps.  Parse parses access logs with the
+parsing module, and is also applied to containers labeled logsql.parse.
+Modules registering steps are listed in LOGSQL_TRANSFORMS so that every
+client process imports them.
+"""
+import fnmatch
+import importlib
+import logging
+import typing
+
+from . import parsing, settings
+
+
+logger = logging.getLogger(__name__)
+
+Records = typing.List[dict]
+BatchFunction = typing.Callable[[Records], Records]
+
+# container label with the parsing format of its log lines
+PARSE_LABEL = "logsql.parse"
 
 
 def transform(container_name, data):
     """ Simple filter function that can be overloaded """
     # pylint: disable=unused-argument
     return data
+
+
+class Step:
+    """ A batch transformation, bound to a container by compile() """
+
+    def bind(self, info: dict) -> BatchFunction:
+        """ The function transforming the batches of the container with the
+        given inspect data
+        """
+        raise NotImplementedError()
+
+
+class Filter(Step):
+    """ Keeps the records for which predicate(data) is true """
+
+    def __init__(self, predicate: typing.Callable[[dict], bool]):
+        self.predicate = predicate
+
+    def bind(self, info):
+        predicate = self.predicate
+        return lambda records: [data for data in records if predicate(data)]
+
+
+class Map(Step):
+    """ Replaces each record by func(data), dropping it if that's falsy """
+
+    def __init__(self, func: typing.Callable[[dict], typing.Optional[dict]]):
+        self.func = func
+
+    def bind(self, info):
+        func = self.func
+        return lambda records: [
+            result for result in map(func, records) if result
+        ]
+
+
+class Enrich(Step):
+    """ Adds fields to every record.
+
+    fields is a dict, or a function of the container's inspect data that
+    is called once when the pipeline is compiled.
+    """
+
+    def __init__(
+            self,
+            fields: typing.Union[dict, typing.Callable[[dict], dict]],
+    ):
+        self.fields = fields
+
+    def bind(self, info):
+        fields = self.fields(info) if callable(self.fields) else self.fields
+
+        def _enrich(records):
+            for data in records:
+                data.update(fields)
+            return records
+        return _enrich
+
+
+class Batch(Step):
+    """ A function of the container's inspect data and a list of records,
+    returning the transformed list
+    """
+
+    def __init__(self, func: typing.Callable[[dict, Records], Records]):
+        self.func = func
+
+    def bind(self, info):
+        func = self.func
+        return lambda records: func(info, records)
+
+
+class Legacy(Step):
+    """ A single-record transform(container_name, data), dropping the
+    record if it returns a falsy value
+    """
+
+    def __init__(self, func: typing.Callable[[str, dict], dict]):
+        self.func = func
+
+    def bind(self, info):
+        func = self.func
+        name = info["Name"]
+        return lambda records: [
+            result for result in (func(name, data) for data in records)
+            if result
+        ]
+
+
+class Parse(Step):
+    """ Parses a field of every record, docker's log line by default, with
+    a format spec, see parsing.compile_format().
+
+    The parsed fields are added to the record, or under target if given.
+    Records that don't match are kept as they are, unless drop is set.
+    """
+
+    def __init__(
+            self,
+            spec: str,
+            field: str = "log",
+            target: str = None,
+            drop: bool = False,
+    ):
+        self.spec = spec
+        self.field = field
+        self.target = target
+        self.drop = drop
+
+    def bind(self, info):
+        parser = parsing.compile_format(self.spec)
+        field, target, drop = self.field, self.target, self.drop
+
+        def _parse(records):
+            lines = []
+            for data in records:
+                value = data.get(field)
+                lines.append(
+                    value.rstrip("\n") if isinstance(value, str) else ""
+                )
+            result = []
+            for data, parsed in zip(records, parser.parse_many(lines)):
+                if parsed is None:
+                    if not drop:
+                        result.append(data)
+                elif target:
+                    data[target] = parsed
+                    result.append(data)
+                else:
+                    data.update(parsed)
+                    result.append(data)
+            return result
+        return _parse
+
+
+def as_step(step: typing.Union[Step, typing.Callable]) -> Step:
+    """ The step itself, or a single-record function wrapped as a step """
+    if isinstance(step, Step):
+        return step
+    return Legacy(step)
+
+
+class Pipeline:
+    """ The steps of one container, compiled """
+
+    def __init__(
+            self,
+            info: dict,
+            functions: typing.Sequence[BatchFunction] = (),
+    ):
+        self.info = info
+        self.functions = list(functions)
+
+    @property
+    def identity(self) -> bool:
+        """ Whether the pipeline leaves the records as they are """
+        return not self.functions
+
+    def __call__(self, records: Records) -> Records:
+        for func in self.functions:
+            if not records:
+                break
+            records = func(records)
+        return records
+
+
+def _matches(
+        pattern: typing.Optional[str],
+        value: typing.Optional[str],
+) -> bool:
+    return pattern is None or \
+        (value is not None and fnmatch.fnmatchcase(value, pattern))
+
+
+class Rule:
+    """ Steps applied to the containers matching name, image and label """
+
+    def __init__(
+            self,
+            steps: typing.Sequence[Step],
+            name: str = None,
+            image: str = None,
+            label: str = None,
+    ):
+        self.steps = steps
+        self.name = name.lstrip("/") if name else None
+        self.image = image
+        self.label = label
+
+    def matches(self, info: dict) -> bool:
+        """ Whether the rule applies to the container """
+        config = info.get("Config") or {}
+        if not _matches(self.name, info.get("Name", "").lstrip("/")):
+            return False
+        if not _matches(self.image, config.get("Image")):
+            return False
+        if self.label is not None:
+            key, _, value = self.label.partition("=")
+            labels = config.get("Labels") or {}
+            if key not in labels:
+                return False
+            if value and labels[key] != value:
+                return False
+        return True
+
+
+class Registry:
+    """ Transformation steps by container """
+
+    def __init__(self):
+        self.rules = []  # type: typing.List[Rule]
+
+    def register(
+            self,
+            *steps: typing.Union[Step, typing.Callable],
+            name: str = None,
+            image: str = None,
+            label: str = None,
+    ) -> None:
+        """ Apply the steps, in order, to the containers matching all of the
+        given name, image (glob patterns) and label (key or key=value)
+        """
+        self.rules.append(Rule(
+            [as_step(step) for step in steps],
+            name=name, image=image, label=label
+        ))
+
+    def clear(self) -> None:
+        """ Remove all rules """
+        del self.rules[:]
+
+    def compile(self, info: dict) -> Pipeline:
+        """ The pipeline of the container with the given inspect data, the
+        steps of all matching rules in the order they were registered
+        """
+        return Pipeline(info, [
+            step.bind(info)
+            for rule in self.rules if rule.matches(info)
+            for step in rule.steps
+        ])
+
+
+REGISTRY = Registry()
+register = REGISTRY.register
+
+_LOADED = set()  # type: typing.Set[str]
+
+
+def load_plugins(modules: str = None) -> None:
+    """ Import the comma separated modules registering steps, once """
+    modules = modules if modules is not None else settings.TRANSFORMS
+    for module in modules.split(","):
+        module = module.strip()
+        if module and module not in _LOADED:
+            importlib.import_module(module)
+            _LOADED.add(module)
+
+
+def compile_pipeline(info: dict) -> Pipeline:
+    """ The pipeline of the container with the given inspect data.
+
+    Log lines of containers labeled PARSE_LABEL=<format spec> are parsed
+    before the registered steps run.
+    """
+    load_plugins()
+    pipeline = REGISTRY.compile(info)
+    labels = (info.get("Config") or {}).get("Labels") or {}
+    spec = labels.get(PARSE_LABEL)
+    if spec:
+        try:
+            pipeline.functions.insert(0, Parse(spec).bind(info))
+        except ValueError as exc:
+            logger.warning("%s: %s", info.get("Name"), exc)
+    return pipeline
+
+
+def transform_batch(info: dict, records: Records) -> Records:
+    """ Transform a batch of the container's records, compiling its
+    pipeline on the fly; tailers compile it once instead
+    """
+    return compile_pipeline(info)(records)
@@ -1,14 +1,24 @@
 """ Utility function s """
 import re
 import os
+import datetime
 import subprocess
 import typing
 
+from .parsing import RegexParser
+
 NGINX_COMBINED_REGEX = re.compile(
     # pylint:disable=line-too-long
     r"""\s*(?P<remote_addr>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) - (?P<remote_user>\S+) \[(?P<datetime>\d{2}/[a-z]{3}/\d{4}:\d{2}:\d{2}:\d{2} ([+-]\d{4}))] \"(?P<request_method>\w+) (?P<url>\S+) (?P<http_version>[^"]+)" (?P<status_code__int>\d{3}) (?P<bytes_sent__int>\d+) (["](?P<referrer>(-)|(.+))["]) (["](?P<user_agent>.+)["])\s*""",  # noqa
     re.IGNORECASE
 )
+# the __int suffixes are resolved once, when the parser is built
+NGINX_COMBINED_PARSER = RegexParser(NGINX_COMBINED_REGEX)
+
+# RFC 3339 with up to nanoseconds, as written by docker's json-file driver
+DOCKER_TIME_REGEX = re.compile(
+    r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:\d{2})$"
+)
 
 
 def inode_number(
@@ -22,6 +32,24 @@ def inode_number(
         return -1
 
 
+def rotated_paths(path: str) -> typing.List[str]:
+    """ The rotated files of a json-file log, path.N ... path.1, oldest
+    first.  Compressed ones (docker's compress option) can't be followed
+    by inode and are skipped.
+    """
+    directory, basename = os.path.split(path)
+    prefix = basename + "."
+    try:
+        names = os.listdir(directory or ".")
+    except FileNotFoundError:
+        return []
+    numbers = [
+        int(name[len(prefix):]) for name in names
+        if name.startswith(prefix) and name[len(prefix):].isdigit()
+    ]
+    return [path + "." + str(number) for number in sorted(numbers)[::-1]]
+
+
 def containers_chown(
         path: str
 ):
@@ -42,17 +70,24 @@ def parse_nginx_combined(
         line: str
 ) -> typing.Optional[dict]:
     """ Parse an NGINX combined line into a dict """
-    match = NGINX_COMBINED_REGEX.match(line)
-    if not match:
-        return None
+    return NGINX_COMBINED_PARSER.parse(line)
 
-    result = {}
-    for key, value in match.groupdict().items():
-        tokens = key.split("__", 1)
-        if len(tokens) == 1:
-            result[key] = value
-        else:
-            # e.g. status_code__int -> status_code = int(value)
-            result[tokens[0]] = __builtins__[tokens[1]](value)
 
-    return result
+def parse_docker_time(
+        value: str
+) -> typing.Optional[datetime.datetime]:
+    """ Parse a json-file timestamp into an aware datetime, truncated to
+    microseconds, None if it isn't one
+    """
+    if not isinstance(value, str):
+        return None
+    match = DOCKER_TIME_REGEX.match(value)
+    if not match:
+        return None
+    seconds, fraction, zone = match.groups()
+    if zone == "Z":
+        zone = "+00:00"
+    fraction = ((fraction or "") + "000000")[:6]
+    return datetime.datetime.fromisoformat(
+        seconds + "." + fraction + zone
+    )
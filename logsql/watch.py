@@ -0,0 +1,329 @@
+"""
+Wait for log file changes.
+
+On Linux the json log file and its directory are watched with inotify, so
+tailers wake up as soon as data is written and only look for a rotation
+when the file was actually moved or deleted.  Where inotify isn't
+available, or the watch limit is exhausted, waiters fall back to polling
+with an interval that backs off while the file is idle.
+
+The waiters of a process share one inotify instance (see InotifyHub): the
+default fs.inotify.max_user_instances is only 128, far fewer than the
+containers of a busy host.
+"""
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+import typing
+
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+IN_MASK_ADD = 0x20000000
+
+FILE_MASK = IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF
+DIRECTORY_MASK = IN_CREATE | IN_MOVED_TO
+
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+DEFAULT_MIN_INTERVAL = 0.05
+
+
+class Inotify:
+    """ Minimal ctypes binding of the Linux inotify API """
+    _libc = None
+
+    def __init__(self):
+        if Inotify._libc is None:
+            name = ctypes.util.find_library("c")
+            if not name:
+                raise OSError(errno.ENOSYS, "libc not found")
+            Inotify._libc = ctypes.CDLL(name, use_errno=True)
+        self.libc = Inotify._libc
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self._check(
+            self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        )
+
+    @staticmethod
+    def _check(result: int) -> int:
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return result
+
+    def fileno(self) -> int:
+        """ The file descriptor that becomes readable on events """
+        return self.fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """ Watch path for the given events, returns the watch descriptor """
+        return self._check(
+            self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        )
+
+    def rm_watch(self, wd: int) -> None:
+        """ Stop watching, errors are ignored since the path may be gone """
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> typing.List[typing.Tuple[int, int, str]]:
+        """ All pending (wd, mask, name) events, without blocking """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self) -> None:
+        """ Release the inotify instance and all its watches """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollWaiter:
+    """ Adaptive polling: the interval doubles while nothing happens """
+
+    def __init__(
+            self,
+            path: str,
+            min_interval: float = DEFAULT_MIN_INTERVAL,
+    ):
+        self.path = path
+        self.min_interval = min_interval
+        self.interval = min_interval
+
+    def fileno(self) -> typing.Optional[int]:
+        """ Polling has no file descriptor to wait on """
+        return None
+
+    def delay(self, timeout: float) -> float:
+        """ The next sleep duration, at most timeout """
+        delay = min(self.interval, timeout)
+        self.interval = min(self.interval * 2, timeout)
+        return delay
+
+    def wait(self, timeout: float) -> None:
+        """ Sleep for the current polling interval """
+        time.sleep(self.delay(timeout))
+
+    def drain(self) -> None:
+        """ Nothing is queued when polling """
+
+    def reset(self) -> None:
+        """ Data was read, poll quickly again """
+        self.interval = self.min_interval
+
+    def rotated(self) -> bool:
+        """ Polling can't tell, so the caller always has to check """
+        return True
+
+    def rewatch(self) -> None:
+        """ Nothing to do for a new file """
+
+    def close(self) -> None:
+        """ Nothing to release """
+
+
+class InotifyHub:
+    """ One inotify instance shared by all the waiters of a process,
+    dispatching the events to the waiters of their watch descriptor
+    """
+
+    def __init__(self):
+        self.inotify = Inotify()
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+        # the same path watched twice gets the same wd
+        self.waiters = {}  # type: typing.Dict[int, typing.List[InotifyWaiter]]
+
+    def fileno(self) -> int:
+        """ The file descriptor that becomes readable on events """
+        return self.inotify.fileno()
+
+    def add_watch(self, waiter: "InotifyWaiter", path: str, mask: int) -> int:
+        """ Watch path for waiter, returns the watch descriptor """
+        with self.lock:
+            # don't replace the mask of another waiter of the same path
+            wd = self.inotify.add_watch(path, mask | IN_MASK_ADD)
+            waiters = self.waiters.setdefault(wd, [])
+            if waiter not in waiters:
+                waiters.append(waiter)
+            return wd
+
+    def rm_watch(self, waiter: "InotifyWaiter", wd: int) -> None:
+        """ Stop watching wd for waiter, and at all once nobody does """
+        with self.lock:
+            waiters = self.waiters.get(wd)
+            if waiters is None:
+                return
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                del self.waiters[wd]
+                self.inotify.rm_watch(wd)
+
+    def dispatch(self) -> None:
+        """ Hand all pending events to their waiters, without blocking """
+        with self.lock:
+            for wd, mask, name in self.inotify.read():
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, every waiter has to check
+                    waiters = {
+                        id(waiter): waiter
+                        for waiters in self.waiters.values()
+                        for waiter in waiters
+                    }.values()
+                else:
+                    waiters = self.waiters.get(wd, [])
+                for waiter in list(waiters):
+                    waiter.handle(wd, mask, name)
+                if mask & IN_IGNORED:
+                    # the kernel removed the watch
+                    self.waiters.pop(wd, None)
+
+
+_HUB = None  # type: typing.Optional[InotifyHub]
+_HUB_LOCK = threading.Lock()
+
+
+def get_hub() -> InotifyHub:
+    """ The InotifyHub of the current process, raises OSError if inotify
+    isn't available
+    """
+    global _HUB  # pylint: disable=global-statement
+    with _HUB_LOCK:
+        if _HUB is None or _HUB.pid != os.getpid():
+            _HUB = InotifyHub()
+        return _HUB
+
+
+class InotifyWaiter:
+    """ Wait for inotify events on a log file and its directory """
+
+    def __init__(self, path: str, hub: InotifyHub = None):
+        self.path = path
+        self.directory, self.basename = os.path.split(path)
+        self.hub = hub or get_hub()
+        self._rotated = False
+        # events arrived that were not waited for yet
+        self.pending = False
+        # called on every event, from the thread that dispatches them
+        self.callback = None  # type: typing.Optional[typing.Callable]
+        self.file_wd = None
+        self.directory_wd = self.hub.add_watch(
+            self, self.directory or ".", DIRECTORY_MASK
+        )
+        try:
+            self.file_wd = self.hub.add_watch(self, path, FILE_MASK)
+        except OSError:
+            self.hub.rm_watch(self, self.directory_wd)
+            raise
+
+    def fileno(self) -> typing.Optional[int]:
+        """ Readable when events are pending, shared with other waiters """
+        return self.hub.fileno()
+
+    def delay(self, timeout: float) -> float:
+        """ Events wake us up, the timeout is only a safety net """
+        return timeout
+
+    def handle(self, wd: int, mask: int, name: str) -> None:
+        """ An event for one of our watches, remembering any rotation """
+        if mask & IN_Q_OVERFLOW:
+            # a rotation may have been dropped
+            self._rotated = True
+        elif wd == self.file_wd:
+            if mask & (IN_MOVE_SELF | IN_DELETE_SELF | IN_IGNORED):
+                self._rotated = True
+        elif wd == self.directory_wd and name == self.basename:
+            self._rotated = True
+        self.pending = True
+        if self.callback is not None:
+            self.callback()
+
+    def wait(self, timeout: float) -> None:
+        """ Block until an event arrives or timeout expires """
+        self.hub.dispatch()
+        if not self.pending:
+            select.select([self.hub.fileno()], [], [], timeout)
+        self.drain()
+
+    def drain(self) -> None:
+        """ Process pending events """
+        self.hub.dispatch()
+        self.pending = False
+
+    def reset(self) -> None:
+        """ Nothing to adapt """
+
+    def rotated(self) -> bool:
+        """ Whether the file was moved, deleted or re-created since the
+        last call
+        """
+        result = self._rotated
+        self._rotated = False
+        return result
+
+    def rewatch(self) -> None:
+        """ Watch the file that now lives at path """
+        if self.file_wd is not None:
+            self.hub.rm_watch(self, self.file_wd)
+            self.file_wd = None
+        try:
+            self.file_wd = self.hub.add_watch(self, self.path, FILE_MASK)
+        except FileNotFoundError:
+            # the directory watch reports when it is created
+            pass
+
+    def close(self) -> None:
+        """ Remove our watches, the shared instance stays open """
+        self.callback = None
+        for wd in (self.file_wd, self.directory_wd):
+            if wd is not None:
+                self.hub.rm_watch(self, wd)
+        self.file_wd = self.directory_wd = None
+
+
+def create_waiter(
+        path: str,
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+):
+    """ An InotifyWaiter for path if possible, otherwise a PollWaiter """
+    try:
+        return InotifyWaiter(path)
+    except OSError as ex:
+        logger.warning(
+            "inotify unavailable for %s (%s), falling back to polling",
+            path, ex
+        )
+        return PollWaiter(path, min_interval=min_interval)
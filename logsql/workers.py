@@ -0,0 +1,384 @@
+"""
+Sharded worker pool.
+
+A fixed number of worker processes (by default one per CPU core) each run
+the asyncio engine for many containers.  Containers are assigned to
+workers by consistent hashing of their id, so containers coming and going
+don't move the others.  When a container does have to move, e.g. because
+the pool is resized, it is only added to its new worker once the old one
+has stopped tailing it, and it resumes from its checkpoint there.
+"""
+import os
+import time
+import queue
+import bisect
+import hashlib
+import logging
+import threading
+import multiprocessing
+import typing
+
+from . import client, db, metrics, settings
+from .checkpoint import store_from_settings
+from .engine import Engine
+from .spool import spool_from_settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLICAS = 100
+REMOVE_TIMEOUT = 10.0
+
+# values in the shared stats array of a worker
+STAT_CONTAINERS = 0
+STAT_LINES = 1
+STATS = 2
+
+
+class HashRing:
+    """ Consistent hashing of keys onto nodes """
+
+    def __init__(
+            self,
+            nodes: typing.Iterable[int] = (),
+            replicas: int = DEFAULT_REPLICAS,
+    ):
+        self.replicas = replicas
+        self.positions = []  # type: typing.List[int]
+        self.owners = {}  # type: typing.Dict[int, int]
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def add(self, node: int) -> None:
+        """ Add a node, taking over 1/N of the keys """
+        for replica in range(self.replicas):
+            position = self._hash("{}:{}".format(node, replica))
+            self.owners[position] = node
+            bisect.insort(self.positions, position)
+
+    def remove(self, node: int) -> None:
+        """ Remove a node, its keys move to the remaining nodes """
+        for replica in range(self.replicas):
+            position = self._hash("{}:{}".format(node, replica))
+            del self.owners[position]
+            self.positions.remove(position)
+
+    def node(self, key: str) -> int:
+        """ The node that owns key """
+        index = bisect.bisect(self.positions, self._hash(key))
+        if index == len(self.positions):
+            index = 0
+        return self.owners[self.positions[index]]
+
+
+def worker_main(
+        index: int,
+        commands: multiprocessing.Queue,
+        events: multiprocessing.Queue,
+        stats,
+        batch_size: int,
+        watch: bool,
+        debug: bool = False,
+):
+    """ Entry point of a worker process """
+    logging.basicConfig(
+        format="%(levelname)s:worker-" + str(index) + ":%(message)s",
+        level=logging.DEBUG if debug else logging.INFO,
+    )
+    metrics.start_exporter()
+    engine = db.create_engine(pool_size=settings.POOL_SIZE + 1)
+    tailing = Engine(
+        engine,
+        batch_size=batch_size,
+        watch=watch,
+        checkpoints=store_from_settings(engine),
+        spool=spool_from_settings("worker-{}".format(index)),
+    )
+    tailing.start()
+
+    tailers = {}
+    while True:
+        try:
+            command = commands.get(timeout=1.0)
+        except queue.Empty:
+            command = None
+
+        for container_id, tailer in list(tailers.items()):
+            if tailer.poll() is not None:
+                del tailers[container_id]
+                events.put(("exited", index, container_id, tailer.poll()))
+        stats[STAT_CONTAINERS] = len(tailers)
+        stats[STAT_LINES] = tailing.lines_written
+
+        if command is None:
+            continue
+        action = command[0]
+        if action == "add":
+            _, container_id, info = command
+            tailers[container_id] = tailing.add_container(container_id, info)
+        elif action == "remove":
+            _, container_id = command
+            tailer = tailers.pop(container_id, None)
+            if tailer is not None:
+                tailer.terminate()
+                _wait_for(tailer)
+            # the next worker resumes from the checkpoint, which must be
+            # written, not queued
+            tailing.checkpoints.flush()
+            events.put(("removed", index, container_id, None))
+        elif action == "stop":
+            break
+
+    tailing.stop()
+    tailing.checkpoints.close()
+
+
+def _wait_for(tailer) -> None:
+    for _ in range(int(REMOVE_TIMEOUT * 100)):
+        if tailer.poll() is not None:
+            return
+        time.sleep(0.01)
+
+
+class WorkerTailer:
+    """ Handle for a container tailed by the pool, like subprocess.Popen """
+
+    def __init__(self, pool: "WorkerPool", container_id: str):
+        self.pool = pool
+        self.container_id = container_id
+        self.returncode = None  # type: typing.Optional[int]
+
+    def poll(self) -> typing.Optional[int]:
+        """ None while the container is tailed, otherwise the return code """
+        return self.returncode
+
+    def terminate(self) -> None:
+        """ Stop tailing the container """
+        self.pool.remove_container(self.container_id)
+
+
+class WorkerPool:
+    """ Worker processes multiplexing the containers between them """
+
+    def __init__(
+            self,
+            size: int = None,
+            batch_size: int = client.DEFAULT_BATCH_SIZE,
+            watch: bool = False,
+            debug: bool = False,
+    ):
+        self.size = size or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.watch = watch
+        self.debug = debug
+
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        # by worker index, as long as size
+        self.stats = []  # type: list
+        self.processes = []  # type: typing.List[multiprocessing.Process]
+        self.commands = []  # type: typing.List[multiprocessing.Queue]
+
+        self.lock = threading.RLock()
+        self.ring = HashRing(range(self.size))
+        self.infos = {}  # type: typing.Dict[str, dict]
+        self.handles = {}  # type: typing.Dict[str, WorkerTailer]
+        self.assigned = {}  # type: typing.Dict[str, int]
+        # containers waiting for their old worker to let go of them
+        self.moving = {}  # type: typing.Dict[str, int]
+        self.thread = None  # type: typing.Optional[threading.Thread]
+        self.quit = False
+
+    def start(self) -> None:
+        """ Start all workers """
+        for index in range(self.size):
+            self._add_worker(index)
+        metrics.WORKER_CONTAINERS.set_function(
+            lambda: self._metric(STAT_CONTAINERS)
+        )
+        metrics.WORKER_LINES.set_function(lambda: self._metric(STAT_LINES))
+        self.thread = threading.Thread(target=self._event_handler)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _add_worker(self, index: int) -> None:
+        self.commands.append(self.context.Queue())
+        self.stats.append(self.context.Array("d", STATS, lock=False))
+        self.processes.append(self._start_worker(index))
+
+    def _start_worker(self, index: int) -> multiprocessing.Process:
+        process = self.context.Process(
+            target=worker_main,
+            args=(
+                index, self.commands[index], self.events, self.stats[index],
+                self.batch_size, self.watch, self.debug,
+            ),
+            name="logsql-worker-" + str(index),
+        )
+        process.daemon = True
+        process.start()
+        logger.info("Started worker %d, PID %d", index, process.pid)
+        return process
+
+    def add_container(self, container_id: str, info: dict) -> WorkerTailer:
+        """ Tail the container in the worker that owns it """
+        with self.lock:
+            handle = WorkerTailer(self, container_id)
+            self.handles[container_id] = handle
+            self.infos[container_id] = info
+            self._assign(container_id, self.ring.node(container_id))
+            return handle
+
+    def _assign(self, container_id: str, index: int) -> None:
+        self.assigned[container_id] = index
+        self.commands[index].put(
+            ("add", container_id, self.infos[container_id])
+        )
+
+    def remove_container(self, container_id: str) -> None:
+        """ Stop tailing the container """
+        with self.lock:
+            self.handles.pop(container_id, None)
+            self.infos.pop(container_id, None)
+            self.moving.pop(container_id, None)
+            index = self.assigned.pop(container_id, None)
+            if index is not None:
+                self.commands[index].put(("remove", container_id))
+
+    def resize(self, size: int) -> None:
+        """ Change the number of workers, moving the containers whose owner
+        changed.  Removed workers let go of their containers, then stop.
+        """
+        size = max(1, size)
+        with self.lock:
+            while self.size < size:
+                self._add_worker(self.size)
+                self.ring.add(self.size)
+                self.size += 1
+            removed = []
+            while self.size > size:
+                self.size -= 1
+                self.ring.remove(self.size)
+                removed.append(self.size)
+            self._rebalance()
+            for index in removed:
+                # after the removes queued by _rebalance
+                self.commands[index].put(("stop",))
+            processes = self.processes[self.size:]
+            del self.processes[self.size:]
+            del self.commands[self.size:]
+            del self.stats[self.size:]
+
+        for process in processes:
+            process.join(timeout=REMOVE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            logger.info("Stopped worker %s", process.name)
+
+        with self.lock:
+            # the containers of workers that stopped without letting go
+            for container_id, index in list(self.assigned.items()):
+                if index >= self.size:
+                    owner = self.moving.pop(container_id, None)
+                    self._assign(
+                        container_id,
+                        self.ring.node(container_id) if owner is None
+                        else owner
+                    )
+
+    def _rebalance(self) -> None:
+        for container_id, index in list(self.assigned.items()):
+            owner = self.ring.node(container_id)
+            if owner != index and container_id not in self.moving:
+                logger.info(
+                    "Moving container %s from worker %d to %d",
+                    container_id, index, owner
+                )
+                self.moving[container_id] = owner
+                self.commands[index].put(("remove", container_id))
+
+    def _event_handler(self) -> None:
+        while not self.quit:
+            try:
+                action, index, container_id, returncode = \
+                    self.events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):  # pragma: no cover
+                return
+            with self.lock:
+                if action == "removed":
+                    owner = self.moving.pop(container_id, None)
+                    if owner is not None:
+                        self._assign(container_id, owner)
+                elif action == "exited":
+                    if self.assigned.get(container_id) == index:
+                        del self.assigned[container_id]
+                        handle = self.handles.pop(container_id, None)
+                        if handle is not None:
+                            handle.returncode = returncode
+
+    def check(self) -> None:
+        """ Restart dead workers and re-add their containers """
+        with self.lock:
+            for index in range(self.size):
+                process = self.processes[index]
+                if process.is_alive():
+                    continue
+                logger.error(
+                    "Worker %d exited with %s, restarting",
+                    index, process.exitcode
+                )
+                self.commands[index] = self.context.Queue()
+                self.stats[index] = self.context.Array(
+                    "d", STATS, lock=False
+                )
+                self.processes[index] = self._start_worker(index)
+                for container_id, owner in list(self.assigned.items()):
+                    # moving containers go to their new owner below
+                    if owner == index and container_id not in self.moving:
+                        self._assign(container_id, index)
+                for container_id, owner in list(self.moving.items()):
+                    if self.assigned.get(container_id) == index:
+                        del self.moving[container_id]
+                        self._assign(container_id, owner)
+
+    def load(self) -> typing.List[dict]:
+        """ Per worker load: containers tailed and lines written """
+        result = []
+        with self.lock:
+            for index, process in enumerate(self.processes):
+                stats = self.stats[index]
+                result.append({
+                    "worker": index,
+                    "pid": process.pid,
+                    "alive": process.is_alive(),
+                    "containers": int(stats[STAT_CONTAINERS]),
+                    "lines": int(stats[STAT_LINES]),
+                })
+        return result
+
+    def _metric(self, stat: int) -> typing.Dict[typing.Tuple[str], float]:
+        with self.lock:
+            return {
+                (str(index),): stats[stat]
+                for index, stats in enumerate(self.stats)
+            }
+
+    def stop(self) -> None:
+        """ Stop all workers """
+        self.quit = True
+        metrics.WORKER_CONTAINERS.set_function(None)
+        metrics.WORKER_LINES.set_function(None)
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                self.commands[index].put(("stop",))
+        for process in self.processes:
+            process.join(timeout=REMOVE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
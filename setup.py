@@ -27,6 +27,9 @@ setup(
             "sphinx",
             "sphinxcontrib-napoleon",
         ],
+        "fast": [
+            "orjson",
+        ],
         "prod": [
             "psycopg2-binary",
             "docker-compose",
@@ -35,12 +35,16 @@ def session_fixture():
         assert settings.DATABASE_URL.endswith("_test")
 
     def _drop_all():
+        with ENGINE.begin() as connection:
+            for view in sqlalchemy.inspect(connection).get_view_names():
+                connection.execute("DROP VIEW " + view)
         meta = sqlalchemy.MetaData()
         meta.reflect(bind=ENGINE)
         meta.drop_all(bind=ENGINE)
 
     _drop_all()
     models.BASE.metadata.create_all(ENGINE)
+    models.create_views(ENGINE)
     session = models.Session()
     yield session
     session.close()
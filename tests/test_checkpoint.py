@@ -0,0 +1,155 @@
+import os
+
+import pytest
+import sqlalchemy
+
+from logsql import checkpoint, models, settings
+from logsql.checkpoint import (
+    CheckpointStore, DatabaseCheckpointStore, OffsetFileStore, create_store
+)
+from logsql.logpath import LogPath
+from logsql.sink import InsertSink
+from logsql.offsetfile import OffsetFile
+
+from . import utils
+
+PATH = "/tmp/test.log"
+STORE_PATH = "/tmp/test.checkpoints"
+
+
+def _store(flush_interval=0.0):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(STORE_PATH + suffix):
+            os.remove(STORE_PATH + suffix)
+    return CheckpointStore(STORE_PATH, flush_interval=flush_interval)
+
+
+def test_checkpoint_store():
+    store = _store()
+    assert store.read("XXX") is None
+
+    store.create("XXX", offset=17, inode=42).save()
+    store.close()
+
+    store = CheckpointStore(STORE_PATH)
+    saved = store.read("XXX")
+    assert (saved.inode, saved.offset) == (42, 17)
+    assert store.keys() == ["XXX"]
+
+    assert store.delete("XXX")
+    assert not store.delete("XXX")
+    assert store.read("XXX") is None
+    store.close()
+
+
+def test_checkpoint_store_group_commit():
+    store = _store(flush_interval=3600)
+    for key in ("AAA", "BBB", "CCC"):
+        store.create(key, offset=1, inode=1).save()
+    assert len(store.pending) == 3
+
+    # pending checkpoints are visible before they are flushed
+    assert store.read("AAA").offset == 1
+
+    other = CheckpointStore(STORE_PATH)
+    assert other.read("AAA") is None
+    store.flush()
+    assert other.read("AAA").offset == 1
+    assert not store.pending
+
+    assert store.reset() == 3
+    assert other.keys() == []
+    other.close()
+    store.close()
+
+
+def test_checkpoint_logpath():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+        print("line2", file=filp)
+
+    store = _store()
+    key = store.key("XXX", PATH)
+    assert key == "XXX"
+
+    logpath = LogPath(PATH, checkpoints=store, key=key)
+    assert logpath.readline() == "line1"
+    logpath.commit()
+    logpath.close()
+    assert not os.path.exists(PATH + OffsetFile.DEFAULT_SUFFIX)
+
+    logpath = LogPath(PATH, checkpoints=store, key=key)
+    assert logpath.readline() == "line2"
+    store.close()
+
+
+def test_offsetfile_store():
+    utils.cleanup(PATH)
+    store = create_store("")
+    assert isinstance(store, OffsetFileStore)
+    assert store.key("XXX", PATH) == PATH
+    assert store.read(PATH) is None
+
+    store.create(PATH, offset=1, inode=2).save()
+    store.flush()
+    assert store.read(PATH).offset == 1
+    assert store.delete(PATH)
+    assert not store.delete(PATH)
+    store.close()
+
+
+def test_database_checkpoint_store(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    store = DatabaseCheckpointStore(engine)
+    assert store.transactional
+    assert store.key("XXX", PATH) == "XXX"
+    assert store.read("XXX") is None
+
+    store.create("XXX", offset=1, inode=2).save()
+    saved = store.read("XXX")
+    assert (saved.inode, saved.offset) == (2, 1)
+
+    saved.offset = 3
+    with pytest.raises(RuntimeError):
+        with engine.begin() as connection:
+            InsertSink().write(connection, "XXX", "/test", ["{}"])
+            store.save(saved, connection)
+            raise RuntimeError()
+    assert store.read("XXX").offset == 1
+    assert session.query(models.Log).count() == 0
+
+    with engine.begin() as connection:
+        InsertSink().write(connection, "XXX", "/test", ["{}"])
+        store.save(saved, connection)
+    assert store.read("XXX").offset == 3
+    assert session.query(models.Log).count() == 1
+
+    assert store.reset() == 1
+    assert not store.delete("XXX")
+    store.close()
+
+
+def test_database_checkpoint_logpath(session, mocker):
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+        print("line2", file=filp)
+
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    store = checkpoint.store_from_settings(engine)
+    assert isinstance(store, OffsetFileStore)
+
+    mocker.patch.object(settings, "CHECKPOINT_DATABASE", True)
+    store = checkpoint.store_from_settings(engine)
+
+    logpath = LogPath(PATH, checkpoints=store, key="XXX")
+    assert logpath.readline() == "line1"
+    with engine.begin() as connection:
+        logpath.commit(connection)
+    logpath.close()
+
+    logpath = LogPath(PATH, checkpoints=store, key="XXX")
+    assert logpath.offsetfile.offset == 6
+    assert logpath.readline() == "line2"
+    assert store.delete("XXX")
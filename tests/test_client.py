@@ -1,11 +1,15 @@
+import os
 import multiprocessing
 
 from addict import Dict
 
-from logsql import client, models, utils
+from logsql import client, models, transform, utils
+from logsql.codec import get_codec
+from logsql.logpath import LogPath
 from logsql.offsetfile import OffsetFile
 
 from .logger import Logger
+from .utils import cleanup
 
 PATH = "/tmp/test.log"
 
@@ -122,3 +126,78 @@ def test_client_batch_size(logger, session):
     assert len(logs) == 2
     assert logs[0]["json"]["log"] == "line1\n"
     assert logs[1]["json"]["log"] == "line2\n"
+
+
+def test_client_read_batch():
+    cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print('{"log": "line1\\n", "stream": "stderr"}', file=filp)
+        print('{"log": "line2\\n", "stream": "stderr"}', file=filp)
+
+    log_path = LogPath(PATH)
+    payloads, envelopes, done = client.read_batch(
+        log_path, "/test", batch_size=1
+    )
+    assert payloads == ['{"log": "line1\\n", "stream": "stderr"}']
+    assert envelopes == [(None, "stderr", "line1")]
+    assert not done
+    payloads, _, done = client.read_batch(log_path, "/test")
+    assert len(payloads) == 1
+    assert client.read_batch(log_path, "/test") == ([], [], False)
+
+
+def test_client_read_batch_transform(mocker):
+    cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print('{"log": "line1\\n"}', file=filp)
+        print('{"log": "line2\\n"}', file=filp)
+        print('{"log": "line3\\n"}', file=filp)
+
+    def _side_effect(container_name, data):
+        assert container_name == "/test"
+        if data["log"] == "line1\n":
+            return None
+        data["upper"] = data["log"].upper()
+        return data
+
+    mocked = mocker.patch.object(client, "transform")
+    mocked.side_effect = _side_effect
+
+    log_path = LogPath(PATH)
+    codec = get_codec("json")
+    payloads, _, _ = client.read_batch(log_path, "/test", 1, codec)
+    assert codec.decode_batch(payloads) == [
+        {"log": "line2\n", "upper": "LINE2\n"}
+    ]
+
+
+def test_client_read_batch_pipeline():
+    cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print('{"log": "line1\\n", "stream": "stdout"}', file=filp)
+        print('{"log": "line2\\n", "stream": "stderr"}', file=filp)
+
+    pipeline = transform.Pipeline({"Name": "/test"}, [
+        transform.Filter(lambda data: data["stream"] == "stderr").bind({}),
+        transform.Enrich({"app": "test"}).bind({}),
+    ])
+    log_path = LogPath(PATH)
+    codec = get_codec("json")
+    payloads, envelopes, _ = client.read_batch(
+        log_path, "/test", 10, codec, pipeline
+    )
+    assert codec.decode_batch(payloads) == [
+        {"log": "line2\n", "stream": "stderr", "app": "test"}
+    ]
+    assert envelopes == [(None, "stderr", "line2")]
+
+
+def test_client_read_batch_removed():
+    cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print('{"log": "line1\\n"}', file=filp)
+
+    log_path = LogPath(PATH)
+    os.remove(PATH)
+    assert len(client.read_batch(log_path, "/test")[0]) == 1
+    assert client.read_batch(log_path, "/test") == ([], [], True)
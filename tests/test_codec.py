@@ -0,0 +1,35 @@
+import pytest
+
+from logsql import codec
+
+LINE = b'{"log": "h\\u00e9llo\\n", "stream": "stderr"}'
+
+
+@pytest.mark.parametrize("name", codec.available())
+def test_codec(name):
+    instance = codec.get_codec(name)
+    assert instance.name == name
+
+    expected = {"log": "héllo\n", "stream": "stderr"}
+    assert instance.loads(LINE) == expected
+    assert instance.loads(memoryview(LINE)) == expected
+    assert instance.loads(LINE.decode("utf-8")) == expected
+
+    records = instance.decode_batch([LINE, LINE])
+    assert records == [expected, expected]
+    payloads = instance.encode_batch(records)
+    assert all(isinstance(payload, str) for payload in payloads)
+    assert instance.decode_batch(payloads) == records
+
+
+def test_codec_default(mocker):
+    mocker.patch.object(codec.settings, "JSON_CODEC", "")
+    assert codec.get_codec().name == codec.available()[0]
+
+    mocker.patch.object(codec.settings, "JSON_CODEC", "json")
+    assert codec.get_codec().name == "json"
+
+
+def test_codec_unavailable():
+    with pytest.raises(ValueError):
+        codec.get_codec("XXX")
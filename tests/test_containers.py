@@ -0,0 +1,59 @@
+import datetime
+
+import sqlalchemy
+
+from logsql import containers, models, settings
+
+UTC = datetime.timezone.utc
+
+
+def _info(**state):
+    return {
+        "Id": "XXX",
+        "Name": "/test",
+        "Config": {"Image": "python:3.7", "Labels": {"app": "test"}},
+        "State": dict({
+            "Running": True,
+            "StartedAt": "2020-03-01T13:45:12.5Z",
+            "FinishedAt": "0001-01-01T00:00:00Z",
+        }, **state),
+    }
+
+
+def test_fields():
+    assert containers.fields(_info()) == {
+        "name": "/test",
+        "image": "python:3.7",
+        "labels": {"app": "test"},
+        "started_at": datetime.datetime(
+            2020, 3, 1, 13, 45, 12, 500000, tzinfo=UTC
+        ),
+        "stopped_at": None,
+    }
+    fields = containers.fields(_info(
+        Running=False, FinishedAt="2020-03-01T14:00:00Z"
+    ))
+    assert fields["stopped_at"] == datetime.datetime(
+        2020, 3, 1, 14, tzinfo=UTC
+    )
+
+
+def test_record(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    with engine.begin() as connection:
+        key = containers.ensure(connection, "XXX", "/old-name")
+        assert containers.ensure(connection, "XXX", "/ignored") == key
+
+    containers.record(engine, _info())
+    container = session.query(models.Container).one()
+    assert container.id == key
+    assert container.name == "/test"
+    assert container.image == "python:3.7"
+    assert container.labels == {"app": "test"}
+    assert container.stopped_at is None
+
+    containers.stopped(
+        engine, "XXX", datetime.datetime(2020, 3, 2, tzinfo=UTC)
+    )
+    session.expire_all()
+    assert session.query(models.Container).one().stopped_at.day == 2
@@ -0,0 +1,58 @@
+import pytest
+import sqlalchemy.exc
+from sqlalchemy.pool import QueuePool
+
+from logsql import db, settings
+
+
+def _operational_error():
+    return sqlalchemy.exc.OperationalError(
+        "SELECT 1", {}, Exception("server closed the connection")
+    )
+
+
+def test_create_engine():
+    engine = db.create_engine("postgresql://localhost/logsql_test")
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == settings.POOL_SIZE
+    assert engine.pool._pre_ping  # pylint: disable=protected-access
+
+    engine = db.create_engine("sqlite://", pool_size=2)
+    assert engine.dialect.name == "sqlite"
+
+
+def test_retry(mocker):
+    mocked_sleep = mocker.patch("time.sleep")
+    func = mocker.Mock(side_effect=[
+        _operational_error(), _operational_error(), _operational_error(), 42
+    ])
+    assert db.retry(func, 1, key=2, min_delay=1, max_delay=3) == 42
+    func.assert_called_with(1, key=2)
+    assert [call[0][0] for call in mocked_sleep.call_args_list] == [1, 2, 3]
+
+
+def test_retry_attempts(mocker):
+    mocker.patch("time.sleep")
+    func = mocker.Mock(side_effect=_operational_error())
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        db.retry(func, attempts=3)
+    assert func.call_count == 3
+
+
+def test_retry_invalidated(mocker):
+    mocker.patch("time.sleep")
+    error = sqlalchemy.exc.DBAPIError(
+        "SELECT 1", {}, Exception("gone"), connection_invalidated=True
+    )
+    func = mocker.Mock(side_effect=[error, 42])
+    assert db.retry(func) == 42
+
+
+def test_retry_statement_error(mocker):
+    mocked_sleep = mocker.patch("time.sleep")
+    func = mocker.Mock(side_effect=sqlalchemy.exc.IntegrityError(
+        "INSERT", {}, Exception("duplicate key")
+    ))
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        db.retry(func)
+    mocked_sleep.assert_not_called()
@@ -0,0 +1,163 @@
+import json
+import queue
+import shutil
+import threading
+
+import docker
+import pytest
+
+from logsql import discovery
+from logsql.registry import ContainerRegistry
+
+ZERO_TIME = "0001-01-01T00:00:00Z"
+
+
+def _config(directory, container_id, name="test", running=True,
+            started_at="2020-03-01T00:00:00Z", finished_at=ZERO_TIME):
+    path = directory / container_id
+    path.mkdir(exist_ok=True)
+    config = {
+        "ID": container_id,
+        "Name": "/" + name,
+        "LogPath": str(path / (container_id + "-json.log")),
+        "State": {
+            "Running": running,
+            "StartedAt": started_at,
+            "FinishedAt": finished_at,
+        },
+        "Config": {"Image": "python:3", "Labels": {"a": "b"}},
+    }
+    # docker replaces the config by renaming a temporary file
+    (path / ".tmp-config").write_text(json.dumps(config))
+    (path / ".tmp-config").rename(path / discovery.CONFIG)
+
+
+def test_directory_client(tmp_path):
+    _config(tmp_path, "AAA", "a")
+    _config(tmp_path, "BBB", "b", running=False)
+    _config(tmp_path, "CCC", "c", running=False, started_at=ZERO_TIME)
+    (tmp_path / "not-a-container").mkdir()
+    client = discovery.DirectoryClient(str(tmp_path))
+
+    info = client.api.inspect_container("AAA")
+    assert info["Id"] == "AAA"
+    assert info["Name"] == "/a"
+    assert info["LogPath"] == str(tmp_path / "AAA" / "AAA-json.log")
+    assert info["Config"]["Labels"] == {"a": "b"}
+    assert info["State"]["Status"] == "running"
+    assert client.api.inspect_container("BBB")["State"]["Status"] == "exited"
+    assert client.api.inspect_container("CCC")["State"]["Status"] == \
+        "created"
+    with pytest.raises(docker.errors.NotFound):
+        client.api.inspect_container("DDD")
+
+    assert [container["Id"] for container in client.api.containers()] == \
+        ["AAA"]
+    registry = ContainerRegistry(client)
+    added, removed = registry.reconcile()
+    assert added == [("AAA", "a"), ("BBB", "b"), ("CCC", "c")]
+    assert removed == []
+    assert registry.get("BBB")["Name"] == "/b"
+
+
+def test_directory_client_cache(tmp_path, mocker):
+    _config(tmp_path, "AAA", "a")
+    client = discovery.DirectoryClient(str(tmp_path))
+    spy = mocker.spy(discovery.json, "loads")
+    client.api.read("AAA")
+    client.api.read("AAA")
+    assert spy.call_count == 1
+
+    shutil.rmtree(str(tmp_path / "AAA"))
+    assert client.api.read("AAA") is None
+    assert client.api.cache == {}
+
+
+def test_changes():
+    running = ("a", True, "2020-03-01T00:00:00Z", ZERO_TIME)
+    stopped = ("a", False, running[2], "2020-03-01T00:01:00Z")
+    restarted = ("a", True, "2020-03-01T00:02:00Z", stopped[3])
+
+    def _actions(old, new):
+        return [
+            (event["Action"], event["id"])
+            for event in discovery.changes(old, new)
+        ]
+
+    assert _actions({}, {"A": running}) == [("create", "A"), ("start", "A")]
+    assert _actions({}, {"A": stopped}) == [("create", "A")]
+    assert _actions({"A": running}, {"A": running}) == []
+    assert _actions({"A": running}, {"A": stopped}) == [("die", "A")]
+    assert _actions({"A": stopped}, {"A": restarted}) == [("start", "A")]
+    assert _actions({"A": running}, {"A": restarted}) == \
+        [("die", "A"), ("start", "A")]
+    assert _actions({"A": running}, {"A": ("b",) + running[1:]}) == \
+        [("rename", "A")]
+    assert _actions({"A": running}, {}) == [("die", "A"), ("destroy", "A")]
+
+    event = discovery.changes({"A": running}, {"A": stopped})[0]
+    assert event["time"] == 1583020860.0
+    assert event["Actor"]["Attributes"]["name"] == "a"
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_directory_client_events(tmp_path, mocker, inotify):
+    if not inotify:
+        mocker.patch.object(discovery, "Inotify", side_effect=OSError)
+    _config(tmp_path, "AAA", "a")
+    client = discovery.DirectoryClient(str(tmp_path), interval=0.05)
+
+    events = queue.Queue()
+    started = threading.Event()
+
+    def _listen():
+        states = client.api.states
+
+        def _states(*args):
+            # the stream starts from the state of its first scan
+            result = states(*args)
+            started.set()
+            return result
+
+        mocker.patch.object(client.api, "states", side_effect=_states)
+        for event in client.events(decode=True):
+            events.put((event["Action"], event["id"]))
+
+    thread = threading.Thread(target=_listen)
+    thread.daemon = True
+    thread.start()
+    try:
+        assert started.wait(5)
+
+        def _next():
+            return events.get(timeout=5)
+
+        _config(tmp_path, "BBB", "b")
+        assert _next() == ("create", "BBB")
+        assert _next() == ("start", "BBB")
+
+        _config(tmp_path, "AAA", "a", running=False,
+                finished_at="2020-03-01T00:01:00Z")
+        assert _next() == ("die", "AAA")
+
+        shutil.rmtree(str(tmp_path / "BBB"))
+        assert _next() == ("die", "BBB")
+        assert _next() == ("destroy", "BBB")
+        assert events.empty()
+    finally:
+        client.close()
+        thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_create_client(mocker):
+    from_env = mocker.patch.object(discovery.docker, "from_env")
+    assert discovery.create_client("docker") is from_env.return_value
+
+    mocker.patch.object(discovery.settings, "CONTAINERS_DIR", "/tmp/x")
+    client = discovery.create_client("directory")
+    assert isinstance(client, discovery.DirectoryClient)
+    assert client.directory == "/tmp/x"
+
+    with pytest.raises(ValueError):
+        discovery.create_client("kubernetes")
@@ -0,0 +1,239 @@
+import json
+import time
+import threading
+
+import pytest
+import sqlalchemy
+
+from logsql import client, models, settings
+from logsql.checkpoint import DatabaseCheckpointStore
+from logsql.engine import Engine
+from logsql.lag import Lag
+from logsql.offsetfile import OffsetFile
+from logsql.spool import Spool
+
+from . import utils
+
+PATH = "/tmp/test.log"
+
+
+def _write_lines(*lines, path=PATH):
+    with open(path, "a") as filp:
+        for line in lines:
+            print(json.dumps({"log": line + "\n", "stream": "stderr"}),
+                  file=filp)
+
+
+def _wait_for_logs(session, count):
+    for _ in range(100):
+        logs = session.query(models.Log).all()
+        if len(logs) >= count:
+            return logs
+        session.rollback()
+        time.sleep(.05)
+    return session.query(models.Log).all()
+
+
+@pytest.mark.parametrize("watch", [False, True])
+def test_engine(session, watch):
+    utils.cleanup(PATH)
+    _write_lines("line1", "line2")
+
+    engine = Engine(
+        sqlalchemy.create_engine(settings.DATABASE_URL),
+        interval=.05 if not watch else 5,
+        watch=watch,
+    )
+    engine.start()
+    try:
+        tailer = engine.add_container(
+            "XXX", {"Name": "/test", "LogPath": PATH}
+        )
+        logs = _wait_for_logs(session, 2)
+        assert tailer.poll() is None
+
+        _write_lines("line3")
+        logs = _wait_for_logs(session, 3)
+        assert engine.lag() == {"XXX": Lag()}
+    finally:
+        engine.stop()
+
+    assert [log.json["log"] for log in logs] == [
+        "line1\n", "line2\n", "line3\n"
+    ]
+    assert logs[0].container_id == "XXX"
+    assert logs[0].container_name == "/test"
+
+    offsetfile = OffsetFile.read(PATH)
+    with open(PATH, "rb") as filp:
+        assert offsetfile.offset == len(filp.read())
+
+
+def test_engine_watch_shared(session):
+    other = PATH + ".other"
+    utils.cleanup(PATH)
+    utils.cleanup(other)
+    _write_lines("line1")
+    _write_lines("other1", path=other)
+
+    engine = Engine(
+        sqlalchemy.create_engine(settings.DATABASE_URL),
+        interval=5,
+        watch=True,
+    )
+    engine.start()
+    try:
+        engine.add_container("XXX", {"Name": "/test", "LogPath": PATH})
+        engine.add_container("YYY", {"Name": "/other", "LogPath": other})
+        _wait_for_logs(session, 2)
+
+        # both tailers wait on the same inotify instance
+        _write_lines("other2", path=other)
+        _write_lines("line2")
+        logs = _wait_for_logs(session, 4)
+        assert len(engine.readers) == 1
+    finally:
+        engine.stop()
+        utils.cleanup(other)
+
+    assert sorted(log.json["log"] for log in logs) == [
+        "line1\n", "line2\n", "other1\n", "other2\n"
+    ]
+
+
+def test_engine_stop_writing(session, mocker):
+    utils.cleanup(PATH)
+    _write_lines("line1", "line2")
+
+    engine = Engine(
+        sqlalchemy.create_engine(settings.DATABASE_URL), interval=.05
+    )
+    writing = threading.Event()
+    write = engine._write
+
+    def _write(items):
+        writing.set()
+        time.sleep(.2)
+        write(items)
+
+    mocker.patch.object(engine, "_write", side_effect=_write)
+    engine.start()
+    try:
+        engine.add_container("XXX", {"Name": "/test", "LogPath": PATH})
+        assert writing.wait(5)
+    finally:
+        engine.stop()
+
+    # the batch was finished and its checkpoint saved
+    assert len(session.query(models.Log).all()) == 2
+    with open(PATH, "rb") as filp:
+        assert OffsetFile.read(PATH).offset == len(filp.read())
+
+
+def test_engine_slow_read(session, mocker):
+    other = PATH + ".other"
+    utils.cleanup(PATH)
+    utils.cleanup(other)
+    _write_lines("line1")
+    _write_lines("other1", path=other)
+
+    engine = Engine(
+        sqlalchemy.create_engine(settings.DATABASE_URL), interval=.05
+    )
+    release = threading.Event()
+    threads = set()
+    read_batch = client.read_batch
+
+    def _read_batch(log_path, *args):
+        threads.add(threading.current_thread())
+        if log_path.path == PATH:
+            # a slow disk
+            release.wait(5)
+        return read_batch(log_path, *args)
+
+    mocker.patch.object(client, "read_batch", side_effect=_read_batch)
+    engine.start()
+    try:
+        engine.add_container("XXX", {"Name": "/test", "LogPath": PATH})
+        engine.add_container("YYY", {"Name": "/other", "LogPath": other})
+        logs = _wait_for_logs(session, 1)
+        # the other tailer and the writer went on
+        assert [log.json["log"] for log in logs] == ["other1\n"]
+        release.set()
+        _wait_for_logs(session, 2)
+    finally:
+        release.set()
+        engine.stop()
+        utils.cleanup(other)
+    assert engine.thread not in threads
+
+
+def test_engine_missing_file(session):
+    utils.cleanup(PATH)
+    engine = Engine(sqlalchemy.create_engine(settings.DATABASE_URL))
+    engine.start()
+    try:
+        tailer = engine.add_container(
+            "XXX", {"Name": "/test", "LogPath": PATH}
+        )
+        for _ in range(100):
+            if tailer.poll() is not None:
+                break
+            time.sleep(.01)
+    finally:
+        engine.stop()
+    assert tailer.poll() == 1
+
+
+def test_engine_terminate(session):
+    utils.cleanup(PATH)
+    _write_lines("line1")
+
+    engine = Engine(sqlalchemy.create_engine(settings.DATABASE_URL))
+    engine.start()
+    try:
+        tailer = engine.add_container(
+            "XXX", {"Name": "/test", "LogPath": PATH}
+        )
+        _wait_for_logs(session, 1)
+        tailer.terminate()
+        for _ in range(100):
+            if tailer.poll() is not None:
+                break
+            time.sleep(.01)
+    finally:
+        engine.stop()
+    assert tailer.poll() == -1
+    assert "XXX" not in engine.tailers
+
+
+def test_engine_spool_transactional(tmp_path):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    with pytest.raises(ValueError):
+        Engine(
+            engine,
+            checkpoints=DatabaseCheckpointStore(engine),
+            spool=Spool(str(tmp_path / "spool")),
+        )
+
+
+def test_engine_spool(session, tmp_path):
+    utils.cleanup(PATH)
+    _write_lines("line1", "line2")
+
+    engine = Engine(
+        sqlalchemy.create_engine(settings.DATABASE_URL),
+        interval=.05,
+        spool=Spool(str(tmp_path / "spool")),
+    )
+    engine.start()
+    try:
+        engine.add_container("XXX", {"Name": "/test", "LogPath": PATH})
+        logs = _wait_for_logs(session, 2)
+    finally:
+        engine.stop()
+
+    assert [log.json["log"] for log in logs] == ["line1\n", "line2\n"]
+    assert engine.spool.stats()["drained_lines"] == 2
+    with open(PATH, "rb") as filp:
+        assert OffsetFile.read(PATH).offset == len(filp.read())
@@ -0,0 +1,106 @@
+import io
+import json
+
+from addict import Dict
+
+from logsql import lag
+from logsql.lag import Lag
+from logsql.logpath import LogPath
+
+from .utils import cleanup
+
+PATH = "/tmp/test.log"
+
+
+def _line(second):
+    return json.dumps({
+        "log": "line{}\n".format(second),
+        "stream": "stdout",
+        "time": "2020-03-01T12:00:{:02d}.123456789Z".format(second),
+    })
+
+
+def _write(*seconds):
+    with open(PATH, "a") as filp:
+        for second in seconds:
+            print(_line(second), file=filp)
+
+
+def test_line_time():
+    assert lag.line_time(_line(5)).second == 5
+    assert lag.line_time(_line(5).encode()).second == 5
+    assert lag.line_time(memoryview(_line(5).encode())).second == 5
+    assert lag.line_time('{"log": "x"}') is None
+    assert lag.line_time(b"") is None
+
+
+def test_log_path_lag():
+    cleanup(PATH)
+    _write(0, 1, 2, 3)
+
+    log_path = LogPath(PATH)
+    size = log_path.lag().bytes
+    assert size == len("".join(_line(s) + "\n" for s in range(4)))
+    # nothing read yet, behind since the first line
+    assert log_path.lag().seconds == 3.0
+
+    log_path.readlines(max_lines=1, raw=True)
+    assert log_path.lag() == Lag(size - len(_line(0)) - 1, 3.0)
+
+    log_path.readlines(raw=True)
+    assert log_path.lag() == Lag()
+    log_path.commit()
+    log_path.close()
+
+    log_path = LogPath(PATH)
+    _write(10)
+    # the last line read before is found in the file
+    assert log_path.lag().seconds == 7.0
+    log_path.close()
+
+
+def test_measure_path():
+    cleanup(PATH)
+    _write(0, 4)
+    first = len(_line(0)) + 1
+    inode = lag.os.stat(PATH).st_ino
+    assert lag.measure_path(PATH, first, inode).seconds == 4.0
+    # rotated: all of the new file is behind
+    assert lag.measure_path(PATH, first, -1).bytes == first * 2
+
+    # and the rest of the rotated file the checkpoint is in
+    lag.os.rename(PATH, PATH + ".1")
+    _write(9)
+    try:
+        assert lag.measure_path(PATH, first, inode) == \
+            Lag(first + len(_line(9)) + 1, 9.0)
+    finally:
+        cleanup(PATH + ".1")
+
+
+def test_scheduling():
+    assert lag.batch_size(100, Lag()) == 100
+    assert lag.batch_size(100, Lag(lag.LAG_STEP)) == 200
+    assert lag.batch_size(100, Lag(100 * lag.LAG_STEP)) == \
+        100 * lag.MAX_BATCH_FACTOR
+    assert [lag.idle_interval(1.0, idle) for idle in range(5)] == \
+        [1, 2, 4, 8, 8]
+
+
+def test_main(mocker):
+    cleanup(PATH)
+    _write(0, 2)
+    client = mocker.patch.object(lag.discovery, "create_client").return_value
+    client.api.containers.return_value = [{"Id": "XXX"}, {"Id": "YYY"}]
+    client.api.inspect_container.side_effect = lambda container_id: {
+        "XXX": {"Id": "XXX", "Name": "/test", "LogPath": PATH},
+        "YYY": {"Id": "YYY", "Name": "/gone", "LogPath": PATH + ".gone"},
+    }[container_id]
+    mocker.patch.object(lag.db, "create_engine")
+
+    out = io.StringIO()
+    assert lag.main(Dict(json=True), out) == 0
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [{
+        "container_id": "XXX", "name": "/test",
+        "bytes": (len(_line(0)) + 1) * 2, "seconds": 2.0,
+    }]
@@ -1,5 +1,8 @@
 import os
 
+import pytest
+
+from logsql import logpath as logpath_module
 from logsql.offsetfile import OffsetFile
 from logsql.logpath import LogPath
 
@@ -112,3 +115,241 @@ def test_logpath_last_chunk():
 
     logpath.commit()
     assert logpath.offsetfile.offset == 12
+
+
+def test_logpath_readlines():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        for i in range(10):
+            print("line" + str(i), file=filp)
+        filp.write("partial")
+
+    logpath = LogPath(PATH, read_size=16)
+    assert logpath.readlines(max_lines=3) == ["line0", "line1", "line2"]
+    assert logpath.offsetfile.offset == 18
+    assert logpath.readlines(max_bytes=10) == ["line3", "line4"]
+    assert logpath.readlines(raw=True) == [
+        b"line" + str(i).encode() for i in range(5, 10)
+    ]
+    assert logpath.readlines() == []
+    assert logpath.offsetfile.offset == 60
+    assert logpath.count == 10
+    assert len(logpath.buffer) == 16
+
+    with open(PATH, "a") as filp:
+        print(" line", file=filp)
+    assert logpath.readlines() == ["partial line"]
+    assert logpath.offsetfile.offset == 73
+
+
+def test_logpath_long_line():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("X" * 100, file=filp)
+        print("short", file=filp)
+
+    logpath = LogPath(PATH, read_size=16)
+    assert logpath.readline() == "X" * 100
+    assert logpath.readline() == "short"
+    assert logpath.readline() is None
+    assert len(logpath.buffer) == 16
+    assert logpath.offsetfile.offset == 107
+
+
+def test_logpath_removed():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    logpath = LogPath(PATH)
+    os.remove(PATH)
+    assert logpath.readlines() == ["line1"]
+    with pytest.raises(FileNotFoundError):
+        logpath.readlines()
+
+
+def test_logpath_catchup():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("skipped", file=filp)
+        for i in range(5):
+            print("line" + str(i), file=filp)
+        print("  ", file=filp)
+        print(" padded ", file=filp)
+        filp.write("partial")
+
+    offsetfile = OffsetFile(PATH)
+    offsetfile.inode = os.stat(PATH).st_ino
+    offsetfile.offset = 8
+    offsetfile.save()
+
+    logpath = LogPath(PATH, catchup_size=16)
+    assert logpath.mapping is not None
+    assert logpath.readlines(max_lines=2) == ["line0", "line1"]
+    assert logpath.offsetfile.offset == 20
+
+    raw = logpath.readlines(max_bytes=6, raw=True)
+    assert isinstance(raw[0], memoryview)
+    assert [bytes(line) for line in raw] == [b"line2"]
+
+    assert logpath.readlines() == ["line3", "line4", "padded"]
+    assert logpath.mapping is None
+    assert logpath.offsetfile.offset == 50
+
+    with open(PATH, "a") as filp:
+        print("", file=filp)
+    assert logpath.readlines() == ["partial"]
+    assert logpath.offsetfile.offset == 58
+    logpath.close()
+
+
+def test_logpath_catchup_small_backlog():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    logpath = LogPath(PATH, catchup_size=1024)
+    assert logpath.mapping is None
+    assert logpath.readlines() == ["line1"]
+    logpath.close()
+
+
+ROTATED_PATH = "/tmp/test-rotated.log"
+
+
+def _cleanup_rotated():
+    utils.cleanup(ROTATED_PATH)
+    for index in range(1, 4):
+        utils.cleanup("{}.{}".format(ROTATED_PATH, index))
+
+
+def _write(*lines):
+    with open(ROTATED_PATH, "a") as filp:
+        for line in lines:
+            print(line, file=filp)
+
+
+def _rotate():
+    """ Like docker's json-file driver with max-file 3 """
+    for index in (2, 1):
+        source = "{}.{}".format(ROTATED_PATH, index)
+        if os.path.exists(source):
+            os.rename(source, "{}.{}".format(ROTATED_PATH, index + 1))
+    os.rename(ROTATED_PATH, ROTATED_PATH + ".1")
+
+
+def test_logpath_resume_rotated():
+    _cleanup_rotated()
+    _write("line1", "line2")
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.readline() == "line1"
+    logpath.commit()
+    logpath.close()
+
+    # rotated twice while nobody was reading
+    _write("line3")
+    _rotate()
+    _write("line4")
+    _rotate()
+    _write("line5")
+
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.following
+    assert logpath.offsetfile.offset == 6
+    assert logpath.lag().bytes == 24
+    assert logpath.readlines() == ["line2", "line3", "line4", "line5"]
+    assert not logpath.following
+    assert logpath.offsetfile.inode == os.stat(ROTATED_PATH).st_ino
+    assert logpath.offsetfile.offset == 6
+    logpath.close()
+    _cleanup_rotated()
+
+
+def test_logpath_rotated_past_checkpoint():
+    _cleanup_rotated()
+    _write("line1", "line2")
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.readline() == "line1"
+    logpath.commit()
+    logpath.close()
+
+    _rotate()
+    _write("line3")
+    _rotate()
+    _write("line4")
+    os.remove(ROTATED_PATH + ".2")
+
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.offsetfile.offset == 0
+    assert logpath.readlines() == ["line3", "line4"]
+    logpath.close()
+    _cleanup_rotated()
+
+
+def test_logpath_follow_rotations():
+    _cleanup_rotated()
+    _write("line1")
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.readlines() == ["line1"]
+
+    # more than one rotation between two reads
+    _write("line2")
+    _rotate()
+    _write("line3")
+    _rotate()
+    _write("line4")
+
+    assert logpath.readlines(max_lines=2) == ["line2", "line3"]
+    assert logpath.following
+    assert logpath.readlines() == ["line4"]
+    assert not logpath.following
+    logpath.close()
+    _cleanup_rotated()
+
+
+def test_logpath_rotation_uncommitted():
+    _cleanup_rotated()
+    _write("line1")
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.readlines() == ["line1"]
+    logpath.commit()
+
+    _write("line2")
+    _rotate()
+    _write("line3")
+    assert logpath.readlines() == ["line2", "line3"]
+    # crashed before the batch was committed
+    logpath.close()
+
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.readlines() == ["line2", "line3"]
+    logpath.close()
+    _cleanup_rotated()
+
+
+def test_logpath_rotation_late_write(mocker):
+    _cleanup_rotated()
+    _write("line1")
+    logpath = LogPath(ROTATED_PATH)
+    assert logpath.readlines() == ["line1"]
+
+    _write("line2")
+    _rotate()
+    _write("line4")
+    inode_number = logpath_module.utils.inode_number
+    late = ["line3"]
+
+    def _inode_number(path):
+        # written to the rotated file between our EOF and the stat
+        with open(ROTATED_PATH + ".1", "a") as filp:
+            for line in late:
+                print(line, file=filp)
+        late.clear()
+        return inode_number(path)
+
+    mocker.patch.object(
+        logpath_module.utils, "inode_number", side_effect=_inode_number
+    )
+    assert logpath.readlines() == ["line2", "line3", "line4"]
+    logpath.close()
+    _cleanup_rotated()
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import socket
+import threading
+import urllib.request
+
+from addict import Dict
+
+from logsql import __main__, metrics
+from logsql.metrics import Collector, Counter, Gauge, Histogram, Registry
+
+
+def _registry():
+    registry = Registry()
+    lines = registry.register(Counter("lines_total", "Lines", ["container"]))
+    clients = registry.register(Gauge("clients", "Clients"))
+    seconds = registry.register(
+        Histogram("seconds", "Seconds", buckets=(.1, 1))
+    )
+    return registry, lines, clients, seconds
+
+
+def test_render():
+    registry, lines, clients, seconds = _registry()
+    lines.inc(3, "/web")
+    lines.inc(2, '/a"b')
+    clients.set_function(lambda: 4)
+    seconds.observe(.05)
+    seconds.observe(.5)
+    seconds.observe(5)
+
+    assert metrics.render(registry.snapshot()).splitlines() == [
+        "# HELP clients Clients",
+        "# TYPE clients gauge",
+        "clients 4",
+        "# HELP lines_total Lines",
+        "# TYPE lines_total counter",
+        'lines_total{container="/a\\"b"} 2',
+        'lines_total{container="/web"} 3',
+        "# HELP seconds Seconds",
+        "# TYPE seconds histogram",
+        'seconds_bucket{le="0.1"} 1',
+        'seconds_bucket{le="1"} 2',
+        'seconds_bucket{le="+Inf"} 3',
+        "seconds_sum 5.55",
+        "seconds_count 3",
+    ]
+
+
+def test_collector(tmp_path, mocker):
+    registry, lines, clients, seconds = _registry()
+    lines.inc(1, "/web")
+    seconds.observe(.05)
+    clients.set(1)
+
+    child, child_lines, child_clients, child_seconds = _registry()
+    child_lines.inc(2, "/web")
+    child_lines.inc(5, "/db")
+    child_seconds.observe(.5)
+    child_clients.set(2)
+    metrics.write_snapshot(str(tmp_path), child)
+    assert os.listdir(str(tmp_path)) == ["{}.json".format(os.getpid())]
+
+    collector = Collector(str(tmp_path), registry)
+    result = collector.collect()
+    assert sorted(result["lines_total"]["values"]) == [
+        [["/db"], 5], [["/web"], 3]
+    ]
+    assert result["clients"]["values"] == [[[], 3]]
+    assert result["seconds"]["values"] == [[[], [1, 1, 0, 0.55]]]
+
+    # counters of exited children are kept, their gauges dropped
+    mocker.patch.object(metrics, "_pid_alive", return_value=False)
+    for _ in range(2):
+        result = collector.collect()
+        assert sorted(result["lines_total"]["values"]) == [
+            [["/db"], 5], [["/web"], 3]
+        ]
+        assert result["clients"]["values"] == [[[], 1]]
+    assert os.listdir(str(tmp_path)) == []
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_serve(tmp_path, mocker):
+    mocker.patch.dict(os.environ)
+    mocker.patch.object(metrics.settings, "METRICS_DIR", "")
+    mocker.patch.object(metrics.LINES_READ, "values", {("/served",): 7})
+    assert metrics.serve(port=0) is None
+
+    port = _free_port()
+    server = metrics.serve(port=port, directory=str(tmp_path))
+    try:
+        with urllib.request.urlopen(
+                "http://127.0.0.1:{}/metrics".format(port)
+        ) as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'logsql_lines_read_total{container="/served"} 7' in body
+    assert os.environ["LOGSQL_METRICS_DIR"] == str(tmp_path)
+
+
+def test_main_pool_metrics(tmp_path, mocker, session):
+    """ The monitor sets up the metrics before starting the pool, so that
+    the workers' metrics are in the scrape
+    """
+    container_id = "c" * 64
+    directory = tmp_path / container_id
+    directory.mkdir()
+    log_path = directory / (container_id + "-json.log")
+    log_path.write_text(json.dumps({"log": "line1\n"}) + "\n")
+    (directory / "config.v2.json").write_text(json.dumps({
+        "ID": container_id,
+        "Name": "/test",
+        "LogPath": str(log_path),
+        "State": {"Running": True},
+    }))
+
+    port = _free_port()
+    mocker.patch.dict(os.environ, {"LOGSQL_METRICS_INTERVAL": "0.1"})
+    mocker.patch.object(__main__.settings, "DISCOVERY", "directory")
+    mocker.patch.object(__main__.settings, "CONTAINERS_DIR", str(tmp_path))
+    mocker.patch.object(metrics.settings, "METRICS_PORT", port)
+    mocker.patch.object(metrics.settings, "METRICS_DIR", "")
+
+    sleep = time.sleep
+    bodies = []
+
+    def _scrape(interval):
+        if threading.current_thread() is not threading.main_thread():
+            sleep(interval)
+            return
+        line = 'logsql_lines_read_total{container="/test"} 1'
+        for _ in range(300):
+            with urllib.request.urlopen(
+                    "http://127.0.0.1:{}/metrics".format(port)
+            ) as response:
+                bodies.append(response.read().decode("utf-8"))
+            if line in bodies[-1]:
+                break
+            sleep(.1)
+        raise SystemExit()
+
+    mocker.patch.object(__main__.time, "sleep", side_effect=_scrape)
+    assert __main__.main(Dict(engine="pool", workers=1, interval=60)) == \
+        128 + __main__.signal.SIGTERM
+    assert 'logsql_lines_read_total{container="/test"} 1' in bodies[-1]
@@ -0,0 +1,88 @@
+import json
+
+import sqlalchemy
+
+from logsql import migrations, models, settings
+
+
+def _legacy_logs(engine):
+    """ The logs table before the typed columns and containers table """
+    with engine.begin() as connection:
+        connection.execute("DROP VIEW logs")
+        connection.execute(
+            "CREATE TABLE logs (id INTEGER PRIMARY KEY, "
+            "container_id VARCHAR(64) NOT NULL, "
+            "container_name VARCHAR(128) NOT NULL, "
+            "json JSON NOT NULL, created_at DATETIME NOT NULL)"
+        )
+        for i in range(5):
+            connection.execute(
+                "INSERT INTO logs (container_id, container_name, json, "
+                "created_at) VALUES (?, ?, ?, '2020-01-01 00:00:00')",
+                "XXX" if i % 2 else "YYY",
+                "/x" if i % 2 else "/y",
+                json.dumps({
+                    "log": "line{}\n".format(i),
+                    "stream": "stdout",
+                    "time": "2020-03-01T13:45:1{}.5Z".format(i),
+                }) if i != 3 else json.dumps({"other": True})
+            )
+
+
+def test_migrate(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    _legacy_logs(engine)
+
+    migrations.migrate(engine)
+    inspector = sqlalchemy.inspect(engine)
+    assert "logs" in inspector.get_view_names()
+    assert migrations.LEGACY_TABLE in inspector.get_table_names()
+
+    assert migrations.move_legacy(engine, batch_size=2) == 5
+    assert migrations.LEGACY_TABLE not in \
+        sqlalchemy.inspect(engine).get_table_names()
+    assert migrations.backfill(engine, batch_size=2) == 4
+
+    logs = session.query(models.Log).order_by(models.Log.id).all()
+    assert [log.message for log in logs] == [
+        "line0", "line1", "line2", None, "line4"
+    ]
+    assert [log.container_id for log in logs] == [
+        "YYY", "XXX", "YYY", "XXX", "YYY"
+    ]
+    assert logs[4].stream == "stdout"
+    assert logs[4].event_time.second == 14
+    assert migrations.backfill(engine) == 0
+
+    # existing queries keep working against the view
+    with engine.connect() as connection:
+        rows = connection.execute(
+            "SELECT container_id, container_name, message FROM logs "
+            "WHERE container_name = '/x' ORDER BY id"
+        ).fetchall()
+    assert [tuple(row) for row in rows] == [
+        ("XXX", "/x", "line1"), ("XXX", "/x", None)
+    ]
+
+    migrations.migrate(engine)
+    assert migrations.move_legacy(engine) == 0
+
+
+def test_upgrade(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    with engine.begin() as connection:
+        connection.execute("DROP VIEW logs")
+        connection.execute("DROP TABLE log_entries")
+        connection.execute(
+            "CREATE TABLE log_entries (id INTEGER PRIMARY KEY, "
+            "container_key INTEGER NOT NULL, "
+            "json JSON NOT NULL, created_at DATETIME NOT NULL)"
+        )
+
+    assert migrations.upgrade(engine) == [
+        "event_time", "stream", "message",
+        "ix_log_entries_container_key_event_time",
+        "ix_log_entries_created_at_id",
+        "ix_log_entries_event_time",
+    ]
+    assert migrations.upgrade(engine) == []
@@ -0,0 +1,75 @@
+import io
+import json
+
+import sqlalchemy
+from addict import Dict
+
+from logsql import notify, settings
+from logsql.notify import Notification, Subscriber
+from logsql.sink import CopySink, InsertSink
+
+
+def test_notification():
+    notification = Notification("XXX", 3, 10, 19, 10)
+    payload = notification.encode()
+    assert len(payload) < 100
+    decoded = Notification.decode(payload)
+    assert (decoded.container_id, decoded.key) == ("XXX", 3)
+    assert (decoded.first, decoded.last, decoded.count) == (10, 19, 10)
+
+
+def test_copy_sink_notify(mocker):
+    copied = io.StringIO()
+
+    def _copy_expert(sql, buf):
+        assert sql.startswith("COPY log_entries (id, container_key")
+        copied.write(buf.read())
+
+    connection = mocker.MagicMock()
+    cursor = connection.connection.cursor.return_value
+    cursor.copy_expert.side_effect = _copy_expert
+    cursor.fetchone.return_value = ("log_entries_id_seq",)
+    cursor.fetchall.return_value = [(41,), (42,)]
+
+    sink = CopySink(channel="logs")
+    sink.keys["XXX"] = 7
+    sink.write(connection, "XXX", "/test", ['{"log": "1"}', '{"log": "2"}'])
+
+    rows = copied.getvalue().splitlines()
+    assert [row.split("\t")[:2] for row in rows] == [["41", "7"], ["42", "7"]]
+    cursor.execute.assert_any_call(
+        CopySink.IDS_SQL, ("log_entries_id_seq", 2)
+    )
+    sql, (channel, payload) = cursor.execute.call_args[0]
+    assert "pg_notify" in sql
+    assert channel == "logs"
+    assert json.loads(payload) == {
+        "container_id": "XXX", "key": 7, "first": 41, "last": 42, "count": 2
+    }
+
+
+def test_subscriber(session, mocker):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    with engine.begin() as connection:
+        sink = InsertSink()
+        sink.write(connection, "XXX", "/test", ['{"log": "1"}'])
+        sink.write(connection, "YYY", "/other", ['{"log": "2"}'])
+        sink.write(connection, "XXX", "/test", ['{"log": "3"}'])
+
+    dbapi_connection = mocker.Mock(notifies=[])
+
+    def _select(*_):
+        dbapi_connection.notifies.extend([
+            Dict(payload=Notification("XXX", 1, 1, 3, 2).encode()),
+            Dict(payload="garbage"),
+        ])
+
+    mocker.patch.object(notify.select, "select", side_effect=_select)
+    subscriber = Subscriber(engine, channel="logs")
+    subscriber.connection = mocker.Mock(connection=dbapi_connection)
+
+    notifications = subscriber.notifications(1.0)
+    assert len(notifications) == 1
+    rows = subscriber.fetch(notifications[0])
+    assert [row.json["log"] for row in rows] == ["1", "3"]
+    assert not dbapi_connection.notifies
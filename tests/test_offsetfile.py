@@ -47,3 +47,16 @@ def test_offsetfile_bad_values():
     with pytest.raises(IOError) as ex:
         OffsetFile.read(PATH)
     assert "invalid literal" in str(ex.value)
+
+
+def test_offsetfile_atomic_save():
+    utils.cleanup(PATH)
+    offsetfile = OffsetFile(PATH, offset=1, inode=2)
+    offsetfile.save()
+    offsetfile.offset = 3
+    offsetfile.save()
+    assert OffsetFile.read(PATH).offset == 3
+    assert not os.path.exists(offsetfile.path + ".tmp")
+
+    assert OffsetFile.remove(PATH)
+    assert not OffsetFile.remove(PATH)
@@ -0,0 +1,80 @@
+import re
+
+import pytest
+
+from logsql import parsing
+
+# pylint: disable=line-too-long
+COMBINED = """1.1.1.1 - bob [17/Aug/2019:23:18:39 +0000] "GET /index.html HTTP/1.1" 200 612 "-" "curl/7.58.0\""""  # noqa
+
+EXPECTED = {
+    "remote_addr": "1.1.1.1",
+    "remote_user": "bob",
+    "time_local": "17/Aug/2019:23:18:39 +0000",
+    "request": "GET /index.html HTTP/1.1",
+    "status": 200,
+    "body_bytes_sent": 612,
+    "http_referer": "-",
+    "http_user_agent": "curl/7.58.0",
+}
+
+
+@pytest.mark.parametrize("spec, extra", [
+    ("nginx_combined", {}),
+    ("apache_combined", {"remote_logname": "-"}),
+])
+def test_combined(spec, extra):
+    parser = parsing.compile_format(spec)
+    expected = dict(EXPECTED, **extra)
+    assert parser.parse(COMBINED) == expected
+    assert parser.parse_many([COMBINED, "BAD LOG LINE"]) == [expected, None]
+
+
+def test_apache_common():
+    line = COMBINED.rsplit(" ", 2)[0].replace(" 612", " -")
+    result = parsing.compile_format("apache_common").parse(line)
+    assert result["status"] == 200
+    assert result["body_bytes_sent"] is None
+    assert result["time_local"] == "17/Aug/2019:23:18:39 +0000"
+
+
+def test_custom_nginx():
+    parser = parsing.compile_format(
+        "nginx:$remote_addr [$time_local] $request_time ${upstream_status}"
+        " $upstream_response_time"
+    )
+    assert parser.parse("10.0.0.1 [x] 0.250 502 0.1, 0.2") == {
+        "remote_addr": "10.0.0.1",
+        "time_local": "x",
+        "request_time": 0.25,
+        "upstream_status": 502,
+        "upstream_response_time": "0.1, 0.2",
+    }
+    assert parser is parsing.compile_format(
+        "nginx:$remote_addr [$time_local] $request_time ${upstream_status}"
+        " $upstream_response_time"
+    )
+
+
+def test_regex():
+    parser = parsing.compile_format(r"regex:(\w+) (?P<code__int>\d+)")
+    assert parser.parse_many(["x 42", "y"]) == [{"code": 42}, None]
+    with pytest.raises(ValueError):
+        parsing.RegexParser(re.compile(r"(?P<code__complex>\d+)"))
+
+
+def test_logfmt():
+    line = 'level=info msg="hello \\"world\\"" took=12 debug empty='
+    assert parsing.parse_many("logfmt", [line, ""]) == [{
+        "level": "info",
+        "msg": 'hello "world"',
+        "took": "12",
+        "debug": True,
+        "empty": "",
+    }, None]
+
+
+@pytest.mark.parametrize("spec", ["unknown", "nginx:", "apache:%{x}Z"])
+def test_invalid(spec):
+    with pytest.raises(ValueError):
+        parsing.compile_format(spec)
@@ -0,0 +1,105 @@
+import datetime
+
+import pytest
+
+from logsql import partitions
+from logsql.partitions import PartitionManager
+
+NOW = datetime.datetime(2020, 3, 1, 13, 45, 12)
+
+
+def _manager(mocker, existing=(), **kwargs):
+    engine = mocker.MagicMock()
+    connection = engine.begin.return_value.__enter__.return_value
+    manager = PartitionManager(engine, **kwargs)
+    mocker.patch.object(
+        manager, "partitions",
+        return_value={name: manager.parse(name) for name in existing}
+    )
+    return manager, connection
+
+
+def _statements(connection):
+    return [call[0][0] for call in connection.execute.call_args_list]
+
+
+def test_names():
+    daily = PartitionManager(None)
+    assert daily.start(NOW) == datetime.datetime(2020, 3, 1)
+    assert daily.name(daily.start(NOW)) == "log_entries_p20200301"
+    assert daily.parse("log_entries_p20200301") == \
+        datetime.datetime(2020, 3, 1)
+    assert daily.parse("logs_default") is None
+    assert daily.parse("other_p20200301") is None
+
+    hourly = PartitionManager(None, interval=partitions.HOUR)
+    assert hourly.name(hourly.start(NOW)) == "log_entries_p2020030113"
+
+    with pytest.raises(ValueError):
+        PartitionManager(None, interval="week")
+
+
+def test_create(mocker):
+    manager, connection = _manager(
+        mocker, existing=["log_entries_p20200301"], premake=2
+    )
+    assert manager.create(NOW) == [
+        "log_entries_p20200302", "log_entries_p20200303"
+    ]
+    assert _statements(connection) == [
+        "CREATE TABLE IF NOT EXISTS log_entries_p20200302 "
+        "PARTITION OF log_entries "
+        "FOR VALUES FROM ('2020-03-02T00:00:00') TO ('2020-03-03T00:00:00')",
+        "CREATE TABLE IF NOT EXISTS log_entries_p20200303 "
+        "PARTITION OF log_entries "
+        "FOR VALUES FROM ('2020-03-03T00:00:00') TO ('2020-03-04T00:00:00')",
+    ]
+
+
+@pytest.mark.parametrize("detach", [False, True])
+def test_expire(mocker, detach):
+    manager, connection = _manager(
+        mocker,
+        existing=[
+            "log_entries_p2020030110",
+            "log_entries_p2020030111",
+            "log_entries_p2020030112",
+        ],
+        interval=partitions.HOUR,
+        retention=datetime.timedelta(hours=2),
+        detach=detach,
+    )
+    # 11:45 is still within retention
+    assert manager.expire(NOW) == ["log_entries_p2020030110"]
+    if detach:
+        assert _statements(connection) == [
+            "ALTER TABLE log_entries "
+            "DETACH PARTITION log_entries_p2020030110"
+        ]
+    else:
+        assert _statements(connection) == ["DROP TABLE log_entries_p2020030110"]
+
+
+def test_expire_forever(mocker):
+    manager, connection = _manager(
+        mocker, existing=["log_entries_p20000101"]
+    )
+    assert manager.expire(NOW) == []
+    assert not connection.execute.called
+
+
+def test_manager_from_settings(mocker):
+    engine = mocker.Mock()
+    engine.dialect.name = "postgresql"
+    mocker.patch.object(partitions.settings, "PARTITION_INTERVAL", "")
+    assert partitions.manager_from_settings(engine) is None
+
+    mocker.patch.object(partitions.settings, "PARTITION_INTERVAL", "hour")
+    mocker.patch.object(partitions.settings, "RETENTION_HOURS", 48)
+    mocker.patch.object(PartitionManager, "is_partitioned", return_value=True)
+    manager = partitions.manager_from_settings(engine)
+    assert manager.interval == partitions.HOUR
+    assert manager.retention == datetime.timedelta(hours=48)
+
+    engine.dialect.name = "sqlite"
+    assert partitions.manager_from_settings(engine) is None
@@ -0,0 +1,170 @@
+import io
+import json
+import datetime
+import itertools
+
+import pytest
+import sqlalchemy
+
+from logsql import models, query, settings
+from logsql.sink import InsertSink
+
+
+def _write(engine, container_id, name, *lines):
+    with engine.begin() as connection:
+        InsertSink().write(connection, container_id, name, [
+            json.dumps(line) for line in lines
+        ])
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    _write(engine, "AAA111", "/web",
+           {"log": "1\n", "attrs": {"level": "info"}, "time": _time(1)},
+           {"log": "2\n", "attrs": {"level": "error"}, "time": _time(2)})
+    # written after 4 happened
+    _write(engine, "BBB222", "/db", {"log": "3\n", "time": _time(4)})
+    _write(engine, "AAA111", "/web", {"log": "4\n", "time": _time(3)})
+    return engine
+
+
+def _time(second):
+    return "2020-03-01T00:00:{:02d}.000000001Z".format(second)
+
+
+def _logs(rows):
+    return [row.json["log"] for row in rows]
+
+
+def test_parse_time():
+    now = datetime.datetime(2020, 3, 1, 12)
+    assert query.parse_time("90s", now) == \
+        datetime.datetime(2020, 3, 1, 11, 58, 30)
+    assert query.parse_time("2h", now) == datetime.datetime(2020, 3, 1, 10)
+    assert query.parse_time("2020-03-01T12:00:00+01:00") == \
+        datetime.datetime(2020, 3, 1, 11)
+    assert query.parse_time("2020-03-01") == datetime.datetime(2020, 3, 1)
+    with pytest.raises(Exception):
+        query.parse_time("yesterday")
+
+
+def test_parse_predicate():
+    assert query.parse_predicate("attrs.level=error") == \
+        (["attrs", "level"], "=", "error")
+    assert query.parse_predicate("stream!=stdout") == \
+        (["stream"], "!=", "stdout")
+    with pytest.raises(Exception):
+        query.parse_predicate("stream")
+
+
+def test_fetch_pages(engine):
+    rows = list(query.fetch(engine, query.build_select(), page_size=2))
+    assert _logs(rows) == ["1\n", "2\n", "4\n", "3\n"]
+    assert rows[0].container_name == "/web"
+
+    rows = list(query.fetch(
+        engine, query.build_select(), page_size=2, limit=3
+    ))
+    assert _logs(rows) == ["1\n", "2\n", "4\n"]
+
+    after = (rows[1].event_time, rows[1].id)
+    rows = query.fetch(engine, query.build_select(), after=after)
+    assert _logs(rows) == ["4\n", "3\n"]
+
+
+def test_fetch_no_event_time(engine):
+    _write(engine, "BBB222", "/db", {"log": "5\n"}, {"log": "6\n"})
+    rows = list(query.fetch(engine, query.build_select(), page_size=1))
+    assert _logs(rows) == ["5\n", "6\n", "1\n", "2\n", "4\n", "3\n"]
+
+    rows = query.fetch(
+        engine, query.build_select(), after=(None, rows[0].id), limit=2
+    )
+    assert _logs(rows) == ["6\n", "1\n"]
+
+
+def test_filters(engine):
+    def _query(**kwargs):
+        return _logs(query.fetch(engine, query.build_select(**kwargs)))
+
+    assert _query(containers=["AAA"]) == ["1\n", "2\n", "4\n"]
+    assert _query(containers=["db", "/web"]) == ["1\n", "2\n", "4\n", "3\n"]
+    assert _query(
+        predicates=[query.parse_predicate("attrs.level=error")]
+    ) == ["2\n"]
+    assert _query(
+        predicates=[query.parse_predicate("attrs.level!=error")]
+    ) == ["1\n", "4\n", "3\n"]
+
+    # on the time of the lines, not when they were written
+    moment = datetime.datetime(2020, 3, 1, 0, 0, 3)
+    assert _query(since=moment) == ["4\n", "3\n"]
+    assert _query(until=moment) == ["1\n", "2\n"]
+    assert _query(since=query.parse_time("2020-03-01T01:00:03+01:00")) == \
+        ["4\n", "3\n"]
+
+
+def test_follow(engine, mocker):
+    log = models.Log.__table__
+
+    def _sleep(_):
+        _write(engine, "BBB222", "/db", {"log": "5\n"})
+        # committed a long transaction after it was created
+        with engine.begin() as connection:
+            last = connection.execute(
+                sqlalchemy.select([sqlalchemy.func.max(log.c.id)])
+            ).scalar()
+            created_at = datetime.datetime.utcnow() - \
+                datetime.timedelta(seconds=10)
+            connection.execute(log.update().where(log.c.id == last).values(
+                created_at=created_at
+            ))
+
+    mocker.patch.object(query.time, "sleep", side_effect=_sleep)
+    rows = query.follow(engine, query.build_select(containers=["BBB"]))
+    # each row once, the late ones included
+    assert _logs(itertools.islice(rows, 3)) == ["3\n", "5\n", "5\n"]
+    rows.close()
+
+
+def test_since_prunes(engine):
+    since = datetime.datetime(2020, 3, 1)
+    select = query.build_select(since=since)
+    # the partitions are by created_at
+    assert "log_entries.created_at >=" in str(select)
+    assert _logs(query.fetch(engine, select)) == ["1\n", "2\n", "4\n", "3\n"]
+
+
+def test_follow_start(engine, mocker):
+    log = models.Log.__table__
+    with engine.begin() as connection:
+        connection.execute(log.update().values(
+            created_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        ))
+
+    def _sleep(_):
+        _write(engine, "BBB222", "/db", {"log": "5\n"})
+
+    mocker.patch.object(query.time, "sleep", side_effect=_sleep)
+    # without since, the rows of the last window only
+    rows = query.follow(engine, query.build_select(containers=["BBB"]))
+    assert _logs(itertools.islice(rows, 1)) == ["5\n"]
+    rows.close()
+
+    since = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+    rows = query.follow(
+        engine, query.build_select(containers=["BBB"]), since=since
+    )
+    assert _logs(itertools.islice(rows, 2)) == ["5\n", "3\n"]
+    rows.close()
+
+
+def test_main(engine):
+    out = io.StringIO()
+    args = query.parse_args(["--container", "web", "--limit", "2"])
+    assert query.main(args, out) == 0
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["json"]["log"] for line in lines] == ["1\n", "2\n"]
+    assert lines[0]["container_id"] == "AAA111"
+    assert lines[0]["created_at"]
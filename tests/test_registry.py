@@ -0,0 +1,99 @@
+import docker
+from addict import Dict
+
+from logsql.registry import ContainerRegistry
+
+
+def _container(container_id, name):
+    return Dict({"id": container_id, "attrs": {"Names": ["/" + name]}})
+
+
+def _event(action, container_id, name="test"):
+    return {
+        "Type": "container",
+        "Action": action,
+        "id": container_id,
+        "Actor": {"Attributes": {"name": name}},
+    }
+
+
+def _registry(mocker, containers):
+    docker_client = mocker.MagicMock()
+    docker_client.containers.list.return_value = containers
+
+    def _inspect(container_id):
+        return {"Name": "/name-" + container_id, "LogPath": "/tmp/x"}
+
+    inspect = mocker.Mock(side_effect=_inspect)
+    return ContainerRegistry(docker_client, inspect=inspect), inspect
+
+
+def test_registry_reconcile(mocker):
+    registry, inspect = _registry(
+        mocker, [_container("AAA", "a"), _container("BBB", "b")]
+    )
+    added, removed = registry.reconcile()
+    assert added == [("AAA", "a"), ("BBB", "b")]
+    assert removed == []
+    assert "AAA" in registry
+    assert len(registry) == 2
+    registry.docker_client.containers.list.assert_called_with(
+        all=True, sparse=True
+    )
+    inspect.assert_not_called()
+
+    assert registry.get("AAA")["LogPath"] == "/tmp/x"
+    assert registry.get("AAA")["LogPath"] == "/tmp/x"
+    inspect.assert_called_once_with("AAA")
+
+    registry.docker_client.containers.list.return_value = [
+        _container("BBB", "b"), _container("CCC", "c")
+    ]
+    added, removed = registry.reconcile()
+    assert added == [("CCC", "c")]
+    assert removed == ["AAA"]
+    assert registry.name("AAA") is None
+    assert inspect.call_count == 1
+
+
+def test_registry_events(mocker):
+    registry, inspect = _registry(mocker, [])
+
+    assert registry.handle_event({"Type": "network"}) is None
+
+    assert registry.handle_event(_event("create", "AAA", "a")) == "create"
+    assert registry.name("AAA") == "a"
+    inspect.assert_not_called()
+
+    assert registry.handle_event(_event("start", "AAA", "a")) == "start"
+    assert registry.name("AAA") == "name-AAA"
+    inspect.assert_called_once_with("AAA")
+
+    # cached until the container changes
+    registry.get("AAA")
+    assert inspect.call_count == 1
+    registry.handle_event(_event("die", "AAA", "a"))
+    registry.get("AAA")
+    assert inspect.call_count == 2
+
+    registry.handle_event(_event("destroy", "AAA", "a"))
+    assert "AAA" not in registry
+    assert registry.reconcile() == ([], [])
+
+
+def test_registry_start_removed(mocker):
+    registry, inspect = _registry(mocker, [])
+    inspect.side_effect = docker.errors.NotFound("gone")
+    registry.handle_event(_event("start", "AAA"))
+    assert "AAA" not in registry
+
+
+def test_registry_no_name(mocker):
+    registry, inspect = _registry(mocker, [_container("AAA", "a")])
+    registry.reconcile()
+    inspect.side_effect = None
+    inspect.return_value = {"LogPath": ""}
+    assert registry.get("AAA") == {"LogPath": ""}
+    assert registry.name("AAA") == "a"
+    assert registry.get("BBB") == {"LogPath": ""}
+    assert registry.name("BBB") == "BBB"
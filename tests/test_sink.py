@@ -0,0 +1,151 @@
+import io
+import json
+import datetime
+
+import sqlalchemy
+
+from logsql import models, settings
+from logsql.codec import get_codec
+from logsql.sink import CopySink, InsertSink, create_sink, envelope
+
+TIME = "2020-03-01T13:45:12.123456789Z"
+
+
+def test_insert_sink(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    sink = InsertSink()
+    with engine.begin() as connection:
+        sink.write(connection, "XXX", "/test", [
+            json.dumps({"log": "line1\n"}),
+            json.dumps({"log": "line2\n", "stream": "stdout", "time": TIME}),
+        ])
+        sink.write(connection, "XXX", "/test", [])
+
+    logs = session.query(models.Log).all()
+    assert [log.json for log in logs] == [
+        {"log": "line1\n"},
+        {"log": "line2\n", "stream": "stdout", "time": TIME},
+    ]
+    assert logs[0].created_at
+    assert logs[0].container_name == "/test"
+    assert logs[0].container_key == logs[1].container_key
+    assert sink.keys == {"XXX": logs[0].container_key}
+    assert (logs[0].event_time, logs[0].stream) == (None, None)
+    assert logs[1].message == "line2"
+    assert logs[1].stream == "stdout"
+    assert logs[1].event_time.replace(tzinfo=None) == \
+        datetime.datetime(2020, 3, 1, 13, 45, 12, 123456)
+
+
+def test_sink_begin_rollback(session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    sink = InsertSink()
+    try:
+        with sink.begin(engine) as connection:
+            sink.write(connection, "XXX", "/test", ["{}"])
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    # the container added by the rolled back transaction is gone
+    assert sink.keys == {}
+    assert session.query(models.Container).count() == 0
+
+
+def test_copy_sink(mocker):
+    copied = io.StringIO()
+
+    def _copy_expert(sql, buf):
+        assert sql.startswith("COPY log_entries ")
+        copied.write(buf.read())
+
+    connection = mocker.MagicMock()
+    cursor = connection.connection.cursor.return_value
+    cursor.copy_expert.side_effect = _copy_expert
+
+    sink = CopySink()
+    sink.keys["XXX"] = 7
+    sink.write(connection, "XXX", "/test", [
+        json.dumps({"log": "tab\there\n", "stream": "stderr", "time": TIME}),
+        json.dumps({"no": "envelope"}),
+    ])
+    sink.write(connection, "XXX", "/test", [])
+
+    rows = copied.getvalue().splitlines()
+    assert len(rows) == 2
+    container_key, created_at, payload, event_time, stream, message = \
+        rows[0].split("\t")
+    assert container_key == "7"
+    assert created_at
+    assert payload.startswith(r'{"log": "tab\\there\\n"')
+    assert (event_time, stream, message) == (TIME, "stderr", r"tab\there")
+    assert rows[1].split("\t")[-3:] == [r"\N", r"\N", r"\N"]
+    cursor.close.assert_called_once()
+
+
+def test_create_sink():
+    assert isinstance(
+        create_sink(sqlalchemy.create_engine("sqlite://")), InsertSink
+    )
+    assert isinstance(
+        create_sink(sqlalchemy.create_engine("postgresql://localhost/x")),
+        CopySink
+    )
+
+
+def test_envelope():
+    codec = get_codec()
+    assert envelope(codec, json.dumps({
+        "log": "line\n", "stream": "stdout", "time": TIME
+    })) == (TIME, "stdout", "line")
+    assert envelope(codec, json.dumps({
+        "log": 42, "stream": "other", "time": "yesterday"
+    })) == (None, None, None)
+    assert envelope(codec, "[1, 2]") == (None, None, None)
+    assert envelope(codec, "not json") == (None, None, None)
+
+
+def test_sink_nul(mocker, session):
+    payload = json.dumps({"log": "a\x00b\n", "stream": "stdout"})
+    assert "\\u0000" in payload
+
+    copied = io.StringIO()
+    connection = mocker.MagicMock()
+    connection.connection.cursor.return_value.copy_expert.side_effect = \
+        lambda sql, buf: copied.write(buf.read())
+    sink = CopySink()
+    sink.keys["XXX"] = 7
+    sink.write(connection, "XXX", "/test", [payload])
+    assert "\x00" not in copied.getvalue()
+    assert copied.getvalue().rstrip("\n").split("\t")[-1] == "a\ufffdb"
+
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    with engine.begin() as connection:
+        InsertSink().write(connection, "XXX", "/test", [payload])
+    log = session.query(models.Log).one()
+    assert log.message == "a\ufffdb"
+    assert log.json["log"] == "a\x00b\n"
+
+
+def test_envelope_docker_line():
+    codec = get_codec()
+    line = '{"log":"line\\n","stream":"stdout","time":"' + TIME + '"}'
+    assert envelope(codec, line) == (TIME, "stdout", "line")
+    line = '{"log":"a \\"b\\"\\n","stream":"stderr","attrs":{"x":"y"},' \
+        '"time":"' + TIME + '"}'
+    assert envelope(codec, line) == (TIME, "stderr", 'a "b"')
+    assert envelope(codec, '{"log":"\\x","stream":"stdout","time":""}') \
+        == (None, None, None)
+
+
+def test_sink_envelopes(mocker, session):
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    sink = InsertSink()
+    loads = mocker.spy(sink.codec, "loads")
+    with engine.begin() as connection:
+        sink.write(
+            connection, "XXX", "/test", [json.dumps({"log": "ignored"})],
+            [(TIME, "stdout", "given")]
+        )
+    loads.assert_not_called()
+    log = session.query(models.Log).one()
+    assert (log.stream, log.message) == ("stdout", "given")
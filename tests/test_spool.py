@@ -0,0 +1,144 @@
+import os
+
+import pytest
+import sqlalchemy
+
+from logsql import metrics, models, spool
+from logsql.sink import InsertSink
+from logsql.spool import Drainer, Spool
+
+from .conftest import ENGINE
+
+
+def _payloads(*lines):
+    return ['{{"log": "{}\\n", "stream": "stdout"}}'.format(line)
+            for line in lines]
+
+
+def test_append_read(tmp_path):
+    directory = str(tmp_path / "spool")
+    instance = Spool(directory, segment_size=1)
+    instance.append("XXX", "/test", _payloads("line1", "line2"))
+    instance.append("YYY", "/other", _payloads("line3"))
+    assert len(os.listdir(directory)) == 2
+
+    paths = instance.segments()
+    assert [list(Spool.read(path)) for path in paths] == [
+        [("XXX", "/test", _payloads("line1", "line2"), None)],
+        [("YYY", "/other", _payloads("line3"), None)],
+    ]
+    stats = instance.stats()
+    assert stats["segments"] == 2
+    assert stats["appended_lines"] == 3
+    assert stats["bytes"] == sum(os.path.getsize(path) for path in paths)
+
+    # a new spool continues after the existing segments
+    assert Spool(directory).sequence == 2
+
+
+def test_envelopes(tmp_path):
+    instance = Spool(str(tmp_path))
+    envelopes = [(None, "stdout", "line1")]
+    instance.append("XXX", "/test", _payloads("line1"), envelopes)
+    assert list(Spool.read(instance.segments(seal=True)[0])) == \
+        [("XXX", "/test", _payloads("line1"), envelopes)]
+
+
+def test_damaged_record(tmp_path):
+    instance = Spool(str(tmp_path), fsync=spool.FSYNC_ALWAYS)
+    instance.append("XXX", "/test", _payloads("line1"))
+    instance.append("XXX", "/test", _payloads("line2"))
+    path = instance.segments(seal=True)[0]
+    with open(path, "r+b") as filp:
+        filp.truncate(os.path.getsize(path) - 1)
+    assert list(Spool.read(path)) == \
+        [("XXX", "/test", _payloads("line1"), None)]
+
+
+def test_full(tmp_path):
+    instance = Spool(str(tmp_path), max_bytes=10)
+    # a batch over the cap still goes into an empty spool
+    instance.append("XXX", "/test", _payloads("line1"))
+    with pytest.raises(spool.SpoolFull):
+        instance.append("XXX", "/test", _payloads("line2"), timeout=0.01)
+    assert instance.stats()["full_waits"] == 1
+
+    with pytest.raises(ValueError):
+        Spool(str(tmp_path), fsync="sometimes")
+
+
+def test_drainer(session, tmp_path):
+    instance = Spool(str(tmp_path / "spool"), max_age=0)
+    instance.append("XXX", "/test", _payloads("line1", "line2"))
+    instance.append("YYY", "/other", _payloads("line3"))
+
+    drainer = Drainer(instance, ENGINE, InsertSink())
+    assert drainer.drain() == 3
+    assert instance.segments() == []
+    stats = instance.stats()
+    assert stats["bytes"] == 0
+    assert stats["drained_batches"] == 2
+
+    logs = session.query(models.Log).order_by(models.Log.id).all()
+    assert [(log.container_id, log.message) for log in logs] == [
+        ("XXX", "line1"), ("XXX", "line2"), ("YYY", "line3")
+    ]
+
+    instance.close()
+    assert not os.path.exists(instance.directory)
+
+
+def test_segments_age(tmp_path):
+    instance = Spool(str(tmp_path), max_age=60)
+    instance.append("XXX", "/test", _payloads("line1"))
+    instance.append("XXX", "/test", _payloads("line2"))
+    # the batches go to the same segment, which isn't drained yet
+    assert instance.segments() == []
+    assert not instance.wait(0.01)
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    instance.max_age = 0.05
+    assert instance.wait(5)
+    paths = instance.segments()
+    assert len(paths) == 1
+    assert len(list(Spool.read(paths[0]))) == 2
+
+
+def test_drainer_quarantine(session, tmp_path, mocker):
+    instance = Spool(str(tmp_path / "spool"), segment_size=1)
+    instance.append("XXX", "/test", _payloads("line1"))
+    instance.append("YYY", "/other", _payloads("line2"))
+    assert metrics.SPOOL_SEGMENTS.values[("spool",)] == 2
+
+    sink = InsertSink()
+    write = sink.write
+
+    def _write(connection, container_id, *args):
+        if container_id == "XXX":
+            raise sqlalchemy.exc.DataError("INSERT", {}, Exception("bad"))
+        return write(connection, container_id, *args)
+
+    mocker.patch.object(sink, "write", side_effect=_write)
+    drainer = Drainer(instance, ENGINE, sink)
+    assert drainer.drain() == 1
+    assert sorted(os.listdir(instance.directory)) == \
+        ["{:016d}.seg.bad".format(0)]
+    assert instance.stats()["quarantined"] == 1
+    assert metrics.SPOOL_SEGMENTS.values[("spool",)] == 0
+    assert metrics.SPOOL_BYTES.values[("spool",)] == 0
+
+    logs = session.query(models.Log).all()
+    assert [log.message for log in logs] == ["line2"]
+
+    instance.close()
+    assert ("spool",) not in metrics.SPOOL_BYTES.values
+
+
+def test_spool_from_settings(mocker, tmp_path):
+    mocker.patch.object(spool.settings, "SPOOL_DIR", "")
+    assert spool.spool_from_settings("engine") is None
+
+    mocker.patch.object(spool.settings, "SPOOL_DIR", str(tmp_path))
+    instance = spool.spool_from_settings("engine")
+    assert instance.directory == str(tmp_path / "engine")
+    assert instance.max_bytes == spool.settings.SPOOL_MAX_BYTES
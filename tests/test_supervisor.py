@@ -0,0 +1,113 @@
+import pytest
+
+from logsql import supervisor
+from logsql.supervisor import Supervisor
+
+
+class Process:
+    def __init__(self):
+        self.returncode = None
+        self.terminated = False
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+
+
+@pytest.fixture(name="clock")
+def clock_fixture(mocker):
+    clock = mocker.patch.object(supervisor.time, "monotonic")
+    clock.return_value = 1000.0
+    return clock
+
+
+def _supervisor(progress=None):
+    spawned = []
+
+    def _spawn(container_id):
+        process = Process()
+        spawned.append((container_id, process))
+        return process
+
+    clients = {}
+    instance = Supervisor(
+        clients, _spawn, progress=progress,
+        min_backoff=1, max_backoff=10, stall_checks=2
+    )
+    return instance, clients, spawned
+
+
+def test_supervisor_restart(clock):
+    instance, clients, spawned = _supervisor()
+    instance.start("XXX")
+    assert len(spawned) == 1
+
+    process = clients["XXX"]
+    process.returncode = 1
+    instance.check()
+    assert instance.children["XXX"].failures == 1
+    instance.check()
+    assert len(spawned) == 1
+
+    clock.return_value += 1
+    instance.check()
+    assert len(spawned) == 2
+    assert clients["XXX"] is not process
+
+    # fails again right away: the backoff doubles
+    clients["XXX"].returncode = 1
+    instance.check()
+    assert instance.children["XXX"].restart_at == clock.return_value + 2
+
+    assert instance.backoff(10) == 10
+
+
+def test_supervisor_backoff_reset(clock):
+    instance, clients, _ = _supervisor()
+    instance.start("XXX")
+    instance.children["XXX"].failures = 5
+
+    clock.return_value += 60
+    clients["XXX"].returncode = 1
+    instance.check()
+    assert instance.children["XXX"].failures == 1
+
+
+def test_supervisor_exited(clock):
+    instance, clients, _ = _supervisor()
+    instance.start("XXX")
+    clients["XXX"].returncode = 0
+    instance.check()
+    assert "XXX" not in clients
+    assert "XXX" not in instance.children
+
+
+def test_supervisor_remove(clock):
+    instance, clients, _ = _supervisor()
+    instance.start("XXX")
+    process = clients["XXX"]
+    instance.remove("XXX")
+    assert process.terminated
+    assert not clients
+    instance.remove("XXX")
+
+
+def test_supervisor_stalled(clock):
+    progress = {"XXX": (10, 10)}
+    instance, clients, _ = _supervisor(progress=progress.get)
+    instance.start("XXX")
+    clients["YYY"] = Process()
+
+    instance.check()
+    progress["XXX"] = (20, 10)
+    instance.check()
+    assert instance.stalled() == []
+    progress["XXX"] = (30, 10)
+    instance.check()
+    assert instance.stalled() == ["XXX"]
+
+    progress["XXX"] = (30, 30)
+    instance.check()
+    assert instance.stalled() == []
@@ -0,0 +1,109 @@
+import pytest
+
+from logsql import transform
+from logsql.transform import Batch, Enrich, Filter, Map, Registry
+
+INFO = {
+    "Name": "/web-1",
+    "Config": {"Image": "nginx:1.19", "Labels": {"tier": "frontend"}},
+}
+
+
+@pytest.fixture(name="registry")
+def registry_fixture(mocker):
+    registry = Registry()
+    mocker.patch.object(transform, "REGISTRY", registry)
+    mocker.patch.object(transform.settings, "TRANSFORMS", "")
+    return registry
+
+
+def test_steps():
+    records = [{"log": "a", "stream": "stdout"}, {"log": "b", "stream": "x"}]
+    pipeline = transform.Pipeline(INFO, [
+        Filter(lambda data: data["stream"] == "stdout").bind(INFO),
+        Map(lambda data: dict(data, log=data["log"].upper())).bind(INFO),
+        Enrich(lambda info: {"image": info["Config"]["Image"]}).bind(INFO),
+        Batch(lambda info, records: records * 2).bind(INFO),
+    ])
+    assert not pipeline.identity
+    assert pipeline(records) == [
+        {"log": "A", "stream": "stdout", "image": "nginx:1.19"},
+    ] * 2
+
+
+def test_pipeline_stops_when_empty(mocker):
+    after = mocker.Mock()
+    pipeline = transform.Pipeline(INFO, [lambda records: [], after])
+    assert pipeline([{"log": "a"}]) == []
+    assert not after.called
+    assert transform.Pipeline(INFO).identity
+
+
+@pytest.mark.parametrize("kwargs, matches", [
+    ({}, True),
+    ({"name": "web-*"}, True),
+    ({"name": "/web-1"}, True),
+    ({"name": "db"}, False),
+    ({"image": "nginx*"}, True),
+    ({"image": "postgres*"}, False),
+    ({"label": "tier"}, True),
+    ({"label": "tier=frontend"}, True),
+    ({"label": "tier=backend"}, False),
+    ({"label": "other"}, False),
+    ({"name": "web-*", "image": "postgres*"}, False),
+])
+def test_rule_matches(kwargs, matches):
+    assert transform.Rule([], **kwargs).matches(INFO) is matches
+
+
+def test_registry(registry):
+    def _legacy(container_name, data):
+        assert container_name == "/web-1"
+        return data if data["log"] != "drop" else None
+
+    registry.register(Enrich({"first": True}), image="nginx*")
+    registry.register(Enrich({"never": True}), image="postgres*")
+    registry.register(_legacy)
+
+    records = [{"log": "keep"}, {"log": "drop"}]
+    assert transform.transform_batch(INFO, records) == [
+        {"log": "keep", "first": True}
+    ]
+
+    registry.clear()
+    assert transform.compile_pipeline(INFO).identity
+
+
+def test_load_plugins(mocker):
+    import_module = mocker.patch.object(transform.importlib, "import_module")
+    mocker.patch.object(transform, "_LOADED", set())
+    transform.load_plugins(" plugins.a,plugins.b ,")
+    transform.load_plugins("plugins.a")
+    assert [call[0][0] for call in import_module.call_args_list] == [
+        "plugins.a", "plugins.b"
+    ]
+
+
+def test_parse(registry):
+    line = '1.1.1.1 - - [17/Aug/2019:23:18:39 +0000] "GET / HTTP/1.1" 200 5' \
+        ' "-" "curl"\n'
+    records = [{"log": line}, {"log": "starting\n"}, {"stream": "stdout"}]
+    parse = transform.Parse("nginx_combined", target="http").bind(INFO)
+    result = parse([dict(data) for data in records])
+    assert result[0]["http"]["status"] == 200
+    assert result[1:] == records[1:]
+
+    registry.register(transform.Parse("nginx_combined", drop=True))
+    assert transform.transform_batch(INFO, records)[0]["status"] == 200
+    assert len(transform.transform_batch(INFO, records)) == 1
+
+
+def test_parse_label(registry):
+    info = {"Name": "/app", "Config": {"Labels": {"logsql.parse": "logfmt"}}}
+    pipeline = transform.compile_pipeline(info)
+    assert pipeline([{"log": "level=warn\n"}]) == [
+        {"log": "level=warn\n", "level": "warn"}
+    ]
+
+    info["Config"]["Labels"]["logsql.parse"] = "unknown"
+    assert transform.compile_pipeline(info).identity
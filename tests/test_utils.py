@@ -1,3 +1,5 @@
+import datetime
+
 from logsql import utils
 
 
@@ -25,3 +27,15 @@ def test_nginx_log():
 def test_nginx_log_no_match():
     line = "BAD LOG LINE"
     assert utils.parse_nginx_combined(line) is None
+
+
+def test_parse_docker_time():
+    utc = datetime.timezone.utc
+    assert utils.parse_docker_time("2020-03-01T13:45:12.123456789Z") == \
+        datetime.datetime(2020, 3, 1, 13, 45, 12, 123456, tzinfo=utc)
+    assert utils.parse_docker_time("2020-03-01T13:45:12Z") == \
+        datetime.datetime(2020, 3, 1, 13, 45, 12, tzinfo=utc)
+    assert utils.parse_docker_time("2020-03-01T14:45:12.5+01:00") == \
+        datetime.datetime(2020, 3, 1, 13, 45, 12, 500000, tzinfo=utc)
+    assert utils.parse_docker_time("2020-03-01 13:45") is None
+    assert utils.parse_docker_time(None) is None
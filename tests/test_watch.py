@@ -0,0 +1,158 @@
+import os
+import time
+
+from logsql import watch
+from logsql.logpath import LogPath
+
+from . import utils
+
+PATH = "/tmp/test.log"
+
+
+def test_inotify_waiter_modify():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    waiter = watch.InotifyWaiter(PATH)
+    try:
+        with open(PATH, "a") as filp:
+            print("line2", file=filp)
+        start = time.monotonic()
+        waiter.wait(5)
+        assert time.monotonic() - start < 1
+        assert not waiter.rotated()
+    finally:
+        waiter.close()
+
+
+def test_inotify_waiter_rotation():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    waiter = watch.InotifyWaiter(PATH)
+    try:
+        os.rename(PATH, PATH + ".1")
+        with open(PATH, "w") as filp:
+            print("line2", file=filp)
+        waiter.wait(5)
+        assert waiter.rotated()
+        assert not waiter.rotated()
+
+        waiter.rewatch()
+        with open(PATH, "a") as filp:
+            print("line3", file=filp)
+        waiter.wait(5)
+        assert not waiter.rotated()
+    finally:
+        waiter.close()
+        os.remove(PATH + ".1")
+
+
+def test_inotify_waiter_timeout():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    waiter = watch.InotifyWaiter(PATH)
+    try:
+        waiter.wait(0.01)
+        assert not waiter.rotated()
+        assert waiter.delay(3) == 3
+    finally:
+        waiter.close()
+
+
+def test_poll_waiter():
+    waiter = watch.PollWaiter(PATH, min_interval=0.1)
+    assert waiter.fileno() is None
+    assert waiter.rotated()
+    assert waiter.delay(1) == 0.1
+    assert waiter.delay(1) == 0.2
+    assert waiter.delay(1) == 0.4
+    assert waiter.delay(1) == 0.8
+    assert waiter.delay(1) == 1
+    waiter.reset()
+    assert waiter.delay(1) == 0.1
+
+
+def test_create_waiter_fallback(mocker):
+    utils.cleanup(PATH)
+    mocker.patch.object(
+        watch.Inotify, "add_watch", side_effect=OSError(28, "No space")
+    )
+    waiter = watch.create_waiter(PATH)
+    assert isinstance(waiter, watch.PollWaiter)
+
+
+def test_logpath_waiter_rotation():
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    logpath = LogPath(PATH, waiter=watch.create_waiter(PATH))
+    assert logpath.readline() == "line1"
+    assert logpath.readline() is None
+
+    os.remove(PATH)
+    with open(PATH, "w") as filp:
+        print("line2", file=filp)
+
+    logpath.wait(5)
+    assert logpath.readline() == "line2"
+    logpath.commit()
+    assert logpath.offsetfile.offset == 6
+    logpath.close()
+
+
+def test_inotify_waiter_overflow(mocker):
+    utils.cleanup(PATH)
+    with open(PATH, "w") as filp:
+        print("line1", file=filp)
+
+    waiter = watch.InotifyWaiter(PATH)
+    try:
+        mocker.patch.object(
+            waiter.hub.inotify, "read",
+            return_value=[(-1, watch.IN_Q_OVERFLOW, "")]
+        )
+        waiter.drain()
+        # a dropped rotation must still be looked for
+        assert waiter.rotated()
+    finally:
+        waiter.close()
+
+
+def test_inotify_waiter_shared():
+    other = PATH + ".other"
+    utils.cleanup(PATH)
+    utils.cleanup(other)
+    for path in (PATH, other):
+        with open(path, "w") as filp:
+            print("line1", file=filp)
+
+    waiter = watch.InotifyWaiter(PATH)
+    waiter2 = watch.InotifyWaiter(other)
+    try:
+        assert waiter.hub is waiter2.hub
+        assert waiter.fileno() == waiter2.fileno()
+
+        os.remove(other)
+        waiter.wait(5)
+        assert not waiter.rotated()
+        # dispatched to the other waiter
+        assert waiter2.pending
+        assert waiter2.rotated()
+
+        # the directory watch is shared, but still held by waiter
+        waiter2.close()
+        with open(PATH, "a") as filp:
+            print("line2", file=filp)
+        waiter.wait(5)
+        os.rename(PATH, PATH + ".1")
+        waiter.wait(5)
+        assert waiter.rotated()
+    finally:
+        waiter.close()
+        utils.cleanup(PATH + ".1")
@@ -0,0 +1,191 @@
+import json
+import time
+import queue
+
+from logsql import metrics, models, workers
+from logsql.workers import HashRing, WorkerPool
+
+from . import utils
+
+PATH = "/tmp/test.log"
+
+
+def _write_lines(*lines):
+    with open(PATH, "a") as filp:
+        for line in lines:
+            print(json.dumps({"log": line + "\n", "stream": "stderr"}),
+                  file=filp)
+
+
+def _wait_for(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(.05)
+    return False
+
+
+def test_hash_ring():
+    ring = HashRing(range(4))
+    keys = ["container-{}".format(i) for i in range(1000)]
+    owners = {key: ring.node(key) for key in keys}
+
+    counts = [list(owners.values()).count(node) for node in range(4)]
+    assert min(counts) > 150
+
+    # only the keys of the new node move
+    ring.add(4)
+    moved = [key for key in keys if ring.node(key) != owners[key]]
+    assert all(ring.node(key) == 4 for key in moved)
+    assert 100 < len(moved) < 300
+
+    ring.remove(4)
+    assert {key: ring.node(key) for key in keys} == owners
+
+
+def test_worker_pool(session):
+    utils.cleanup(PATH)
+    _write_lines("line1", "line2")
+
+    def _logs(count):
+        session.rollback()
+        return session.query(models.Log).count() >= count
+
+    pool = WorkerPool(2)
+    pool.start()
+    try:
+        tailer = pool.add_container(
+            "XXX", {"Name": "/test", "LogPath": PATH}
+        )
+        assert _wait_for(lambda: _logs(2))
+        assert tailer.poll() is None
+        owner = pool.assigned["XXX"]
+        assert _wait_for(lambda: pool.load()[owner]["lines"] == 2)
+        assert pool.load()[owner]["containers"] == 1
+
+        # moving the container to another worker resumes at its checkpoint
+        pool.ring.remove(owner)
+        pool.resize(pool.size)
+        assert _wait_for(lambda: pool.assigned["XXX"] != owner)
+        _write_lines("line3")
+        assert _wait_for(lambda: _logs(3))
+
+        tailer.terminate()
+        assert "XXX" not in pool.assigned
+    finally:
+        pool.stop()
+
+    logs = session.query(models.Log).all()
+    assert [log.json["log"] for log in logs] == [
+        "line1\n", "line2\n", "line3\n"
+    ]
+
+
+def test_worker_pool_exited(session):
+    utils.cleanup(PATH)
+    pool = WorkerPool(1)
+    pool.start()
+    try:
+        tailer = pool.add_container(
+            "XXX", {"Name": "/test", "LogPath": PATH}
+        )
+        assert _wait_for(lambda: tailer.poll() is not None)
+    finally:
+        pool.stop()
+    assert tailer.poll() == 1
+    assert "XXX" not in pool.assigned
+
+
+def test_worker_main_remove(mocker):
+    for name in ("metrics", "db", "store_from_settings", "spool_from_settings"):
+        mocker.patch.object(workers, name)
+    engine = mocker.patch.object(workers, "Engine").return_value
+    engine.lines_written = 0
+    tailer = engine.add_container.return_value
+    tailer.poll.return_value = None
+
+    def _terminate():
+        tailer.poll.return_value = 0
+
+    tailer.terminate.side_effect = _terminate
+
+    commands = queue.Queue()
+    events = mocker.Mock()
+    # the checkpoint is written before the new owner is told to resume
+    events.put.side_effect = \
+        lambda _: engine.checkpoints.flush.assert_called_once_with()
+    commands.put(("add", "XXX", {"Name": "/test", "LogPath": PATH}))
+    commands.put(("remove", "XXX"))
+    commands.put(("stop",))
+    workers.worker_main(0, commands, events, [0, 0], 100, False)
+
+    events.put.assert_called_once_with(("removed", 0, "XXX", None))
+    tailer.terminate.assert_called_once_with()
+
+
+def test_worker_pool_check_moving(mocker):
+    pool = WorkerPool(2)
+    pool.processes = [
+        mocker.Mock(is_alive=lambda: False), mocker.Mock(is_alive=lambda: True)
+    ]
+    pool.commands = [mocker.Mock(), mocker.Mock()]
+    pool.stats = [None, None]
+    mocker.patch.object(pool, "context")
+    mocker.patch.object(pool, "_start_worker")
+    pool.infos["XXX"] = {"Name": "/test", "LogPath": PATH}
+    pool.assigned["XXX"] = 0
+    # worker 0 died before letting go of the container
+    pool.moving["XXX"] = 1
+
+    pool.check()
+    assert pool.commands[0] is pool.context.Queue.return_value
+    # only added to its new owner, not to the restarted worker too
+    pool.commands[0].put.assert_not_called()
+    pool.commands[1].put.assert_called_once_with(
+        ("add", "XXX", pool.infos["XXX"])
+    )
+    assert pool.assigned == {"XXX": 1}
+    assert pool.moving == {}
+
+
+def test_worker_pool_resize(session):
+    utils.cleanup(PATH)
+    _write_lines("line1")
+
+    def _logs(count):
+        session.rollback()
+        return session.query(models.Log).count() >= count
+
+    pool = WorkerPool(1)
+    pool.start()
+    try:
+        pool.add_container("XXX", {"Name": "/test", "LogPath": PATH})
+        assert _wait_for(lambda: _logs(1))
+
+        pool.resize(3)
+        assert len(pool.processes) == len(pool.commands) == 3
+        assert [load["worker"] for load in pool.load()] == [0, 1, 2]
+        owner = pool.ring.node("XXX")
+        assert _wait_for(lambda: pool.assigned.get("XXX") == owner)
+        _write_lines("line2")
+        assert _wait_for(lambda: _logs(2))
+        assert _wait_for(lambda: pool.load()[owner]["containers"] == 1)
+        assert metrics.WORKER_CONTAINERS.snapshot()["values"][owner] == \
+            [[str(owner)], 1.0]
+
+        removed = pool.processes[1:]
+        pool.resize(1)
+        assert not any(process.is_alive() for process in removed)
+        assert len(pool.processes) == len(pool.stats) == 1
+        assert _wait_for(lambda: pool.assigned.get("XXX") == 0)
+        _write_lines("line3")
+        assert _wait_for(lambda: _logs(3))
+        assert len(metrics.WORKER_CONTAINERS.snapshot()["values"]) == 1
+    finally:
+        pool.stop()
+
+    logs = session.query(models.Log).all()
+    assert [log.json["log"] for log in logs] == [
+        "line1\n", "line2\n", "line3\n"
+    ]